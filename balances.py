@@ -0,0 +1,125 @@
+# balances.py — Saldos de tokens por ATA derivada (sin escanear todas las cuentas de la wallet)
+# - ATA por (owner, mint) derivada localmente y cacheada
+# - Programa (Token / Token-2022) y decimales del mint cacheados tras la primera consulta
+# - Varios mints en un solo getMultipleAccounts: amount raw (u64 @64) + decimales (u8 @44 del mint)
+# - tenencias(): inventario completo de la wallet (modo batch de salida_forzada)
+# Usado por swap_real, salida_forzada y el trader (suscripción a la ATA).
+
+import threading
+from base64 import b64decode
+
+from solders.pubkey import Pubkey
+
+import swap_exec
+from config import wallet_pubkey
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+TOKEN_PROGRAM      = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+TOKEN_2022_PROGRAM = "TokenzQdBNbLqP5VEhdkAS6EPFLC1PE9qDgsqe3J7Z1"
+ATA_PROGRAM        = "ATokenGPvbdGVxL1cYRLd6Cj4EGsbq8rJ4Z9GeMqEjv"
+
+OFF_AMOUNT   = 64   # token account: mint(32) + owner(32) + amount(u64)
+OFF_DECIMALS = 44   # mint: option(4) + authority(32) + supply(u64) + decimals(u8)
+
+_ata_cache = {}     # (owner, mint, program) -> str
+_mint_info = {}     # mint -> (program, decimals)
+_lock = threading.Lock()
+
+def ata(mint: str, owner=None, program: str | None = None) -> str:
+    """Dirección de la associated token account (derivación local, cacheada)."""
+    owner = str(owner or wallet_pubkey)
+    program = program or (_mint_info.get(str(mint)) or (TOKEN_PROGRAM,))[0]
+    key = (owner, str(mint), program)
+    addr = _ata_cache.get(key)
+    if addr is None:
+        addr = str(Pubkey.find_program_address(
+            [bytes(Pubkey.from_string(owner)), bytes(Pubkey.from_string(program)), bytes(Pubkey.from_string(str(mint)))],
+            Pubkey.from_string(ATA_PROGRAM),
+        )[0])
+        with _lock:
+            _ata_cache[key] = addr
+    return addr
+
+def monto_raw(acc) -> int:
+    if not acc:
+        return 0
+    data = b64decode(acc["data"][0])
+    return int.from_bytes(data[OFF_AMOUNT:OFF_AMOUNT + 8], "little") if len(data) >= OFF_AMOUNT + 8 else 0
+
+def _accounts(addrs, commitment):
+    res = swap_exec.rpc("getMultipleAccounts", [addrs, {"encoding": "base64", "commitment": commitment}], timeout=3.0)
+    return (res or {}).get("value") or [None] * len(addrs)
+
+def balances_raw(mints, owner=None, commitment="processed") -> dict:
+    """{mint: (raw, decimals)} con un getMultipleAccounts (más uno la primera vez si hay mints Token-2022)."""
+    mints = [str(m) for m in mints]
+    nuevos = [m for m in mints if m not in _mint_info]
+    addrs = [ata(m, owner) for m in mints] + nuevos
+    with swap_exec.stage("balances", n=len(mints), nuevos=len(nuevos)):
+        vals = _accounts(addrs, commitment)
+
+    for m, acc in zip(nuevos, vals[len(mints):]):
+        if acc and acc.get("owner") in (TOKEN_PROGRAM, TOKEN_2022_PROGRAM):
+            data = b64decode(acc["data"][0])
+            with _lock:
+                _mint_info[m] = (acc["owner"], data[OFF_DECIMALS] if len(data) > OFF_DECIMALS else None)
+
+    out = {}
+    reintentar = []
+    for m, acc in zip(mints, vals[:len(mints)]):
+        prog, dec = _mint_info.get(m, (TOKEN_PROGRAM, None))
+        if m in nuevos and prog == TOKEN_2022_PROGRAM:
+            reintentar.append(m)   # la ATA consultada era la del programa clásico
+            continue
+        out[m] = (monto_raw(acc), dec)
+
+    if reintentar:
+        for m, acc in zip(reintentar, _accounts([ata(m, owner) for m in reintentar], commitment)):
+            out[m] = (monto_raw(acc), _mint_info[m][1])
+
+    emit("balances_ok", n=len(mints), nonzero=sum(1 for v in out.values() if v[0] > 0))
+    return out
+
+def balance(mint: str, owner=None, commitment="processed"):
+    """(raw, ui, decimals) del mint en la ATA del owner."""
+    raw, dec = balances_raw([mint], owner, commitment)[str(mint)]
+    ui = raw / (10 ** dec) if dec else float(raw)
+    return raw, ui, dec
+
+def tenencias(owner=None, commitment="confirmed") -> dict:
+    """{mint: (raw, decimals)} de todo lo que tiene la wallet (>0), Token y Token-2022. Solo para inventario."""
+    owner = str(owner or wallet_pubkey)
+    out = {}
+    with swap_exec.stage("holdings"):
+        for prog in (TOKEN_PROGRAM, TOKEN_2022_PROGRAM):
+            res = swap_exec.rpc("getTokenAccountsByOwner", [owner, {"programId": prog},
+                                {"encoding": "jsonParsed", "commitment": commitment}], timeout=8.0)
+            for acc in (res or {}).get("value") or []:
+                info = (((acc.get("account") or {}).get("data") or {}).get("parsed") or {}).get("info") or {}
+                ta = info.get("tokenAmount") or {}
+                mint, raw = info.get("mint"), int(ta.get("amount") or 0)
+                if mint and raw > 0:
+                    prev = out.get(mint, (0, None))[0]
+                    out[mint] = (prev + raw, ta.get("decimals"))
+                    with _lock:
+                        _mint_info.setdefault(mint, (prog, ta.get("decimals")))
+    emit("holdings_ok", n=len(out))
+    return out
+
+def programa(mint: str) -> str:
+    """Token program del mint (Token / Token-2022), cacheado; clásico si aún no se conoce."""
+    if str(mint) not in _mint_info:
+        balances_raw([mint])
+    return (_mint_info.get(str(mint)) or (TOKEN_PROGRAM,))[0]
+
+def decimales(mint: str):
+    """Decimales del mint (cacheados; consulta el mint si no se conocen)."""
+    if str(mint) not in _mint_info:
+        balances_raw([mint])
+    return (_mint_info.get(str(mint)) or (None, None))[1]
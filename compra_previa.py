@@ -0,0 +1,124 @@
+# compra_previa.py — Compra especulativa: preparación en la confirmación CONF_TICKS-1 (antes de la señal)
+# - preparar(): quote + /swap USDC y SOL en paralelo (sin firmar ni enviar) y spool en disco con timestamp
+# - tomar(): el trader consume la preparación una sola vez si está fresca (TTL + desvío de precio acotado)
+# - descartar(): la señal no confirmó → se borra; coste = solo cuota de quote/swap
+# - La TX preparada se simula igual en el envío (swap_exec.ajustar_cu): una ruta ya inválida no sale
+# Usado por main_master (preparar / descartar) y el trader (tomar).
+
+import os, json, time, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import compra_swap_usdc, compra_swap_sol
+from config import AMOUNT_USDC
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+SPOOL_DIR       = os.getenv("APOLLO_PREP_SPOOL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "compra_spool"))
+MONTO_USDC      = AMOUNT_USDC     # mismo monto que el trader (config)
+TTL_S           = float(os.getenv("APOLLO_PREP_TTL", "6.0"))     # ~ 2 polls + arranque del trader
+DESVIO_MAX_BPS  = 50      # precio de entrada vs precio al preparar; más → la quote ya no representa el pool
+
+_en_curso = set()
+_lock = threading.Lock()
+
+def _ruta(address: str) -> str:
+    return os.path.join(SPOOL_DIR, f"{address}.json")
+
+def _serializable(prep: dict) -> dict:
+    # 'tx' (TxCruda) y 'difusion' son objetos en memoria; el envío los reconstruye desde swap_json
+    return {k: v for k, v in prep.items() if k not in ("tx", "difusion")}
+
+# ===== Orquestador =====
+def _preparar(address: str, px_usd: float, sol_usd: float | None):
+    t0 = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            fu = ex.submit(compra_swap_usdc.preparar_compra_usdc, address, int(round(MONTO_USDC * 1_000_000)))
+            fs = ex.submit(compra_swap_sol.preparar_compra_sol, address, MONTO_USDC, sol_usd or None)
+            preps = {}
+            for base, f in (("USDC", fu), ("SOL", fs)):
+                try:
+                    p = f.result()
+                except Exception as e:
+                    emit("buy_prep_leg_error", mint=address, base=base, err=str(e))
+                    p = None
+                if p and p.get("out_raw", 0) > 0 and p.get("in_usd", 0) > 0:
+                    preps[base] = _serializable(p)
+        if not preps:
+            emit("buy_prep_empty", mint=address, dt_ms=int((time.monotonic() - t0) * 1000))
+            return
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        tmp = _ruta(address) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"ts": time.time(), "address": address, "monto": MONTO_USDC,
+                       "px_usd": px_usd, "preps": preps}, f)
+        os.replace(tmp, _ruta(address))
+        emit("buy_prep_ready", mint=address, bases=list(preps), dt_ms=int((time.monotonic() - t0) * 1000))
+    except Exception as e:
+        emit("buy_prep_error", mint=address, err=str(e))
+    finally:
+        with _lock:
+            _en_curso.discard(address)
+
+def preparar(address: str, px_usd: float, sol_usd: float | None = None) -> bool:
+    """Lanza la preparación en segundo plano (una por mint a la vez). False si ya había una en curso."""
+    with _lock:
+        if address in _en_curso:
+            return False
+        _en_curso.add(address)
+    threading.Thread(target=_preparar, args=(address, float(px_usd), sol_usd), daemon=True).start()
+    return True
+
+def descartar(address: str):
+    try:
+        os.remove(_ruta(address))
+        emit("buy_prep_discarded", mint=address)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        emit("buy_prep_error", mint=address, err=str(e))
+
+# ===== Trader =====
+def tomar(address: str, px_usd: float | None = None, monto: float = MONTO_USDC):
+    """
+    Preparaciones {base: prep} listas para enviar_compra_*, o None si no hay, venció el TTL,
+    cambió el monto o el precio se movió más de DESVIO_MAX_BPS. Se consumen una sola vez.
+    """
+    path = _ruta(address)
+    tomado = path + ".tomado"
+    try:
+        os.replace(path, tomado)          # consumo atómico frente a una escritura tardía del orquestador
+    except FileNotFoundError:
+        return None
+    try:
+        with open(tomado, "r", encoding="utf-8") as f:
+            d = json.load(f)
+    except Exception as e:
+        emit("buy_prep_error", mint=address, err=str(e))
+        return None
+    finally:
+        try: os.remove(tomado)
+        except Exception: pass
+
+    edad = time.time() - float(d.get("ts") or 0)
+    motivo = None
+    if d.get("address") != address:
+        motivo = "mint"
+    elif edad > TTL_S:
+        motivo = "ttl"
+    elif abs(float(d.get("monto") or 0) - float(monto)) > 1e-9:
+        motivo = "monto"
+    elif px_usd and d.get("px_usd"):
+        desvio = abs(float(px_usd) / float(d["px_usd"]) - 1) * 10_000
+        if desvio > DESVIO_MAX_BPS:
+            motivo = f"desvio_{int(desvio)}bps"
+    if motivo:
+        emit("buy_prep_stale", mint=address, reason=motivo, age_ms=int(edad * 1000))
+        return None
+    emit("buy_prep_used", mint=address, bases=list(d["preps"]), age_ms=int(edad * 1000))
+    return d["preps"]
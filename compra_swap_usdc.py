@@ -1,22 +1,20 @@
 # compra_swap_usdc.py — VIP-only: USDC->TOKEN hop=1 (ExactIn), optimizado + observabilidad
 # Mantiene:
-# - Intentos ma={64,56,48}, hop=1 real, filtro label, minOut estricto, dynamicSlippage=False
-# - quote timeout=6s, swap timeout=12s, fee ≤45 bps, TX ≤1300B/≤1800b64
-# - HTTP keep-alive, retries + RPC fallback
+# - Intentos ma={64,56,48} ordenados/recortados por rutas_stats (quote y /swap en pipeline: gana la primera TX válida), hop=1 real, filtro label, minOut estricto, dynamicSlippage=False
+# - quote timeout=6s, swap timeout=12s, fee ≤45 bps, TX v0 (ALTs) ≤1232B
+# - HTTP/RPC vía swap_exec (pool compartido); envío difundido a todos los RPC hasta confirmar/expirar
+# - CU price por priority_fees (perfil entry, ajustado por latencia de aterrizaje)
 # Añadido:
 # - Telemetría granular: inicio, quote_ok/err, filtros, swap_req/err, tx_sent, excepción, métricas de tiempo
 
 import sys, os, json, time, sqlite3
-import requests
-from base64 import b64decode
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from solana.transaction import Transaction
-from solana.rpc.types import TxOpts
-from solana.rpc.api import Client
 
+import swap_exec
+import priority_fees
+import rutas_stats
+import tx_codec
 from config import (
-    client, keypair, wallet_pubkey,
-    JUPITER_API_KEY, QUOTE_URL, SWAP_URL,
+    wallet_pubkey,
     DB_NAME, AMOUNT_LAMPORTS as CFG_AMOUNT_LAMPORTS
 )
 
@@ -33,65 +31,9 @@ def dbg(*a):
     if DEBUG:
         print("🧪", *a)
 
-# ===== HTTP session (keep-alive) =====
-_SES = requests.Session()
-try:
-    from requests.adapters import HTTPAdapter
-    _SES.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=12, max_retries=0))
-    _SES.mount("http://",  HTTPAdapter(pool_connections=4, pool_maxsize=12, max_retries=0))
-except Exception:
-    pass
-_SES.headers.update({"Accept": "application/json", "Connection": "keep-alive"})
-
-def http_get(url, headers=None, params=None, timeout=10):
-    r = _SES.get(url, headers=headers or {}, params=params or {}, timeout=timeout)
-    dbg("GET", r.status_code, url)
-    if r.status_code >= 400:
-        dbg("RESP", (r.text or "")[:700])
-    return r
-
-def http_post(url, headers=None, json_body=None, timeout=15):
-    r = _SES.post(url, headers=headers or {}, json=json_body or {}, timeout=timeout)
-    dbg("POST", r.status_code, url)
-    if r.status_code >= 400:
-        dbg("RESP", (r.text or "")[:700])
-    return r
-
-# --- Envío robusto con retries y RPCs de respaldo ---
-FALLBACK_RPC_URLS = ["https://api.mainnet-beta.solana.com"]
-
-def _rpc_name(cli: Client):
-    for attr in ("endpoint_uri", "endpoint"):
-        v = getattr(cli, attr, None)
-        if v: return v
-    prov = getattr(cli, "_provider", None)
-        # pragma: no cover
-    if prov is not None:
-        return getattr(prov, "endpoint_uri", "unknown")
-    return "unknown"
-
-def send_with_retries(tx_bytes, primary_client: Client, label="[SEND]"):
-    opts_list = [
-        TxOpts(skip_preflight=False, preflight_commitment="confirmed", max_retries=2),
-        TxOpts(skip_preflight=True,  preflight_commitment="processed", max_retries=4),
-    ]
-    clients = [primary_client] + [Client(u) for u in FALLBACK_RPC_URLS]
-    last_err = None
-    for cli in clients:
-        for opts in opts_list:
-            try:
-                print(f"{label} rpc={_rpc_name(cli)} skip_preflight={opts.skip_preflight}")
-                return cli.send_raw_transaction(tx_bytes, opts=opts)
-            except Exception as e:
-                last_err = e
-                emit("tx_send_error_try", rpc=_rpc_name(cli), skip_preflight=bool(opts.skip_preflight), err=str(e))
-                time.sleep(0.20)
-    if last_err:
-        raise last_err
-
 # --- Guard-rails tamaño/fees ---
-MAX_RAW_BYTES = 1300
-MAX_B64_LEN   = 1800
+MAX_RAW_BYTES = swap_exec.PACKET_DATA_SIZE   # v0 + ALTs: rara vez se supera
+MAX_B64_LEN   = swap_exec.PACKET_B64_LEN
 MAX_FEE_BPS   = 45
 
 # --- Filtro de labels no deseados (defensivo) ---
@@ -112,197 +54,217 @@ def _label_ok(quote_json: dict) -> bool:
 
 # Monto por defecto (override por argv)
 AMOUNT_LAMPORTS = CFG_AMOUNT_LAMPORTS
-USDC_MINT = "EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v"
+USDC_MINT = swap_exec.USDC_MINT
+CANDIDATOS_MA = (64, 56, 48)   # orden por defecto (sin historial)
+
+def preparar_compra_usdc(output_mint: str, amount_lamports: int | None = None):
+    """
+    Cotiza, filtra y construye la TX USDC->TOKEN sin firmar ni enviar.
+    Devuelve dict {route, swap_json, quote, out_raw, in_usd, ...} o None si no hay ruta válida.
+    """
+    amount = int(amount_lamports or AMOUNT_LAMPORTS)
+    cuentas_fee = priority_fees.cuentas_pool(output_mint, USDC_MINT)
+    priority_fees.precalentar(cuentas_fee)   # en paralelo con las quotes
+
+    def obtener_cotizacion(max_accounts: int):
+        params = {
+            "inputMint": USDC_MINT,
+            "outputMint": output_mint,
+            "amount": amount,                # entero on-chain (USDC*10^6)
+            "swapMode": "ExactIn",
+            "slippageBps": 30,               # 0.3%
+            "onlyDirectRoutes": "true",      # hop=1
+            "restrictIntermediateTokens": "true",
+            "maxAccounts": max_accounts,
+        }
+        tq0 = time.perf_counter()
+        r = swap_exec.quote(params, timeout=6, route="USDC", ma=max_accounts)  # quote 6s
+        emit("quote_http", ma=max_accounts, status=int(r.status_code), dt_ms=int((time.perf_counter()-tq0)*1000))
+        return r
+
+    def cotizar_y_filtrar(ma: int):
+        """Quote + filtros (hop/label/fees/min_out). Devuelve la quote válida o None."""
+        try:
+            quote_res = obtener_cotizacion(ma)
+        except Exception as e:
+            emit("quote_exc", ma=ma, err=str(e))
+            return None
+
+        if quote_res.status_code != 200:
+            print(f"[BUY][USDC] Quote HTTP {quote_res.status_code} (ma={ma})")
+            emit("quote_bad_status", ma=ma, status=int(quote_res.status_code))
+            return None
+
+        try:
+            quote = quote_res.json()
+        except Exception as je:
+            emit("quote_json_error", ma=ma, err=str(je))
+            dbg("QUOTE JSON error:", je, "| body:", (quote_res.text or "")[:400])
+            return None
+
+        route = quote.get("routePlan") or []
+        if not route:
+            emit("route_missing", ma=ma)
+            dbg("SIN RUTA en QUOTE (routePlan vacío).")
+            return None
+
+        # hop=1 real
+        if len(route) != 1:
+            emit("route_filtered_hop", ma=ma, legs=len(route))
+            dbg(f"Ruta con {len(route)} legs. Saltando…")
+            return None
+
+        # filtro label
+        if not _label_ok(quote):
+            lbl = (route[0].get("label") or "")
+            emit("route_filtered_label", ma=ma, label=lbl)
+            dbg("Ruta filtrada por label.")
+            return None
+
+        # fees guard-rail
+        try:
+            fees = sum(int(step.get("percentFeeBps", 0)) for step in route)
+        except Exception:
+            fees = 0
+        if fees > MAX_FEE_BPS:
+            emit("route_filtered_fee", ma=ma, fee_bps=int(fees))
+            print(f"[BUY][USDC] Ruta cara: {fees} bps. Probando otra…")
+            return None
+
+        # min_out estricto desde quote
+        min_out_raw = int(quote.get("otherAmountThreshold") or quote.get("outAmountWithSlippage") or 0)
+        if min_out_raw <= 0:
+            emit("route_filtered_minout_missing", ma=ma)
+            dbg("Quote sin otherAmountThreshold/outAmountWithSlippage. Skip.")
+            return None
+
+        emit("route_selected", ma=ma, fee_bps=int(fees), min_out_raw=int(min_out_raw),
+             label=(route[0].get("label") or ""))
+        return quote
+
+    def construir(ma: int, quote: dict):
+        """/swap para una quote válida (timeout 12s, sin dynamicSlippage). Devuelve prep o None."""
+        cu_price = priority_fees.cu_price("entry", cuentas_fee)
+        ts0 = time.perf_counter()
+        swap_res = swap_exec.build_swap(
+            quote, timeout=12, tags={"route": "USDC", "ma": ma},
+            wrapAndUnwrapSol=False,                  # USDC-only
+            useSharedAccounts=True,
+            asLegacyTransaction=False,               # v0 + address lookup tables
+            dynamicSlippage=False,                   # ← clave
+            computeUnitPriceMicroLamports=cu_price,
+        )
+        emit("swap_http", ma=ma, status=int(swap_res.status_code), dt_ms=int((time.perf_counter()-ts0)*1000))
+        if swap_res.status_code != 200:
+            print(f"[BUY][USDC] /swap {swap_res.status_code}: {swap_res.text[:160]}")
+            emit("swap_bad_status", ma=ma, status=int(swap_res.status_code))
+            return None
+
+        try:
+            sj = swap_res.json()
+        except Exception as je:
+            emit("swap_json_error", ma=ma, err=str(je))
+            dbg("SWAP JSON error:", je, "| body:", (swap_res.text or "")[:400])
+            return None
+
+        if "error" in sj:
+            emit("swap_sim_error", ma=ma, detail=json.dumps(sj)[:600])
+            dbg("SWAP error obj:", json.dumps(sj)[:700])
+            return None
+
+        raw_b64 = sj.get("swapTransaction")
+        if not raw_b64:
+            emit("swap_missing_tx", ma=ma)
+            dbg("SWAP sin 'swapTransaction'")
+            return None
+
+        # Tamaño TX (decodificada una sola vez: la misma se firma al enviar)
+        try:
+            tx = tx_codec.decodificar(raw_b64)
+            raw_len = len(tx)
+            b64_len = len(raw_b64)
+            dbg(f"TX size raw={raw_len}B b64={b64_len}")
+        except Exception:
+            tx = None
+            raw_len = None
+            b64_len = None
+
+        if (raw_len is not None and raw_len > MAX_RAW_BYTES) or (b64_len is not None and b64_len > MAX_B64_LEN):
+            emit("route_filtered_size", ma=ma, raw_len=raw_len or -1, b64_len=b64_len or -1)
+            print(f"[BUY][USDC] TX grande (raw≈{raw_len}B, b64≈{b64_len}). Buscando ruta más compacta…")
+            return None
+
+        rutas_stats.registrar(output_mint, "USDC", f"ma{ma}", "validas")
+        return {
+            "route": "USDC",
+            "swap_json": sj,
+            "tx": tx,
+            "quote": quote,
+            "ma": ma,
+            "forma": f"ma{ma}",
+            "raw_len": raw_len,
+            "b64_len": b64_len,
+            "out_raw": int(quote.get("outAmount") or 0),
+            "in_usd": amount / 1_000_000,
+            "cu_price": cu_price,
+        }
+
+    # Intentos priorizados por historial (rutas_stats): quotes en paralelo y cada /swap en cuanto su quote pasa filtros.
+    # Gana la primera TX construible y dentro de tamaño; el resto se cancela.
+    candidatos_ma = [int(f[2:]) for f in rutas_stats.candidatos(output_mint, "USDC", [f"ma{ma}" for ma in CANDIDATOS_MA])]
+    cotizar, construir_r = rutas_stats.con_registro(output_mint, "USDC", lambda ma: f"ma{ma}", cotizar_y_filtrar, construir)
+    prep = swap_exec.primera_construible({ma: (lambda ma=ma: cotizar(ma)) for ma in candidatos_ma}, construir_r)
+    if prep:
+        print(f"[BUY][USDC] Ruta OK (ma={prep['ma']}) | raw≈{prep['raw_len']}B b64≈{prep['b64_len']}")
+        emit("route_final", ma=prep["ma"], raw_len=int(prep["raw_len"] or -1), b64_len=int(prep["b64_len"] or -1))
+        return prep
+
+    emit("buy_usdc_abort", reason="no_valid_route")
+    print("[BUY][USDC] SIN RUTAS válidas (hop=1/label/fees/size/min_out).")
+    return None
+
+def enviar_compra_usdc(prep: dict):
+    """Firma y envía la TX preparada por preparar_compra_usdc. Devuelve firma (str) o False."""
+    print("[BUY][USDC] Firmando y enviando…")
+    raw = swap_exec.sign_tx(prep.get("tx") or prep["swap_json"]["swapTransaction"])
+    # límite de CU ajustado (simulación = chequeo previo) y el fee sobrante reinvertido en precio por CU
+    raw, cu = swap_exec.ajustar_cu(raw, "buy:" + swap_exec.etiqueta_cu(prep["quote"]),
+                                   precio_max=priority_fees.PERFILES["entry"]["max"])
+    if cu["err"] is not None:
+        print(f"[BUY][USDC] Simulación fallida, no se envía: {cu['err']}")
+        emit("tx_sim_failed", err=str(cu["err"]))
+        return False
+
+    try:
+        t_send0 = time.perf_counter()
+        d = swap_exec.broadcast(raw, label="[BUY][USDC] SEND",
+                                last_valid_block_height=prep["swap_json"].get("lastValidBlockHeight"))
+        prep["difusion"] = d
+        sig = d.sig
+        print(f"[BUY][USDC] TXID: {sig}")
+        rutas_stats.registrar(prep["quote"].get("outputMint"), "USDC", prep["forma"], "enviadas")
+        priority_fees.registrar_envio(sig, "entry", cu["cu_price"] or prep["cu_price"])
+        emit("tx_sent", sig=str(sig), rpc=d.endpoint, dt_ms=int((time.perf_counter()-t_send0)*1000))
+        return str(sig)
+    except Exception as e:
+        emit("tx_send_failed", err=str(e))
+        print(f"[BUY][USDC] Error de envío (reintentos agotados): {e}")
+        return False
 
 def ejecutar_compra_usdc(output_mint: str):
     t0 = time.perf_counter()
     emit("buy_usdc_start", wallet=str(wallet_pubkey), output_mint=output_mint, amount_lamports=int(AMOUNT_LAMPORTS))
     try:
         print(f"\n[BUY][USDC] Wallet: {wallet_pubkey}")
-        print(f"[BUY][USDC] USDC -> {output_mint} por {AMOUNT_LAMPORTS} lamports (USDC 6 dec)")
         dbg("PY:", sys.executable, "| CWD:", os.getcwd())
 
-        def obtener_cotizacion(max_accounts: int):
-            params = {
-                "inputMint": USDC_MINT,
-                "outputMint": output_mint,
-                "amount": AMOUNT_LAMPORTS,       # entero on-chain (USDC*10^6)
-                "swapMode": "ExactIn",
-                "slippageBps": 30,               # 0.3%
-                "onlyDirectRoutes": "true",      # hop=1
-                "restrictIntermediateTokens": "true",
-                "maxAccounts": max_accounts,
-            }
-            headers = {
-                "accept": "application/json",
-                "Authorization": f"Bearer {JUPITER_API_KEY}"
-            }
-            tq0 = time.perf_counter()
-            r = http_get(QUOTE_URL, headers=headers, params=params, timeout=6)  # quote 6s
-            emit("quote_http", ma=max_accounts, status=int(r.status_code), dt_ms=int((time.perf_counter()-tq0)*1000))
-            return r
-
-        headers_swap = {
-            "accept": "application/json",
-            "Authorization": f"Bearer {JUPITER_API_KEY}"
-        }
-
-        # Intentos reducidos y priorizados
-        candidatos_ma = [64, 56, 48]
-        swap_json = None
-        ruta_info = None  # (ma, raw_len, b64_len)
-
-        # Paraleliza y toma la primera ruta válida
-        with ThreadPoolExecutor(max_workers=len(candidatos_ma)) as ex:
-            fut_map = {ex.submit(obtener_cotizacion, ma): ma for ma in candidatos_ma}
-            for fut in as_completed(fut_map):
-                ma = fut_map[fut]
-                try:
-                    quote_res = fut.result()
-                except Exception as e:
-                    emit("quote_exc", ma=ma, err=str(e))
-                    continue
-
-                if quote_res.status_code != 200:
-                    print(f"[BUY][USDC] Quote HTTP {quote_res.status_code} (ma={ma})")
-                    emit("quote_bad_status", ma=ma, status=int(quote_res.status_code))
-                    continue
-
-                try:
-                    quote = quote_res.json()
-                except Exception as je:
-                    emit("quote_json_error", ma=ma, err=str(je))
-                    dbg("QUOTE JSON error:", je, "| body:", (quote_res.text or "")[:400])
-                    continue
-
-                route = quote.get("routePlan") or []
-                if not route:
-                    emit("route_missing", ma=ma)
-                    dbg("SIN RUTA en QUOTE (routePlan vacío).")
-                    continue
-
-                # hop=1 real
-                if len(route) != 1:
-                    emit("route_filtered_hop", ma=ma, legs=len(route))
-                    dbg(f"Ruta con {len(route)} legs. Saltando…")
-                    continue
-
-                # filtro label
-                if not _label_ok(quote):
-                    lbl = (route[0].get("label") or "")
-                    emit("route_filtered_label", ma=ma, label=lbl)
-                    dbg("Ruta filtrada por label.")
-                    continue
-
-                # fees guard-rail
-                try:
-                    fees = sum(int(step.get("percentFeeBps", 0)) for step in route)
-                except Exception:
-                    fees = 0
-                if fees > MAX_FEE_BPS:
-                    emit("route_filtered_fee", ma=ma, fee_bps=int(fees))
-                    print(f"[BUY][USDC] Ruta cara: {fees} bps. Probando otra…")
-                    continue
-
-                # min_out estricto desde quote
-                min_out_raw = int(quote.get("otherAmountThreshold") or quote.get("outAmountWithSlippage") or 0)
-                if min_out_raw <= 0:
-                    emit("route_filtered_minout_missing", ma=ma)
-                    dbg("Quote sin otherAmountThreshold/outAmountWithSlippage. Skip.")
-                    continue
-
-                emit("route_selected", ma=ma, fee_bps=int(fees), min_out_raw=int(min_out_raw),
-                     label=(route[0].get("label") or ""))
-
-                # Construir swap (timeout 12s, sin dynamicSlippage)
-                swap_body = {
-                    "quoteResponse": quote,
-                    "userPublicKey": str(wallet_pubkey),
-                    "wrapAndUnwrapSol": False,               # USDC-only
-                    "useSharedAccounts": True,
-                    "asLegacyTransaction": True,
-                    "dynamicSlippage": False,                # ← clave
-                    "computeUnitPriceMicroLamports": 9000
-                }
-                ts0 = time.perf_counter()
-                swap_res = http_post(SWAP_URL, headers=headers_swap, json_body=swap_body, timeout=12)
-                emit("swap_http", ma=ma, status=int(swap_res.status_code), dt_ms=int((time.perf_counter()-ts0)*1000))
-                if swap_res.status_code != 200:
-                    print(f"[BUY][USDC] /swap {swap_res.status_code}: {swap_res.text[:160]}")
-                    emit("swap_bad_status", ma=ma, status=int(swap_res.status_code))
-                    continue
-
-                try:
-                    sj = swap_res.json()
-                except Exception as je:
-                    emit("swap_json_error", ma=ma, err=str(je))
-                    dbg("SWAP JSON error:", je, "| body:", (swap_res.text or "")[:400])
-                    continue
-
-                if "error" in sj:
-                    emit("swap_sim_error", ma=ma, detail=json.dumps(sj)[:600])
-                    dbg("SWAP error obj:", json.dumps(sj)[:700])
-                    continue
-
-                raw_b64 = sj.get("swapTransaction")
-                if not raw_b64:
-                    emit("swap_missing_tx", ma=ma)
-                    dbg("SWAP sin 'swapTransaction'")
-                    continue
-
-                # Tamaño TX
-                try:
-                    tx_decoded = b64decode(raw_b64)
-                    raw_len = len(tx_decoded)
-                    b64_len = len(raw_b64)
-                    dbg(f"TX size raw={raw_len}B b64={b64_len}")
-                except Exception:
-                    raw_len = None
-                    b64_len = None
-
-                if (raw_len is not None and raw_len > MAX_RAW_BYTES) or (b64_len is not None and b64_len > MAX_B64_LEN):
-                    emit("route_filtered_size", ma=ma, raw_len=raw_len or -1, b64_len=b64_len or -1)
-                    print(f"[BUY][USDC] TX grande (raw≈{raw_len}B, b64≈{b64_len}). Buscando ruta más compacta…")
-                    continue
-
-                # Primer resultado válido
-                swap_json = sj
-                ruta_info = (ma, raw_len, b64_len)
-                try:
-                    ex.shutdown(wait=False, cancel_futures=True)
-                except TypeError:
-                    pass
-                break
-
-        if not swap_json:
-            emit("buy_usdc_abort", reason="no_valid_route")
-            print("[BUY][USDC] SIN RUTAS válidas (hop=1/label/fees/size/min_out).")
+        prep = preparar_compra_usdc(output_mint)
+        if not prep:
             return False
 
-        ma, raw_len, b64_len = ruta_info
-        print(f"[BUY][USDC] Ruta OK (ma={ma}) | raw≈{raw_len}B b64≈{b64_len}")
-        emit("route_final", ma=ma, raw_len=int(raw_len or -1), b64_len=int(b64_len or -1))
-
-        # Firmar y enviar con retries/fallback
-        print("[BUY][USDC] Firmando y enviando…")
-        tx_decoded = b64decode(swap_json["swapTransaction"])
-        transaction = Transaction.deserialize(tx_decoded)
-        transaction.sign(keypair)
-        raw = transaction.serialize()
-
-        try:
-            t_send0 = time.perf_counter()
-            txid = send_with_retries(raw, client, label="[BUY][USDC] SEND")
-            sig = getattr(txid, "value", txid)
-            print(f"[BUY][USDC] TXID: {sig}")
-            emit("tx_sent", sig=str(sig), dt_ms=int((time.perf_counter()-t_send0)*1000))
-            emit("buy_usdc_done", ok=True, total_ms=int((time.perf_counter()-t0)*1000))
-            return str(sig)
-        except Exception as e:
-            emit("tx_send_failed", err=str(e))
-            print(f"[BUY][USDC] Error de envío (reintentos agotados): {e}")
-            emit("buy_usdc_done", ok=False, total_ms=int((time.perf_counter()-t0)*1000))
-            return False
+        sig = enviar_compra_usdc(prep)
+        emit("buy_usdc_done", ok=bool(sig), total_ms=int((time.perf_counter()-t0)*1000))
+        return sig
 
     except Exception as e:
         emit("buy_usdc_exception", err=str(e))
@@ -331,6 +293,7 @@ if __name__ == "__main__":
             sys.exit(2)
 
     ok = ejecutar_compra_usdc(output_mint)
+    rutas_stats.vaciar()
     sys.exit(0 if ok else 1)
 # telemetry.py — Telemetría ligera con SQLite + contexto Timer/span
 
@@ -37,6 +37,7 @@ JUPITER_API_KEY = os.getenv("JUPITER_API_KEY", "").strip()  # no usado en Lite
 # === 🌐 URLs Jupiter (Lite) ===
 QUOTE_URL = "https://lite-api.jup.ag/swap/v1/quote"
 SWAP_URL  = "https://lite-api.jup.ag/swap/v1/swap"
+SWAP_IX_URL = "https://lite-api.jup.ag/swap/v1/swap-instructions"
 
 # === ⚙️ Parámetros generales ===
 DB_NAME = "goodt.db"
@@ -0,0 +1,241 @@
+# confirmaciones.py — Servicio de confirmación de firmas (signatureSubscribe + polling de respaldo)
+# - Una conexión WS (config.WS_URL) por proceso, en un hilo propio con su event loop
+# - suscribir(sig) devuelve un Future que se resuelve al alcanzar el commitment objetivo
+# - Polling por lotes (getSignatureStatuses) cubre caídas del WS y firmas ya aterrizadas
+# - Firmas sin interesados (timeout/soltar) o más viejas que PEND_MAX_S salen del pendiente y del WS
+# Usado por swap_exec (fin de la re-difusión), salida_forzada y el trader (compra aterrizada).
+
+import json, time, asyncio, threading
+from concurrent.futures import Future, CancelledError
+
+import websockets
+
+import swap_exec
+from config import WS_URL, WS_PING_INTERVAL, WS_PING_TIMEOUT
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+POLL_WS_OK   = 1.5     # s entre polls con el WS vivo (solo respaldo)
+POLL_WS_DOWN = 0.4     # s entre polls sin WS
+POLL_BATCH   = 256     # firmas por getSignatureStatuses
+RECONNECT_S  = 1.0
+PEND_MAX_S   = 180.0   # s máx. de una firma pendiente (su blockhash ya expiró de sobra)
+
+_NIVELES = {"processed": 0, "confirmed": 1, "finalized": 2}
+
+class _Pendiente:
+    __slots__ = ("sig", "commitment", "fut", "t0", "sub_id", "refs")
+
+    def __init__(self, sig, commitment):
+        self.sig = sig
+        self.commitment = commitment
+        self.fut = Future()
+        self.t0 = time.monotonic()
+        self.sub_id = None
+        self.refs = 0                # llamadores que esperan la firma
+
+class Confirmador:
+    """Resuelve Futures de firmas: {"ok", "err", "slot", "via", "dt_ms"}."""
+
+    def __init__(self, ws_url=WS_URL):
+        self.ws_url = ws_url
+        self._pend = {}              # (sig, commitment) -> _Pendiente
+        self._lock = threading.Lock()
+        self._loop = None
+        self._ws_ok = False
+        self._started = False
+        self._nuevo = None           # asyncio.Event (dentro del loop)
+
+    # --- ciclo de vida ---
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run_ws, daemon=True).start()
+        threading.Thread(target=self._run_poll, daemon=True).start()
+
+    # --- API ---
+    def suscribir(self, sig: str, commitment="confirmed") -> Future:
+        self.start()
+        key = (str(sig), commitment)
+        with self._lock:
+            p = self._pend.get(key)
+            if p is None:
+                p = self._pend[key] = _Pendiente(str(sig), commitment)
+                nuevo = True
+            else:
+                nuevo = False
+            p.refs += 1
+        if nuevo:
+            self._despertar()
+        return p.fut
+
+    def soltar(self, sig: str, commitment="confirmed"):
+        """El llamador deja de esperar la firma; con el último sale del pendiente y se cancela su Future."""
+        key = (str(sig), commitment)
+        with self._lock:
+            p = self._pend.get(key)
+            if p is None:
+                return
+            p.refs -= 1
+            if p.refs > 0:
+                return
+            del self._pend[key]
+        p.fut.cancel()
+        self._despertar()   # el WS da de baja su suscripción
+
+    def esperar(self, sig: str, timeout=90.0, commitment="confirmed"):
+        """Bloquea hasta confirmar/fallar. Devuelve el dict de resultado o None si vence el timeout."""
+        fut = self.suscribir(sig, commitment)
+        try:
+            return fut.result(timeout=timeout)
+        except (Exception, CancelledError):
+            emit("confirm_timeout", sig=str(sig), timeout_s=timeout)
+            self.soltar(sig, commitment)
+            return None
+
+    def _despertar(self):
+        loop, ev = self._loop, self._nuevo
+        if loop is not None and ev is not None:
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:
+                pass   # loop cerrado: la reconexión vuelve a suscribir lo pendiente
+
+    # --- resolución ---
+    def _resolver(self, p: _Pendiente, err=None, slot=None, via="ws"):
+        with self._lock:
+            if self._pend.get((p.sig, p.commitment)) is not p:
+                return   # ya resuelta, soltada o expirada
+            del self._pend[(p.sig, p.commitment)]
+        if via != "ws":
+            self._despertar()   # resuelta por polling: el WS da de baja su suscripción
+        res = {"ok": err is None, "err": err, "slot": slot, "via": via,
+               "dt_ms": int((time.monotonic() - p.t0) * 1000)}
+        p.fut.set_result(res)
+        emit("confirm_ok" if err is None else "confirm_err", sig=p.sig, commitment=p.commitment,
+             via=via, slot=slot, err=str(err) if err is not None else None, dt_ms=res["dt_ms"])
+
+    # --- WebSocket ---
+    async def _ws_loop(self):
+        self._nuevo = asyncio.Event()
+        async with websockets.connect(self.ws_url, ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT) as ws:
+            self._ws_ok = True
+            emit("confirm_ws_connected")
+            req_id = 0
+            por_req = {}     # id request -> _Pendiente
+            por_sub = {}     # id suscripción -> _Pendiente
+            enviados = set() # _Pendiente ya suscritos en esta conexión
+            while True:
+                with self._lock:
+                    vigentes = set(self._pend.values())
+                enviados &= vigentes
+                faltan = [p for p in vigentes if p not in enviados]
+                # resueltas por polling, soltadas o expiradas: fuera del WS
+                for sub_id in [s for s, p in por_sub.items() if p not in vigentes]:
+                    del por_sub[sub_id]
+                    req_id += 1
+                    await ws.send(json.dumps({
+                        "jsonrpc": "2.0", "id": req_id, "method": "signatureUnsubscribe", "params": [sub_id]
+                    }))
+                for p in faltan:
+                    req_id += 1
+                    por_req[req_id] = p
+                    enviados.add(p)
+                    await ws.send(json.dumps({
+                        "jsonrpc": "2.0", "id": req_id, "method": "signatureSubscribe",
+                        "params": [p.sig, {"commitment": p.commitment}]
+                    }))
+                self._nuevo.clear()
+
+                recv = asyncio.ensure_future(ws.recv())
+                nuevo = asyncio.ensure_future(self._nuevo.wait())
+                done, _ = await asyncio.wait({recv, nuevo}, timeout=5.0, return_when=asyncio.FIRST_COMPLETED)
+                if recv not in done:
+                    recv.cancel()
+                    nuevo.cancel()
+                    continue
+                nuevo.cancel()
+
+                data = json.loads(recv.result())
+                if "id" in data and data["id"] in por_req:
+                    p = por_req.pop(data["id"])
+                    if data.get("result") is not None:
+                        p.sub_id = data["result"]
+                        por_sub[p.sub_id] = p
+                    continue
+                params = data.get("params") or {}
+                p = por_sub.pop(params.get("subscription"), None)
+                if p is None:
+                    continue
+                res = params.get("result") or {}
+                val = res.get("value") or {}
+                slot = (res.get("context") or {}).get("slot")
+                self._resolver(p, err=val.get("err"), slot=slot, via="ws")
+
+    def _run_ws(self):
+        while True:
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self._ws_loop())
+            except Exception as e:
+                emit("confirm_ws_error", err=str(e))
+            finally:
+                self._ws_ok = False
+                self._nuevo = None
+                try: self._loop.close()
+                except Exception: pass
+            time.sleep(RECONNECT_S)
+
+    # --- Polling de respaldo ---
+    def _purgar(self):
+        now = time.monotonic()
+        with self._lock:
+            viejas = [self._pend.pop(k) for k, p in list(self._pend.items()) if now - p.t0 > PEND_MAX_S]
+        for p in viejas:
+            p.fut.cancel()
+            emit("confirm_expired", sig=p.sig, commitment=p.commitment, age_s=int(now - p.t0))
+        if viejas:
+            self._despertar()
+
+    def _poll_once(self):
+        with self._lock:
+            pend = list(self._pend.values())
+        for i in range(0, len(pend), POLL_BATCH):
+            lote = pend[i:i + POLL_BATCH]
+            res = swap_exec.rpc("getSignatureStatuses", [[p.sig for p in lote], {"searchTransactionHistory": False}], timeout=2.0)
+            for p, st in zip(lote, (res or {}).get("value") or []):
+                if not st:
+                    continue
+                if st.get("err") is not None:
+                    self._resolver(p, err=st["err"], slot=st.get("slot"), via="poll")
+                elif _NIVELES.get(st.get("confirmationStatus"), -1) >= _NIVELES.get(p.commitment, 1):
+                    self._resolver(p, slot=st.get("slot"), via="poll")
+
+    def _run_poll(self):
+        while True:
+            time.sleep(POLL_WS_OK if self._ws_ok else POLL_WS_DOWN)
+            try:
+                if self._pend:
+                    self._purgar()
+                    self._poll_once()
+            except Exception as e:
+                emit("confirm_poll_error", err=str(e))
+
+# Instancia compartida por proceso
+confirmador = Confirmador()
+
+def suscribir(sig: str, commitment="confirmed") -> Future:
+    return confirmador.suscribir(sig, commitment)
+
+def esperar(sig: str, timeout=90.0, commitment="confirmed"):
+    return confirmador.esperar(sig, timeout, commitment)
+
+def soltar(sig: str, commitment="confirmed"):
+    confirmador.soltar(sig, commitment)
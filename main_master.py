@@ -4,6 +4,16 @@ from collections import deque, defaultdict
 from datetime import datetime, timedelta
 from reporte import tick_reporte_diario           # ← 🔔 REPORTE DIARIO 23:59
 from telemetry import Timer, jlog                 # ← punto 4: observabilidad mínima
+try:
+    import compra_previa                          # ← compra preparada en la pre-señal (CONF_TICKS-1)
+except Exception as _e:
+    compra_previa = None
+    print(f"⚠️ compra_previa no disponible (el trader cotiza al lanzarse): {_e}")
+try:
+    import vault_feed                             # ← feed de vaults abierto antes de la señal (traspaso al trader)
+except Exception as _e:
+    vault_feed = None
+    print(f"⚠️ vault_feed no disponible (el trader abre su feed al lanzarse): {_e}")
 
 # =================== CONST ===================
 DB_NAME   = "goodt.db"
@@ -38,6 +48,13 @@ SCORE_WEIGHTS = {
 TICK_MIN_RET = 0.008       # 0.8% mínimo para contar “tick”
 SCORE_THRESHOLD = 17       # score mínimo
 CONF_TICKS = 2             # confirmaciones
+PREP_COMPRA = os.getenv("APOLLO_PREP_BUY", "1") != "0"   # preparar la compra en CONF_TICKS-1
+
+# ---- Feed previo: vaults por WS desde que el score se acerca al umbral
+FEED_PREVIO  = os.getenv("APOLLO_WARM", "1") != "0"
+WARM_SCORE   = SCORE_THRESHOLD - 5   # score desde el que se abre el feed del pool
+WARM_KEEP_S  = 60.0                  # sin acercarse al umbral este tiempo → se cierra
+WARM_MAX     = 4                     # feeds abiertos a la vez (se cierra el más viejo)
 
 # ---- Punto 3: trailing y anti round-trip (vía orquestador)
 ACTIVA_TRAIL_EN  = 0.020   # +2.0% activa trailing
@@ -94,6 +111,101 @@ def _win_keep_awake_off():
 
 atexit.register(_win_keep_awake_off)
 
+# =================== QUOTE SERVICE (cache de quotes compartida por los traders) ===================
+_QUOTE_SVC = None
+
+def _quote_service_on():
+    global _QUOTE_SVC
+    try:
+        _QUOTE_SVC = subprocess.Popen([sys.executable, os.path.join(os.getcwd(), "quote_service.py")],
+                                      cwd=os.getcwd(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except Exception as e:
+        print(f"⚠️ quote_service no arrancó (los traders usan su cache local): {e}")
+
+def _quote_service_off():
+    if _QUOTE_SVC is not None and _QUOTE_SVC.poll() is None:
+        try: _QUOTE_SVC.terminate()
+        except Exception: pass
+
+atexit.register(_quote_service_off)
+
+# =================== WALLET PREP (wSOL persistente + ATAs de VIPs, fuera del camino de compra) ===================
+WALLET_PREP_EVERY = 120.0   # s: rebalanceo periódico del wSOL aunque no haya VIPs nuevos
+_WALLET_PREP = None
+_WALLET_PREP_TS = 0.0
+_preparados = set()
+
+def _wallet_prep(mints=(), forzar=False):
+    """
+    Lanza wallet_prep.py (uno a la vez, sin bloquear el scan) con los VIPs aún no preparados, o solo
+    para el wSOL si pasó WALLET_PREP_EVERY o 'forzar' (tras un trade: ventas a SOL / compras con wSOL).
+    """
+    global _WALLET_PREP, _WALLET_PREP_TS
+    if _WALLET_PREP is not None and _WALLET_PREP.poll() is None:
+        return
+    nuevos = [m for m in mints if m and m not in _preparados]
+    vencido = time.monotonic() - _WALLET_PREP_TS >= WALLET_PREP_EVERY
+    if _WALLET_PREP is not None and not nuevos and not vencido and not forzar:
+        return
+    _WALLET_PREP_TS = time.monotonic()
+    try:
+        _WALLET_PREP = subprocess.Popen([sys.executable, os.path.join(os.getcwd(), "wallet_prep.py"), ",".join(nuevos)],
+                                        cwd=os.getcwd(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _preparados.update(nuevos)
+        jlog("wallet_prep_launch", n=len(nuevos))
+    except Exception as e:
+        print(f"⚠️ wallet_prep no arrancó (los traders envuelven SOL en cada swap): {e}")
+
+# =================== COMPRA PREVIA (pre-señal) ===================
+def _preparar_compra(mint, px_usd, sol_usd):
+    if not PREP_COMPRA or compra_previa is None or not px_usd:
+        return
+    if compra_previa.preparar(mint, px_usd, sol_usd):
+        if DEBUG: print(f"[{ts()}] 🧪 pre-señal {_short(mint)}: preparando compra")
+        jlog("buy_prep_launch", mint=mint)
+
+def _descartar_compra(mint):
+    if compra_previa is not None:
+        compra_previa.descartar(mint)
+
+# =================== FEED PREVIO (vaults por WS antes de la señal) ===================
+_feeds = {}   # mint -> [PriceFeed, ts_monotonic del último acercamiento al umbral]
+
+def _feed_previo(row):
+    mint = row["address"]
+    if not FEED_PREVIO or vault_feed is None or not row["vault_usdc"] or not row["vault_token"]:
+        return
+    e = _feeds.get(mint)
+    if e:
+        e[1] = time.monotonic(); return
+    while len(_feeds) >= WARM_MAX:
+        _cerrar_feed(min(_feeds, key=lambda m: _feeds[m][1]))
+    try:
+        f = vault_feed.PriceFeed(row["vault_usdc"], row["vault_token"], foto_inicial=True)
+        f.start()
+        _feeds[mint] = [f, time.monotonic()]
+        if DEBUG: print(f"[{ts()}] 📡 feed previo {_short(mint)} (score cerca del umbral)")
+        jlog("warm_feed_open", mint=mint)
+    except Exception as e:
+        jlog("warm_feed_err", mint=mint, msg=str(e))
+
+def _cerrar_feed(mint):
+    e = _feeds.pop(mint, None)
+    if e:
+        threading.Thread(target=e[0].stop, daemon=True).start()   # stop() espera al hilo WS: fuera del scan
+        jlog("warm_feed_close", mint=mint)
+
+def _purgar_feeds():
+    now = time.monotonic()
+    for m in [m for m, e in _feeds.items() if now - e[1] > WARM_KEEP_S]:
+        _cerrar_feed(m)
+
+def _feed_traspaso(mint, sol_usd=None) -> dict:
+    e = _feeds.get(mint)
+    env = vault_feed.a_entorno(e[0], sol_usd) if e else {}
+    jlog("warm_feed_handoff", mint=mint, ok=bool(env))
+    return env
+
 # =================== SQLITE ===================
 _SQL_CON = None
 
@@ -316,10 +428,11 @@ def _weighted_score(series):
             pass
     return score
 
-def decide_signal(series):
+def decide_signal(series, score=None):
     if len(series) < 20:
         return False
-    score = _weighted_score(series)
+    if score is None:
+        score = _weighted_score(series)
     return score >= SCORE_THRESHOLD
 
 # --- Filtro adicional: estructura bull r60 < r30 < r15 ---
@@ -393,6 +506,8 @@ def hay_stop():
 
 def main():
     _win_keep_awake_on()
+    _quote_service_on()
+    _wallet_prep()
     print("▶️  main_master_vip (low-latency): monitoreando VIPs y lanzando trading_good_diactivo.py …")
 
     price_hist = defaultdict(lambda: deque(maxlen=420))   # ~10 min si POLL≈1.5
@@ -419,7 +534,7 @@ def main():
 
         tick_reporte_diario()
 
-        # FREEZE 1×1
+        # FREEZE 1×1 (trade en curso o wallet_prep cerrando el wSOL)
         if os.path.exists(LOCK_FILE):
             if lock_is_stale(20):
                 print(f"[{ts()}] ⚠️ trading.lock viejo → limpio.")
@@ -444,6 +559,8 @@ def main():
                     vips_cache_count = cnt
                     reuse_vips_cycles = MAX_REUSE_CYCLES
 
+            _wallet_prep([row["address"] for row in vips])   # VIPs nuevos o rebalanceo periódico
+
             if not vips:
                 if DEBUG: print(f"[{ts()}] 💤 0 VIPs '🚀 comprar'.")
                 time.sleep(poll_secs); continue
@@ -503,19 +620,30 @@ def main():
                     print(f"[{ts()}]   ↪︎ {n} r15={r15:+.3%} r30={r30:+.3%} r60={r60:+.3%} bull={ok_bull} conf={confirm[mint]}")
 
                 # Señal válida solo si score y estructura bull
-                if decide_signal(series) and estructura_bull(series):
+                score = _weighted_score(series) if len(series) >= 20 else 0
+                if decide_signal(series, score) and estructura_bull(series):
                     confirm[mint] += 1
                 else:
-                    if confirm[mint] != 0: confirm[mint] = 0
+                    if confirm[mint] != 0:
+                        confirm[mint] = 0
+                        _descartar_compra(mint)   # la señal no confirmó
 
                 # Anti reentrada
                 last_t = max(last_trade_ts.get(mint, 0.0), last_launch_ts.get(mint, 0.0))
                 cool_ok = (tnow - last_t) >= REENTRY_BLOCK
 
+                # Score cerca del umbral: feed de vaults abierto para traspasarlo al trader
+                if (score >= WARM_SCORE or confirm[mint] > 0) and cool_ok:
+                    _feed_previo(row)
+
+                # Pre-señal: quote + TX sin firmar listas para cuando llegue la confirmación
+                if 0 < confirm[mint] == CONF_TICKS - 1 and cool_ok:
+                    _preparar_compra(mint, prices.get(mint), sol_usd)
+
                 if confirm[mint] >= CONF_TICKS and cool_ok:
                     if not acquire_lock():
                         if DEBUG: print(f"[{ts()}] ⏸️ Trade en curso. Omito señal de {_short(mint)}")
-                        confirm[mint] = 0; continue
+                        confirm[mint] = 0; _descartar_compra(mint); continue
                     try:
                         script_name = _trading_script_for_now(datetime.now())
                         n = row["name"] or _short(mint)
@@ -530,6 +658,7 @@ def main():
                         env["APOLLO_TRAIL_STOP_BPS"]     = str(int(TRAILING_STOP * 10_000))    # 70
                         env["APOLLO_HOLD_SECS"]          = str(int(HOLD_SECS))                 # 8
                         env["APOLLO_REENTRY_BLOCK_SECS"] = str(int(REENTRY_BLOCK))             # 30
+                        env.update(_feed_traspaso(mint, sol_usd if row["route_base"] == "SOL" else None))
                         py = sys.executable
                         script = os.path.join(os.getcwd(), script_name)
                         with Timer("launch_trader", mint=mint):
@@ -543,13 +672,18 @@ def main():
                         jlog("launch_err", mint=mint, msg=str(e))
                         running.discard(mint)
                     finally:
+                        _descartar_compra(mint)           # preparación no consumida (trader sin arrancar / directo)
+                        _cerrar_feed(mint)                # el trader ya tuvo el suyo
                         release_lock()
+                        _wallet_prep(forzar=True)         # wSOL de vuelta al objetivo tras el trade
                 elif confirm[mint] >= CONF_TICKS and not cool_ok:
                     if DEBUG:
                         left = REENTRY_BLOCK - (tnow - last_t)
                         print(f"[{ts()}] 🧊 veto reentrada {_short(mint)} {left:.1f}s")
                         jlog("reentry_veto", mint=mint, left=round(left,1))
 
+            _purgar_feeds()
+
             # Limpia running sin query pesada
             if running:
                 placeholders = ",".join("?" for _ in running)
@@ -0,0 +1,169 @@
+# notificar.py — Alertas fire-and-forget: spool en disco + worker sidecar (nunca bloquea el camino crítico)
+# - encolar(): escribe la alerta en el spool (archivo atómico) y despierta al worker si no está vivo
+# - Worker: proceso aparte (python notificar.py --worker) que drena el spool por lotes y reintenta con backoff
+# - Spool acotado (MAX_SPOOL): si se llena se descartan las alertas más viejas
+# - Latido por alerta; al arrancar, el worker devuelve al spool las '.enviando' de un worker caído
+# El envío real sigue siendo mesenger.py (misma CLI: --token --name [--amount] --subject).
+
+import os, sys, json, time, uuid, subprocess, argparse
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+SPOOL_DIR     = os.getenv("APOLLO_ALERT_SPOOL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "alertas_spool"))
+MAX_SPOOL     = 500       # alertas máx. en disco
+MAX_INTENTOS  = 5
+BACKOFF_S     = (2, 5, 15, 30, 60)
+LOTE          = 20        # alertas por pasada
+SEND_TIMEOUT  = 30
+HEARTBEAT_S   = SEND_TIMEOUT + 10.0   # worker vivo si su latido es más reciente (cubre un envío lento)
+IDLE_EXIT_S   = 60.0      # el worker termina tras este tiempo sin alertas
+MESSENGER     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mesenger.py")
+
+_LATIDO = os.path.join(SPOOL_DIR, ".worker")
+
+# ===== Productor =====
+def _recortar_spool():
+    try:
+        xs = sorted(f for f in os.listdir(SPOOL_DIR) if f.endswith(".json"))
+        for f in xs[:max(0, len(xs) - MAX_SPOOL + 1)]:
+            os.remove(os.path.join(SPOOL_DIR, f))
+            emit("alert_dropped", file=f)
+    except Exception:
+        pass
+
+def _latir():
+    open(_LATIDO, "a").close()
+    os.utime(_LATIDO, None)
+
+def _worker_vivo() -> bool:
+    try:
+        return time.time() - os.path.getmtime(_LATIDO) < HEARTBEAT_S
+    except OSError:
+        return False
+
+def _lanzar_worker():
+    try:
+        kw = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "stdin": subprocess.DEVNULL}
+        if os.name == "nt":
+            kw["creationflags"] = 0x00000008 | 0x00000200   # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+        else:
+            kw["start_new_session"] = True
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker"], **kw)
+        _latir()   # evita lanzar otro worker mientras este arranca
+    except Exception as e:
+        emit("alert_worker_spawn_error", err=str(e))
+
+def encolar(token: str, name: str, subject: str, amount_tokens: float | None = None):
+    """Encola la alerta y vuelve de inmediato (no lanza excepciones)."""
+    try:
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        _recortar_spool()
+        alerta = {"token": token, "name": name, "subject": subject,
+                  "amount": amount_tokens if isinstance(amount_tokens, (int, float)) else None,
+                  "ts": time.time(), "intentos": 0, "proximo": 0}
+        nombre = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}.json"
+        tmp = os.path.join(SPOOL_DIR, nombre + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(alerta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(SPOOL_DIR, nombre))
+        emit("alert_queued", token=token, subject=subject)
+        if not _worker_vivo():
+            _lanzar_worker()
+        return True
+    except Exception as e:
+        emit("alert_queue_error", err=str(e))
+        return False
+
+# ===== Worker =====
+def _enviar(a: dict) -> bool:
+    cmd = [sys.executable, MESSENGER, "--token", a["token"], "--name", a["name"]]
+    if isinstance(a.get("amount"), (int, float)):
+        cmd += ["--amount", f"{a['amount']:.8f}"]
+    cmd += ["--subject", a["subject"]]
+    try:
+        return subprocess.run(cmd, check=False, timeout=SEND_TIMEOUT).returncode == 0
+    except Exception as e:
+        emit("alert_send_error", err=str(e))
+        return False
+
+def drenar() -> int:
+    """Una pasada por el spool: envía las alertas vencidas (máx. LOTE). Devuelve cuántas quedan."""
+    xs = sorted(f for f in os.listdir(SPOOL_DIR) if f.endswith(".json"))
+    now = time.time()
+    for f in xs[:LOTE]:
+        path = os.path.join(SPOOL_DIR, f)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                a = json.load(fh)
+        except Exception:
+            try: os.remove(path)
+            except OSError: pass
+            continue
+        if a.get("proximo", 0) > now:
+            continue
+        _latir()   # un lote de envíos lentos no debe parecer un worker caído
+        # reclamar la alerta (rename atómico): si otro worker la tomó, se salta
+        envio = path[:-5] + ".enviando"
+        try:
+            os.rename(path, envio)
+        except OSError:
+            continue
+        if _enviar(a):
+            os.remove(envio)
+            emit("alert_sent", token=a.get("token"), subject=a.get("subject"), lag_s=round(now - a.get("ts", now), 2))
+            continue
+        a["intentos"] = int(a.get("intentos", 0)) + 1
+        if a["intentos"] >= MAX_INTENTOS:
+            os.remove(envio)
+            emit("alert_abandoned", token=a.get("token"), subject=a.get("subject"))
+            continue
+        a["proximo"] = now + BACKOFF_S[min(a["intentos"] - 1, len(BACKOFF_S) - 1)]
+        with open(envio, "w", encoding="utf-8") as fh:
+            json.dump(a, fh, ensure_ascii=False)
+        os.replace(envio, path)
+    return len([f for f in os.listdir(SPOOL_DIR) if f.endswith(".json")])
+
+def _recuperar_enviando():
+    """Devuelve al spool las alertas reclamadas por un worker que murió a mitad de envío."""
+    for f in os.listdir(SPOOL_DIR):
+        if not f.endswith(".enviando"):
+            continue
+        try:
+            os.replace(os.path.join(SPOOL_DIR, f), os.path.join(SPOOL_DIR, f[:-9] + ".json"))
+            emit("alert_requeued", file=f)
+        except OSError:
+            pass
+
+def worker():
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    _latir()
+    _recuperar_enviando()   # solo arranca un worker si el latido anterior venció
+    idle_desde = time.monotonic()
+    while True:
+        _latir()
+        try:
+            quedan = drenar()
+        except Exception as e:
+            emit("alert_worker_error", err=str(e))
+            quedan = 1
+        if quedan:
+            idle_desde = time.monotonic()
+        elif time.monotonic() - idle_desde > IDLE_EXIT_S:
+            break
+        time.sleep(1.0)
+    try: os.remove(_LATIDO)
+    except OSError: pass
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Cola de alertas (spool + worker)")
+    ap.add_argument("--worker", action="store_true", help="Drenar el spool hasta quedar inactivo")
+    args = ap.parse_args()
+    if args.worker:
+        worker()
+    else:
+        print(f"spool={SPOOL_DIR} pendientes={len([f for f in os.listdir(SPOOL_DIR) if f.endswith('.json')]) if os.path.isdir(SPOOL_DIR) else 0}")
@@ -0,0 +1,224 @@
+# priority_fees.py — Auto-tuner del precio por CU (µlamports) según latencia de aterrizaje
+# - Fees recientes por cuentas tocadas: getRecentPrioritizationFees (cache corto, precalentable)
+# - Fees muestreadas sobre pool + vaults del VIP (cuentas con write-lock), no sobre los mints
+# - Registro por TX enviada: slot de envío y slot de aterrizaje (tabla fee_landing en DB_NAME)
+#   El envío se escribe en un hilo; el aterrizaje lo reportan las confirmaciones (Difusion, trader, swap_real)
+# - Perfiles: entry (compra) < exit (venta) < forced (salida_forzada)
+# precio = percentil(fees recientes) × factor(latencia observada / objetivo), acotado por perfil.
+
+import time, sqlite3, threading, statistics
+
+import swap_exec
+from config import DB_NAME
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+# target_slots: latencia objetivo (slot aterrizaje - slot envío)
+# pct: percentil de fees recientes usado como base
+PERFILES = {
+    "entry":  {"target_slots": 4, "pct": 50, "min": 2_000,  "max": 60_000,  "default": 9_000},
+    "exit":   {"target_slots": 2, "pct": 75, "min": 5_000,  "max": 150_000, "default": 15_000},
+    "forced": {"target_slots": 2, "pct": 90, "min": 10_000, "max": 400_000, "default": 30_000},
+}
+
+FEES_TTL       = 8.0      # s de validez del muestreo de fees recientes
+FEES_TIMEOUT   = 1.0      # s máx. de espera por el muestreo en el camino crítico
+HIST_WINDOW_S  = 900      # ventana de historial de aterrizaje (15 min)
+HIST_MIN_N     = 3        # mínimo de muestras para corregir por latencia
+ATERRIZADAS_TTL = 60.0    # s que se guarda un aterrizaje a la espera del registro de su envío
+
+_fees_cache = {}          # key(tuple cuentas) -> (ts_monotonic, [fees])
+_fees_inflight = {}       # key -> threading.Event
+_aterrizadas = {}         # sig -> (slot_landed, ts_monotonic) confirmadas antes de escribir su envío
+_pools = {}               # mint -> cuentas del pool VIP (write-locked por el swap)
+_lock = threading.Lock()
+_reg_lock = threading.Lock()   # registro envío/aterrizaje (fee_landing + _aterrizadas)
+
+# ===== RPC =====
+_rpc = swap_exec.rpc
+
+def slot_actual(commitment="processed"):
+    try:
+        return int(_rpc("getSlot", [{"commitment": commitment}]))
+    except Exception as e:
+        emit("fee_slot_error", err=str(e))
+        return None
+
+# ===== Fees recientes =====
+def cuentas_pool(mint: str, *extra) -> list:
+    """
+    Cuentas que el swap bloquea en escritura (pool + vaults del VIP) para muestrear fees. Los mints
+    no se bloquean en escritura; sin pool conocido se usan 'mint' y 'extra' como antes.
+    """
+    mint = str(mint)
+    if mint not in _pools:
+        try:
+            with sqlite3.connect(DB_NAME, timeout=2) as con:
+                row = con.execute("SELECT pool_id, vault_usdc, vault_token FROM vip_tokens WHERE address=?",
+                                  (mint,)).fetchone()
+            _pools[mint] = [c for c in (row or ()) if c]
+        except Exception as e:
+            emit("fee_pool_lookup_error", err=str(e))
+            return [mint, *extra]
+    return list(_pools[mint]) or [mint, *extra]
+
+def _key(cuentas):
+    return tuple(sorted({str(c) for c in (cuentas or []) if c}))
+
+def _fetch_fees(key):
+    try:
+        res = _rpc("getRecentPrioritizationFees", [list(key)] if key else [])
+        fees = [int(x.get("prioritizationFee") or 0) for x in (res or [])]
+        with _lock:
+            _fees_cache[key] = (time.monotonic(), fees)
+        emit("fee_recent_ok", n=len(fees), cuentas=len(key))
+    except Exception as e:
+        emit("fee_recent_error", err=str(e))
+    finally:
+        with _lock:
+            ev = _fees_inflight.pop(key, None)
+        if ev:
+            ev.set()
+
+def precalentar(cuentas):
+    """Lanza el muestreo de fees en segundo plano (idempotente mientras esté en vuelo)."""
+    key = _key(cuentas)
+    with _lock:
+        hit = _fees_cache.get(key)
+        if (hit and time.monotonic() - hit[0] < FEES_TTL) or key in _fees_inflight:
+            return
+        _fees_inflight[key] = threading.Event()
+    threading.Thread(target=_fetch_fees, args=(key,), daemon=True).start()
+
+def fees_recientes(cuentas, timeout=FEES_TIMEOUT):
+    key = _key(cuentas)
+    precalentar(cuentas)
+    with _lock:
+        ev = _fees_inflight.get(key)
+    if ev:
+        ev.wait(timeout)
+    with _lock:
+        hit = _fees_cache.get(key)
+    return hit[1] if hit else []
+
+def _percentil(xs, p):
+    xs = sorted(xs)
+    if not xs:
+        return None
+    k = (len(xs) - 1) * (p / 100.0)
+    f = int(k); c = min(f + 1, len(xs) - 1)
+    return xs[f] + (xs[c] - xs[f]) * (k - f)
+
+# ===== Historial de aterrizaje =====
+def _db():
+    con = sqlite3.connect(DB_NAME, timeout=2)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS fee_landing(
+          sig          TEXT PRIMARY KEY,
+          perfil       TEXT NOT NULL,
+          cu_price     INTEGER NOT NULL,
+          slot_sent    INTEGER,
+          slot_landed  INTEGER,
+          ts_sent      REAL NOT NULL
+        )
+    """)
+    return con
+
+def _registrar_envio(sig, perfil, cu_price, slot_sent, ts_sent):
+    if slot_sent is None:
+        slot_sent = slot_actual()
+    try:
+        with _reg_lock:
+            slot_landed = (_aterrizadas.pop(str(sig), None) or (None,))[0]
+            with _db() as con:
+                con.execute("INSERT OR REPLACE INTO fee_landing(sig, perfil, cu_price, slot_sent, slot_landed, ts_sent) VALUES (?,?,?,?,?,?)",
+                            (str(sig), perfil, int(cu_price), slot_sent, slot_landed, ts_sent))
+        emit("fee_send_recorded", sig=str(sig), perfil=perfil, cu_price=int(cu_price), slot_sent=slot_sent)
+    except Exception as e:
+        emit("fee_record_error", err=str(e))
+
+def registrar_envio(sig: str, perfil: str, cu_price: int, slot_sent: int | None = None):
+    """
+    Guarda la TX enviada sin bloquear al llamador (getSlot + sqlite en un hilo propio). El hilo no es
+    daemon: un proceso CLI que termina tras enviar no pierde el registro.
+    """
+    if not sig:
+        return
+    threading.Thread(target=_registrar_envio, args=(sig, perfil, cu_price, slot_sent, time.time())).start()
+
+def registrar_landing(sig: str, slot_landed: int | None):
+    """Slot de aterrizaje de una TX confirmada. Si su envío aún no está escrito se guarda para él."""
+    if not sig or not slot_landed:
+        return
+    try:
+        with _reg_lock:
+            with _db() as con:
+                n = con.execute("UPDATE fee_landing SET slot_landed=? WHERE sig=? AND slot_landed IS NULL",
+                                (int(slot_landed), str(sig))).rowcount
+            if not n:
+                ahora = time.monotonic()
+                for k in [k for k, (_, t) in _aterrizadas.items() if ahora - t > ATERRIZADAS_TTL]:
+                    del _aterrizadas[k]
+                _aterrizadas[str(sig)] = (int(slot_landed), ahora)
+    except Exception as e:
+        emit("fee_record_error", err=str(e))
+
+def resolver_pendientes(max_rows=64):
+    """Completa slot_landed de envíos recientes con un único getSignatureStatuses."""
+    try:
+        with _db() as con:
+            rows = con.execute("SELECT sig FROM fee_landing WHERE slot_landed IS NULL AND ts_sent>=? ORDER BY ts_sent DESC LIMIT ?",
+                               (time.time() - HIST_WINDOW_S, max_rows)).fetchall()
+        sigs = [r[0] for r in rows]
+        if not sigs:
+            return 0
+        res = _rpc("getSignatureStatuses", [sigs, {"searchTransactionHistory": True}])   # en segundo plano: firmas fuera del status cache
+        n = 0
+        for sig, st in zip(sigs, (res or {}).get("value") or []):
+            if st and st.get("slot") and st.get("err") is None:
+                registrar_landing(sig, st["slot"])
+                n += 1
+        emit("fee_landing_resolved", n=n, pending=len(sigs))
+        return n
+    except Exception as e:
+        emit("fee_landing_error", err=str(e))
+        return 0
+
+def latencia_slots(perfil: str):
+    try:
+        with _db() as con:
+            rows = con.execute("""
+                SELECT slot_landed - slot_sent FROM fee_landing
+                WHERE perfil=? AND slot_landed IS NOT NULL AND slot_sent IS NOT NULL AND ts_sent>=?
+                ORDER BY ts_sent DESC LIMIT 30
+            """, (perfil, time.time() - HIST_WINDOW_S)).fetchall()
+        xs = [max(0, int(r[0])) for r in rows]
+        return statistics.median(xs) if len(xs) >= HIST_MIN_N else None
+    except Exception:
+        return None
+
+# ===== Selección =====
+def cu_price(perfil: str, cuentas=None) -> int:
+    """Precio por CU (µlamports) para el perfil dado y las cuentas que toca la TX."""
+    cfg = PERFILES.get(perfil) or PERFILES["entry"]
+    fees = [f for f in fees_recientes(cuentas) if f > 0]
+    base = _percentil(fees, cfg["pct"]) or cfg["default"]
+
+    lat = latencia_slots(perfil)
+    factor = 1.0
+    if lat is not None:
+        # tarde → subir (hasta 3x); holgado → bajar (hasta 0.6x)
+        factor = max(0.6, min(3.0, 1.0 + 0.5 * (lat - cfg["target_slots"]) / max(1, cfg["target_slots"])))
+
+    price = int(max(cfg["min"], min(cfg["max"], base * factor)))
+    emit("fee_cu_price", perfil=perfil, base=int(base), factor=round(factor, 3), lat_slots=lat,
+         n_fees=len(fees), cu_price=price)
+    return price
+
+# Completa aterrizajes pendientes en segundo plano al importar (el historial queda listo para cu_price)
+threading.Thread(target=resolver_pendientes, daemon=True).start()
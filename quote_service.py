@@ -0,0 +1,92 @@
+# quote_service.py — Servicio local de quotes compartido entre procesos (cache TTL + single-flight)
+# - Servidor TCP en 127.0.0.1 (JSON por línea): {"params", "timeout", "headers", "attempts"} -> {"status": int, "text": str}
+# - Dentro del servidor: swap_exec.quote_local (cache ~2 slots, coalesce de peticiones idénticas en vuelo)
+# - Cliente pedir(): conexión corta con timeout de conexión mínimo; si no hay servidor devuelve None
+#   y el llamador usa su cache en proceso (sin reintentar el socket durante DOWN_SECS).
+#   Una respuesta lenta de Jupiter no es "servicio caído": vuelve como 504 sin repetir el GET
+# Lanzado por main_master al arrancar; también: python quote_service.py
+
+import os, json, time, socket, socketserver
+
+import swap_exec
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+HOST         = "127.0.0.1"
+PORT         = int(os.getenv("APOLLO_QUOTE_PORT", "47011"))
+CONNECT_S    = 0.05     # s de conexión al servicio local
+DOWN_SECS    = 5.0      # tras un fallo de conexión no se reintenta el socket durante este tiempo
+HABILITADO   = os.getenv("APOLLO_QUOTE_SERVICE", "1") != "0"
+
+_down_until = 0.0
+
+# ===== Cliente =====
+def _leer_linea(sock) -> bytes:
+    buf = bytearray()
+    while not buf.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+def pedir(params: dict, timeout=6, headers=None, attempts=1):
+    """
+    RespuestaCacheada desde el servicio, o None si no está disponible (solo un fallo de conexión
+    marca el servicio caído). Si Jupiter tarda más que 'timeout' se devuelve un 504: repetir el
+    GET en proceso solo duplicaría la espera.
+    """
+    global _down_until
+    if not HABILITADO or time.monotonic() < _down_until:
+        return None
+    try:
+        s = socket.create_connection((HOST, PORT), timeout=CONNECT_S)
+    except OSError as e:
+        _down_until = time.monotonic() + DOWN_SECS
+        emit("quote_service_down", err=str(e))
+        return None
+    try:
+        with s:
+            s.settimeout(timeout * max(1, int(attempts)) + 1.0)
+            s.sendall(json.dumps({"params": params, "timeout": timeout, "headers": dict(headers) if headers else None,
+                                  "attempts": attempts}).encode() + b"\n")
+            resp = json.loads(_leer_linea(s))
+        if "error" in resp:
+            raise RuntimeError(resp["error"])
+        return swap_exec.RespuestaCacheada(resp["status"], resp["text"], "quote_service")
+    except socket.timeout:
+        emit("quote_service_timeout", timeout=timeout)
+        return swap_exec.RespuestaCacheada(504, "", "quote_service")
+    except Exception as e:
+        emit("quote_service_error", err=str(e))
+        return None
+
+# ===== Servidor =====
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline())
+            r = swap_exec.quote_local(req["params"], timeout=float(req.get("timeout") or 6),
+                                      headers=req.get("headers"), attempts=int(req.get("attempts") or 1))
+            out = {"status": r.status_code, "text": r.text}
+        except Exception as e:
+            out = {"error": str(e)}
+        self.wfile.write(json.dumps(out).encode() + b"\n")
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def servir():
+    with _Server((HOST, PORT), _Handler) as srv:
+        print(f"quote_service escuchando en {HOST}:{PORT} (ttl={swap_exec.QUOTE_TTL}s)")
+        emit("quote_service_start", port=PORT)
+        srv.serve_forever()
+
+if __name__ == "__main__":
+    servir()
@@ -0,0 +1,305 @@
+# raydium_directo.py — Swap directo contra el pool Raydium del VIP (CPMM / AMM v4), sin /quote ni /swap de Jupiter
+# - Cuentas estáticas del pool (vaults, mints, programas, amm_config / market OpenBook) cacheadas por proceso
+# - Reservas: las que ya transmite el trader (vaults por WS) o un getMultipleAccounts (pool + vaults)
+# - min_out local: producto constante con el fee del pool; TX v0 firmada con blockhash cacheado
+# - Chequeo previo por simulación (swap_exec.ajustar_cu); cualquier fallo → el llamador sigue con Jupiter
+# - Cuentas auxiliares (wSOL, ATA de salida) solo si wallet_prep no las tiene ya preparadas
+# - Modelo local (estimar/desvio_bps): impacto esperado y contraste de quotes de Jupiter contra el pool
+# Usado por el trader (compra) y swap_real (venta).
+
+import os, threading
+from base64 import b64decode
+
+from solders.pubkey import Pubkey
+from solders.instruction import Instruction, AccountMeta
+from solders.message import MessageV0
+from solders.transaction import VersionedTransaction
+from solders.compute_budget import set_compute_unit_limit, set_compute_unit_price
+
+import swap_exec
+import balances
+import wallet_prep
+from config import keypair, wallet_pubkey
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+CPMM_PROGRAM     = "CPMMoo8L3F4NbTegBCKVNunggL7H1ZpdTHKxQB5qKP1C"
+AMM_V4_PROGRAM   = "675kPX9MHTjS2zt1qfr1NYHuzeLXfQM9H24wFSUt1Mp8"
+AMM_V4_AUTHORITY = "5Q544fKrFoe6tsEbD7S8EmxGTJYAKtTVhAW5Q5pge4j1"
+SOL_MINT         = swap_exec.SOL_MINT
+
+HABILITADO   = os.getenv("APOLLO_DIRECTO", "1") != "0"
+CU_LIMIT     = 200_000     # inicial; ajustar_cu lo reduce al consumo simulado
+CPMM_FEE_DEN = 1_000_000
+
+_DISC_SWAP_BASE_INPUT = bytes.fromhex("8fbe5adac41e33de")   # sha256("global:swap_base_input")[:8]
+
+_pools = {}
+_lock = threading.Lock()
+
+def _pk(data: bytes, off: int) -> str:
+    return str(Pubkey.from_bytes(data[off:off + 32]))
+
+def _u64(data: bytes, off: int) -> int:
+    return int.from_bytes(data[off:off + 8], "little")
+
+def _cuentas(addrs):
+    res = swap_exec.rpc("getMultipleAccounts", [list(addrs), {"encoding": "base64", "commitment": "processed"}], timeout=3.0)
+    vals = (res or {}).get("value") or [None] * len(addrs)
+    return [(a["owner"], b64decode(a["data"][0])) if a else (None, b"") for a in vals]
+
+# ===== Estado del pool =====
+class Pool:
+    """Cuentas de un pool hop=1 y su fórmula de salida. 'desc' = lo que hay en los vaults y no es reserva."""
+
+    def __init__(self, pool_id: str, tipo: str):
+        self.id = pool_id
+        self.tipo = tipo                 # "CPMM" | "AMM_V4"
+        self.mints = (None, None)
+        self.vaults = (None, None)
+        self.programas = (balances.TOKEN_PROGRAM, balances.TOKEN_PROGRAM)
+        self.desc = (0, 0)
+        self.fee_num, self.fee_den = 0, 1
+        self.extra = {}
+
+    def lado(self, mint_in: str) -> int:
+        """Índice (0/1) del mint de entrada en el pool."""
+        if mint_in == self.mints[0]:
+            return 0
+        if mint_in == self.mints[1]:
+            return 1
+        raise ValueError(f"mint {mint_in} no pertenece al pool {self.id}")
+
+    def salida(self, amount_in: int, r_in: int, r_out: int) -> int:
+        """Producto constante con fee sobre la entrada (redondeo del programa: fee hacia arriba, salida hacia abajo)."""
+        fee = -(-amount_in * self.fee_num // self.fee_den)
+        neto = amount_in - fee
+        if neto <= 0 or r_in <= 0 or r_out <= 0:
+            return 0
+        return neto * r_out // (r_in + neto)
+
+def _parse_cpmm(pool_id, data) -> Pool:
+    p = Pool(pool_id, "CPMM")
+    p.vaults = (_pk(data, 72), _pk(data, 104))
+    p.mints = (_pk(data, 168), _pk(data, 200))
+    p.programas = (_pk(data, 232), _pk(data, 264))
+    p.desc = (_u64(data, 341) + _u64(data, 357), _u64(data, 349) + _u64(data, 365))
+    amm_config = _pk(data, 8)
+    (_, cfg), = _cuentas([amm_config])
+    p.fee_num, p.fee_den = _u64(cfg, 12), CPMM_FEE_DEN
+    p.extra = {
+        "amm_config": amm_config,
+        "observation": _pk(data, 296),
+        "authority": str(Pubkey.find_program_address([b"vault_and_lp_mint_auth_seed"], Pubkey.from_string(CPMM_PROGRAM))[0]),
+    }
+    return p
+
+def _parse_amm_v4(pool_id, data) -> Pool:
+    p = Pool(pool_id, "AMM_V4")
+    p.vaults = (_pk(data, 336), _pk(data, 368))      # coin (base), pc (quote)
+    p.mints = (_pk(data, 400), _pk(data, 432))
+    p.desc = (_u64(data, 192), _u64(data, 200))      # base/quote need_take_pnl
+    p.fee_num, p.fee_den = _u64(data, 176), _u64(data, 184)
+    market, market_prog = _pk(data, 528), _pk(data, 560)
+    (_, m), = _cuentas([market])
+    signer = Pubkey.create_program_address([bytes(Pubkey.from_string(market)), m[45:53]],
+                                           Pubkey.from_string(market_prog))
+    p.extra = {
+        "open_orders": _pk(data, 496), "target_orders": _pk(data, 592),
+        "market": market, "market_program": market_prog,
+        "bids": _pk(m, 285), "asks": _pk(m, 317), "event_queue": _pk(m, 253),
+        "m_base_vault": _pk(m, 117), "m_quote_vault": _pk(m, 165), "vault_signer": str(signer),
+    }
+    return p
+
+def pool(pool_id: str) -> Pool:
+    """Pool cacheado (un getMultipleAccounts + config/market la primera vez)."""
+    p = _pools.get(pool_id)
+    if p is not None:
+        return p
+    with swap_exec.stage("direct_pool_load"):
+        (owner, data), = _cuentas([pool_id])
+        if owner == CPMM_PROGRAM:
+            p = _parse_cpmm(pool_id, data)
+        elif owner == AMM_V4_PROGRAM:
+            p = _parse_amm_v4(pool_id, data)
+        else:
+            raise ValueError(f"pool {pool_id} con programa no soportado: {owner}")
+    with _lock:
+        _pools[pool_id] = p
+    emit("direct_pool_loaded", pool=pool_id, tipo=p.tipo, fee=f"{p.fee_num}/{p.fee_den}")
+    return p
+
+def reservas(p: Pool, vaults: dict | None = None):
+    """
+    (r0, r1) netas. 'vaults' = {vault: raw} del feed del trader; si falta alguno se leen pool + vaults
+    (el pool también refresca lo que se descuenta: fees de protocolo / pnl pendiente).
+    """
+    if vaults and all(vaults.get(v) is not None for v in p.vaults):
+        brutas = [int(vaults[v]) for v in p.vaults]
+        via = "feed"
+    else:
+        (_, pd), (_, v0), (_, v1) = _cuentas([p.id, *p.vaults])
+        brutas = [_u64(v, balances.OFF_AMOUNT) if len(v) >= balances.OFF_AMOUNT + 8 else 0 for v in (v0, v1)]
+        if p.tipo == "CPMM" and len(pd) >= 373:
+            p.desc = (_u64(pd, 341) + _u64(pd, 357), _u64(pd, 349) + _u64(pd, 365))
+        elif p.tipo == "AMM_V4" and len(pd) >= 208:
+            p.desc = (_u64(pd, 192), _u64(pd, 200))
+        via = "rpc"
+    r = (max(0, brutas[0] - p.desc[0]), max(0, brutas[1] - p.desc[1]))
+    emit("direct_reserves", pool=p.id, via=via, r0=r[0], r1=r[1])
+    return r
+
+def cotizar(p: Pool, mint_in: str, amount_in: int, vaults: dict | None = None) -> int:
+    """outAmount local (raw) para amount_in del mint de entrada."""
+    i = p.lado(mint_in)
+    r = reservas(p, vaults)
+    return p.salida(int(amount_in), r[i], r[1 - i])
+
+# ===== Modelo local =====
+def estimar(pool_id: str, mint_in: str, amount_in: int, vaults: dict | None = None):
+    """
+    Quote local del pool: {pool, mint_out, out, impacto, fee_bps}. 'impacto' = fracción de precio
+    movida por la entrada neta (misma definición que priceImpactPct). None si el pool no se puede leer.
+    """
+    try:
+        p = pool(pool_id)
+        i = p.lado(mint_in)
+        r = reservas(p, vaults)
+        neto = int(amount_in) - -(-int(amount_in) * p.fee_num // p.fee_den)
+        est = {
+            "pool": pool_id, "mint_out": p.mints[1 - i],
+            "out": p.salida(int(amount_in), r[i], r[1 - i]),
+            "impacto": neto / (r[i] + neto) if r[i] > 0 else 1.0,
+            "fee_bps": p.fee_num * 10_000 / p.fee_den,
+        }
+        emit("local_quote", pool=pool_id, amount_in=int(amount_in), out=est["out"],
+             impacto=round(est["impacto"], 6), fee_bps=est["fee_bps"])
+        return est
+    except Exception as e:
+        emit("local_quote_error", pool=pool_id, err=str(e))
+        return None
+
+def desvio_bps(quote: dict, est: dict | None):
+    """outAmount de Jupiter vs. el modelo local (bps, positivo = Jupiter promete más). None si no es el mismo pool."""
+    rp = (quote or {}).get("routePlan") or []
+    if not est or not est["out"] or len(rp) != 1:
+        return None
+    info = rp[0].get("swapInfo") or {}
+    if info.get("ammKey") != est["pool"] or quote.get("outputMint") != est["mint_out"]:
+        return None
+    return int(round((int(quote.get("outAmount") or 0) / est["out"] - 1) * 10_000))
+
+# ===== Instrucciones =====
+def _meta(addr, signer=False, writable=False):
+    return AccountMeta(Pubkey.from_string(str(addr)), signer, writable)
+
+def _cuentas_previas(p: Pool, i: int, amount_in: int):
+    """
+    Instrucciones previas al swap y si hay que cerrar el wSOL al final. Con wSOL persistente
+    (wallet_prep) y ATA de salida ya creada, la TX lleva solo compute budget + swap.
+    """
+    o = 1 - i
+    pre, cerrar = [], False
+    saldo = wallet_prep.saldo_wsol() if SOL_MINT in (p.mints[i], p.mints[o]) else None
+    if p.mints[i] == SOL_MINT:
+        if saldo is None:                                   # sin wSOL persistente: envolver y cerrar al final
+            pre += [wallet_prep.ix_crear_ata(SOL_MINT)] + wallet_prep.ix_envolver(amount_in)
+            cerrar = True
+        elif saldo < amount_in:                             # completar solo lo que falta
+            pre += wallet_prep.ix_envolver(amount_in - saldo)
+    if p.mints[o] == SOL_MINT:
+        if saldo is None:
+            pre.append(wallet_prep.ix_crear_ata(SOL_MINT))
+            cerrar = True                                   # si existe, el producto queda envuelto
+    elif not wallet_prep.ata_lista(p.mints[o]):
+        pre.append(wallet_prep.ix_crear_ata(p.mints[o], p.programas[o]))
+    return pre, cerrar
+
+def _ix_swap(p: Pool, i: int, amount_in: int, min_out: int):
+    owner = str(wallet_pubkey)
+    o = 1 - i
+    src = balances.ata(p.mints[i], owner, p.programas[i])
+    dst = balances.ata(p.mints[o], owner, p.programas[o])
+    if p.tipo == "CPMM":
+        x = p.extra
+        metas = [
+            _meta(owner, True), _meta(x["authority"]), _meta(x["amm_config"]), _meta(p.id, writable=True),
+            _meta(src, writable=True), _meta(dst, writable=True),
+            _meta(p.vaults[i], writable=True), _meta(p.vaults[o], writable=True),
+            _meta(p.programas[i]), _meta(p.programas[o]), _meta(p.mints[i]), _meta(p.mints[o]),
+            _meta(x["observation"], writable=True),
+        ]
+        data = _DISC_SWAP_BASE_INPUT + int(amount_in).to_bytes(8, "little") + int(min_out).to_bytes(8, "little")
+        return Instruction(Pubkey.from_string(CPMM_PROGRAM), data, metas)
+    x = p.extra
+    metas = [
+        _meta(balances.TOKEN_PROGRAM), _meta(p.id, writable=True), _meta(AMM_V4_AUTHORITY),
+        _meta(x["open_orders"], writable=True), _meta(x["target_orders"], writable=True),
+        _meta(p.vaults[0], writable=True), _meta(p.vaults[1], writable=True),
+        _meta(x["market_program"]), _meta(x["market"], writable=True),
+        _meta(x["bids"], writable=True), _meta(x["asks"], writable=True), _meta(x["event_queue"], writable=True),
+        _meta(x["m_base_vault"], writable=True), _meta(x["m_quote_vault"], writable=True), _meta(x["vault_signer"]),
+        _meta(src, writable=True), _meta(dst, writable=True), _meta(owner, True),
+    ]
+    data = bytes([9]) + int(amount_in).to_bytes(8, "little") + int(min_out).to_bytes(8, "little")   # SwapBaseIn
+    return Instruction(Pubkey.from_string(AMM_V4_PROGRAM), data, metas)
+
+def _min_out(out_est: int, slippage_bps: int) -> int:
+    return max(1, out_est * (10_000 - int(slippage_bps)) // 10_000)
+
+# ===== Swap =====
+def swap(pool_id: str, mint_in: str, amount_in: int, slippage_bps: int, cu_price: int,
+         vaults: dict | None = None, lado: str = "direct", precio_max: int | None = None, kp=None):
+    """
+    Construye, simula, firma y difunde el swap directo. Devuelve dict
+    {sig, difusion, out_est, min_out, mint_out, tipo} o None (el llamador sigue con Jupiter).
+    """
+    if not HABILITADO or not pool_id:
+        return None
+    try:
+        p = pool(pool_id)
+        i = p.lado(mint_in)
+        o = 1 - i
+        with swap_exec.stage("direct_quote", pool=pool_id):
+            r = reservas(p, vaults)
+            out_est = p.salida(int(amount_in), r[i], r[o])
+        if out_est <= 0:
+            emit("direct_skip", pool=pool_id, reason="out<=0")
+            return None
+        min_out = _min_out(out_est, slippage_bps)
+
+        ixs = [set_compute_unit_limit(CU_LIMIT), set_compute_unit_price(int(cu_price))]
+        payer = Pubkey.from_string(str(wallet_pubkey))
+        pre, cerrar = _cuentas_previas(p, i, int(amount_in))
+        ixs += pre
+        ixs.append(_ix_swap(p, i, amount_in, min_out))
+        if cerrar:
+            ixs.append(wallet_prep.ix_cerrar(wallet_prep.wsol_ata()))   # unwrap
+
+        with swap_exec.stage("direct_sign"):
+            bh, last_valid = swap_exec.blockhash_cache.get()
+            msg = MessageV0.try_compile(payer, ixs, [], bh)
+            raw = bytes(VersionedTransaction(msg, [swap_exec._solders_kp(kp or keypair)]))
+        if len(raw) > swap_exec.PACKET_DATA_SIZE:
+            emit("direct_skip", pool=pool_id, reason="tx_size", raw_len=len(raw))
+            return None
+
+        raw, cu = swap_exec.ajustar_cu(raw, f"{lado}:direct-{p.tipo}", kp, precio_max=precio_max)
+        if cu["err"] is not None:
+            emit("direct_sim_failed", pool=pool_id, err=str(cu["err"]))
+            return None
+
+        d = swap_exec.broadcast(raw, label=f"[DIRECT][{p.tipo}] SEND", last_valid_block_height=last_valid)
+        emit("direct_sent", pool=pool_id, tipo=p.tipo, sig=d.sig, rpc=d.endpoint,
+             amount_in=int(amount_in), out_est=out_est, min_out=min_out, cu_limit=cu["cu_limit"])
+        return {"sig": d.sig, "difusion": d, "out_est": out_est, "min_out": min_out,
+                "mint_out": p.mints[o], "tipo": p.tipo, "cu_price": cu["cu_price"] or int(cu_price)}
+    except Exception as e:
+        emit("direct_error", pool=pool_id, err=str(e))
+        return None
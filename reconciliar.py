@@ -0,0 +1,174 @@
+# reconciliar.py — Precio real de ejecución (fill) desde la metadata de la TX confirmada
+# - Un getTransaction por firma: deltas exactos de pre/postTokenBalances del owner
+# - Contrapartida USDC (token balances) o SOL (lamports nativos + wSOL, sin fee ni rent de ATA nueva)
+# - Escribe en operaciones: tx, fill, fee (lamports) y slippage vs. precio de decisión (bps)
+# Usado por el trader (entrada, en segundo plano) y swap_real (salida).
+
+import time, sqlite3
+
+import swap_exec
+from config import DB_NAME, wallet_pubkey
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+USDC_MINT = swap_exec.USDC_MINT
+SOL_MINT  = swap_exec.SOL_MINT
+ATA_RENT_LAMPORTS = 2_039_280     # rent-exempt de una token account (165 bytes)
+PRICE_V3_URL = "https://lite-api.jup.ag/price/v3"
+
+GETTX_INTENTOS = 6                # getTransaction puede devolver null unos instantes tras confirmar
+GETTX_PAUSA    = 0.5
+
+# Columnas que se añaden a operaciones si faltan
+_COLS = {
+    "tx_entrada": "TEXT", "tx_salida": "TEXT",
+    "fill_entrada": "REAL", "fill_salida": "REAL",
+    "fee_entrada_lamports": "INTEGER", "fee_salida_lamports": "INTEGER",
+    "slippage_entrada_bps": "INTEGER", "slippage_salida_bps": "INTEGER",
+}
+
+# ===== Transacción =====
+def obtener_tx(sig: str):
+    for i in range(GETTX_INTENTOS):
+        try:
+            tx = swap_exec.rpc("getTransaction", [str(sig), {
+                "encoding": "json", "commitment": "confirmed", "maxSupportedTransactionVersion": 0
+            }], timeout=5.0)
+            if tx:
+                return tx
+        except Exception as e:
+            emit("reconcile_gettx_error", sig=str(sig), err=str(e), intento=i+1)
+        time.sleep(GETTX_PAUSA * (i + 1))
+    return None
+
+def _token_deltas(meta, owner):
+    """{mint: (delta_raw, decimals, existia_antes)} para las token accounts del owner."""
+    pre, post = {}, {}
+    for lst, dst in ((meta.get("preTokenBalances") or [], pre), (meta.get("postTokenBalances") or [], post)):
+        for b in lst:
+            if b.get("owner") != owner:
+                continue
+            ta = b.get("uiTokenAmount") or {}
+            k = (b.get("accountIndex"), b.get("mint"))
+            dst[k] = (int(ta.get("amount") or 0), ta.get("decimals"))
+    out = {}
+    for k in set(pre) | set(post):
+        mint = k[1]
+        a0, d0 = pre.get(k, (0, None))
+        a1, d1 = post.get(k, (0, None))
+        d, dec, existia = out.get(mint, (0, d1 if d1 is not None else d0, False))
+        out[mint] = (d + a1 - a0, dec, existia or k in pre)
+    return out
+
+def fill_de_tx(sig: str, mint: str, owner=None, precio_sol: float | None = None):
+    """
+    Deltas exactos de la TX para 'mint' y su contrapartida.
+    Devuelve dict {token_raw, token_ui, counter, counter_ui, usd, precio_usd, fee_lamports, slot} o None.
+    """
+    owner = str(owner or wallet_pubkey)
+    tx = obtener_tx(sig)
+    if not tx:
+        emit("reconcile_tx_missing", sig=str(sig))
+        return None
+    meta = tx.get("meta") or {}
+    if meta.get("err") is not None:
+        emit("reconcile_tx_failed", sig=str(sig), err=str(meta.get("err")))
+        return None
+
+    deltas = _token_deltas(meta, owner)
+    if mint not in deltas or not deltas[mint][0]:
+        emit("reconcile_no_delta", sig=str(sig), mint=mint)
+        return None
+    tok_raw, tok_dec, tok_existia = deltas[mint]
+    tok_ui = abs(tok_raw) / (10 ** int(tok_dec or 0))
+    fee = int(meta.get("fee") or 0)
+
+    if USDC_MINT in deltas and deltas[USDC_MINT][0]:
+        counter = "USDC"
+        counter_ui = abs(deltas[USDC_MINT][0]) / 1e6
+        usd = counter_ui
+    else:
+        counter = "SOL"
+        keys = ((tx.get("transaction") or {}).get("message") or {}).get("accountKeys") or []
+        idx = keys.index(owner) if owner in keys else 0
+        lamports = int((meta.get("postBalances") or [0])[idx]) - int((meta.get("preBalances") or [0])[idx]) + fee
+        if tok_raw > 0 and not tok_existia:
+            lamports += ATA_RENT_LAMPORTS          # la compra creó la ATA: ese rent no es precio
+        if SOL_MINT in deltas:
+            lamports += deltas[SOL_MINT][0]        # wSOL persistente (si no se desenvolvió)
+        counter_ui = abs(lamports) / 1e9
+        px_sol = precio_sol or precio_sol_usd()
+        usd = counter_ui * px_sol if px_sol else None
+
+    out = {
+        "token_raw": tok_raw, "token_ui": tok_ui, "counter": counter, "counter_ui": counter_ui,
+        "usd": usd, "precio_usd": (usd / tok_ui) if (usd and tok_ui) else None,
+        "fee_lamports": fee, "slot": tx.get("slot"),
+    }
+    emit("reconcile_fill", sig=str(sig), mint=mint, **{k: v for k, v in out.items() if k != "slot"})
+    return out
+
+def precio_sol_usd(timeout=2.0):
+    try:
+        r = swap_exec.http_get(PRICE_V3_URL, params={"ids": SOL_MINT}, timeout=timeout)
+        j = r.json() or {}
+        return float(((j.get("data") or j).get(SOL_MINT) or {}).get("usdPrice") or 0) or None
+    except Exception as e:
+        emit("reconcile_sol_price_error", err=str(e))
+        return None
+
+# ===== DB =====
+def _asegurar_columnas(con):
+    cols = {r[1] for r in con.execute("PRAGMA table_info(operaciones)").fetchall()}
+    for c, t in _COLS.items():
+        if c not in cols:
+            con.execute(f"ALTER TABLE operaciones ADD COLUMN {c} {t}")
+
+def _slippage_bps(fill, decision, lado):
+    if not fill or not decision:
+        return None
+    # entrada: pagar más es peor; salida: recibir menos es peor (positivo = coste)
+    r = fill / decision - 1 if lado == "entrada" else decision / fill - 1
+    return int(round(r * 10_000))
+
+def reconciliar_entrada(op_id: int, sig: str, mint: str, precio_sol: float | None = None, db=DB_NAME):
+    """Fill real de la compra → operaciones (fill_entrada, fee, slippage vs price_entrada)."""
+    f = fill_de_tx(sig, mint, precio_sol=precio_sol)
+    try:
+        with sqlite3.connect(db, timeout=8) as con:
+            _asegurar_columnas(con)
+            row = con.execute("SELECT price_entrada FROM operaciones WHERE id=?", (op_id,)).fetchone()
+            decision = float(row[0] or 0) if row else 0
+            fill = f["precio_usd"] if f else None
+            con.execute("""
+                UPDATE operaciones SET tx_entrada=?, fill_entrada=?, fee_entrada_lamports=?, slippage_entrada_bps=?
+                WHERE id=?
+            """, (str(sig), fill, f["fee_lamports"] if f else None, _slippage_bps(fill, decision, "entrada"), op_id))
+        emit("reconcile_entry_ok", op_id=op_id, fill=fill, decision=decision)
+        return f
+    except Exception as e:
+        emit("reconcile_db_error", op_id=op_id, err=str(e))
+        return f
+
+def reconciliar_salida(op_id: int, sig: str, mint: str, precio_decision: float | None = None,
+                       precio_sol: float | None = None, db=DB_NAME):
+    """Fill real de la venta → operaciones (fill_salida, fee, slippage vs precio de decisión)."""
+    f = fill_de_tx(sig, mint, precio_sol=precio_sol)
+    try:
+        with sqlite3.connect(db, timeout=8) as con:
+            _asegurar_columnas(con)
+            fill = f["precio_usd"] if f else None
+            con.execute("""
+                UPDATE operaciones SET tx_salida=?, fill_salida=?, fee_salida_lamports=?, slippage_salida_bps=?
+                WHERE id=?
+            """, (str(sig), fill, f["fee_lamports"] if f else None, _slippage_bps(fill, precio_decision, "salida"), op_id))
+        emit("reconcile_exit_ok", op_id=op_id, fill=fill, decision=precio_decision)
+        return f
+    except Exception as e:
+        emit("reconcile_db_error", op_id=op_id, err=str(e))
+        return f
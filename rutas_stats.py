@@ -0,0 +1,200 @@
+# rutas_stats.py — Estadística de formas de quote (maxAccounts / directa) por mint y base de ruta
+# - Contadores por (address, base, forma): intentos → válidas (filtros + /swap) → enviadas → aterrizadas/fallidas
+#   (intentos = formas con resultado; las canceladas por perder la carrera no cuentan)
+# - candidatos(): ordena las formas por probabilidad de terminar en TX aterrizada y recorta cuando hay confianza
+# - Sin historial del mint se usa el agregado de la base (todas las mints); exploración ocasional con todas
+# - Escrituras en un hilo propio (cola + lotes): nunca en el camino de la compra
+# - Lectura desde contadores en memoria (carga única al importar + cada registrar): candidatos() no toca disco
+# Usado por compra_swap_usdc, compra_swap_sol y el trader (compra aterrizada).
+
+import time, queue, random, sqlite3, threading
+
+from config import DB_NAME
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+MIN_MUESTRAS    = 5       # intentos del mint para confiar en sus números (si no, agregado de la base)
+SCORE_CONFIANZA = 0.5     # con la mejor forma por encima de esto se piden solo MAX_CANDIDATOS
+SCORE_MIN       = 0.05    # formas con muestras suficientes y score menor se descartan
+MAX_CANDIDATOS  = 2
+EXPLORAR        = 0.10    # fracción de compras que dispara todas las formas (mantiene vivas las stats)
+FLUSH_S         = 1.0
+
+EVENTOS = ("intentos", "validas", "enviadas", "aterrizadas", "fallidas")
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS route_stats (
+    address     TEXT NOT NULL,
+    base        TEXT NOT NULL,
+    forma       TEXT NOT NULL,
+    intentos    INTEGER DEFAULT 0,
+    validas     INTEGER DEFAULT 0,
+    enviadas    INTEGER DEFAULT 0,
+    aterrizadas INTEGER DEFAULT 0,
+    fallidas    INTEGER DEFAULT 0,
+    updated_at  TEXT,
+    PRIMARY KEY (address, base, forma)
+)
+"""
+
+_cola = queue.Queue()
+_hilo = None
+_hilo_lock = threading.Lock()
+
+_mem_lock = threading.Lock()
+_propias  = {}   # (address, base) -> {forma: [contadores en orden EVENTOS]}
+_globales = {}   # base -> {forma: [contadores]} (agregado de todas las mints)
+
+def _sumar(address: str, base: str, forma: str, valores):
+    for dst in (_propias.setdefault((address, base), {}), _globales.setdefault(base, {})):
+        c = dst.setdefault(forma, [0] * len(EVENTOS))
+        for i, v in enumerate(valores):
+            c[i] += v
+
+# ===== Escritura (asíncrona) =====
+def registrar(address: str, base: str, forma: str, evento: str, n: int = 1):
+    """Suma n al contador 'evento' de la forma. Vuelve de inmediato."""
+    global _hilo
+    if evento not in EVENTOS:
+        return
+    with _mem_lock:
+        _sumar(str(address), base, forma, [int(n) if e == evento else 0 for e in EVENTOS])
+    _cola.put((str(address), base, forma, evento, int(n)))
+    if _hilo is None:
+        with _hilo_lock:
+            if _hilo is None:
+                _hilo = threading.Thread(target=_escritor, daemon=True)
+                _hilo.start()
+
+def con_registro(address: str, base: str, forma_de, cotizar, construir):
+    """
+    Envuelve cotizar(clave) / construir(clave, quote) de swap_exec.primera_construible para contar
+    'intentos' solo con resultado terminal: quote descartada o /swap terminado. Las formas que
+    pierden la carrera y se cancelan antes de construir no cuentan (no fallaron).
+    """
+    def _cotizar(k):
+        quote = None
+        try:
+            quote = cotizar(k)
+            return quote
+        finally:
+            if quote is None:
+                registrar(address, base, forma_de(k), "intentos")
+
+    def _construir(k, quote):
+        try:
+            return construir(k, quote)
+        finally:
+            registrar(address, base, forma_de(k), "intentos")
+
+    return _cotizar, _construir
+
+def _volcar(lote):
+    acc = {}
+    for address, base, forma, evento, n in lote:
+        d = acc.setdefault((address, base, forma), dict.fromkeys(EVENTOS, 0))
+        d[evento] += n
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    with sqlite3.connect(DB_NAME, timeout=8) as con:
+        con.execute(_DDL)
+        for (address, base, forma), d in acc.items():
+            con.execute("""
+                INSERT INTO route_stats (address, base, forma, intentos, validas, enviadas, aterrizadas, fallidas, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(address, base, forma) DO UPDATE SET
+                    intentos    = intentos    + excluded.intentos,
+                    validas     = validas     + excluded.validas,
+                    enviadas    = enviadas    + excluded.enviadas,
+                    aterrizadas = aterrizadas + excluded.aterrizadas,
+                    fallidas    = fallidas    + excluded.fallidas,
+                    updated_at  = excluded.updated_at
+            """, (address, base, forma, *(d[e] for e in EVENTOS), now))
+
+def _escritor():
+    while True:
+        lote = [_cola.get()]
+        time.sleep(FLUSH_S)
+        while True:
+            try:
+                lote.append(_cola.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _volcar(lote)
+        except Exception as e:
+            emit("route_stats_write_error", err=str(e), n=len(lote))
+
+def vaciar(timeout: float = 3.0):
+    """Espera (acotado) a que se escriba lo encolado; para procesos CLI que terminan tras la compra."""
+    t_end = time.monotonic() + timeout
+    while not _cola.empty() and time.monotonic() < t_end:
+        time.sleep(0.05)
+    if _hilo is not None:
+        time.sleep(min(FLUSH_S + 0.2, max(0.0, t_end - time.monotonic())))
+
+# ===== Lectura (memoria) =====
+def _cargar():
+    """Una lectura de route_stats al importar; lo demás llega por registrar()."""
+    try:
+        with sqlite3.connect(DB_NAME, timeout=2) as con:
+            con.execute(_DDL)
+            filas = con.execute(
+                "SELECT address, base, forma, intentos, validas, enviadas, aterrizadas, fallidas FROM route_stats").fetchall()
+    except Exception as e:
+        emit("route_stats_read_error", err=str(e))
+        return
+    with _mem_lock:
+        for address, base, forma, *vals in filas:
+            _sumar(address, base, forma, [int(v or 0) for v in vals])
+    emit("route_stats_loaded", n=len(filas))
+
+def _filas(address: str, base: str):
+    # (intentos, validas, enviadas, aterrizadas) por forma: del mint y agregado de la base
+    with _mem_lock:
+        propias = {f: tuple(c[:4]) for f, c in _propias.get((str(address), base), {}).items()}
+        globales = {f: tuple(c[:4]) for f, c in _globales.get(base, {}).items()}
+    return propias, globales
+
+def _score(intentos, validas, enviadas, aterrizadas) -> float:
+    # P(válida) · P(aterriza | enviada), con suavizado de Laplace
+    return (validas + 1) / (intentos + 2) * (aterrizadas + 1) / (enviadas + 2)
+
+def candidatos(address: str, base: str, formas: list, max_n: int = MAX_CANDIDATOS) -> list:
+    """
+    Formas a cotizar, de más a menos probable. Sin datos (o en exploración) devuelve 'formas' tal cual.
+    'formas' es la lista por defecto en su orden de preferencia; nunca devuelve una lista vacía.
+    """
+    if random.random() < EXPLORAR:
+        emit("route_stats_explore", address=address, base=base)
+        return list(formas)
+    try:
+        propias, globales = _filas(address, base)
+    except Exception as e:
+        emit("route_stats_read_error", err=str(e))
+        return list(formas)
+
+    stats = {}
+    for f in formas:
+        p = propias.get(f)
+        stats[f] = p if p and p[0] >= MIN_MUESTRAS else globales.get(f)
+    if not any(stats.values()):
+        return list(formas)
+
+    scores = {f: (_score(*s) if s else None) for f, s in stats.items()}
+    prior = {f: i for i, f in enumerate(formas)}
+    orden = sorted(formas, key=lambda f: (-(scores[f] if scores[f] is not None else 0.0), prior[f]))
+    vivas = [f for f in orden if scores[f] is None or stats[f][0] < MIN_MUESTRAS or scores[f] >= SCORE_MIN] or orden[:1]
+
+    mejor = scores[vivas[0]]
+    if mejor is not None and stats[vivas[0]][0] >= MIN_MUESTRAS and mejor >= SCORE_CONFIANZA:
+        vivas = vivas[:max_n]
+    emit("route_stats_candidates", address=address, base=base, formas=vivas,
+         scores={f: round(scores[f], 3) for f in vivas if scores[f] is not None})
+    return vivas
+
+_cargar()
@@ -1,22 +1,28 @@
-# salida_forzada.py — TOKEN -> SOL forzado (firma local con solana-py; asLegacyTransaction)
+# salida_forzada.py — TOKEN -> SOL forzado (firma local; TX v0 con address lookup tables)
+# HTTP/quote/build/sign/send vía swap_exec (pool compartido, sin handshake por llamada).
 # Uso:
-#   python salida_forzada.py <TOKEN_MINT> --max-intentos 6 --delay 3 --op-id 123 --debug --slippage-plan 30,60,100,150,200,300
+#   python salida_forzada.py <TOKEN_MINT> --max-intentos 6 --delay 3 --op-id 123 --debug --slippage-plan 30,60,100,150,200,300 [--local-ix] [--escalar-s 6]
+#   python salida_forzada.py --batch all|MINT1,MINT2 [--rps 10] [--local-ix]     (liquidación de varias posiciones)
 # Notas:
 #   - No cambia la columna 'estado' en DB.
 #   - Guarda siempre los txids aunque la confirmación demore.
-#   - Firma la transacción de Jupiter localmente (legacy).
+#   - Escala slippage por presupuesto de tiempo (--escalar-s); intentos previos siguen vivos, solo uno puede liquidar.
+#   - Firma la transacción de Jupiter localmente (v0).
+#   - Con wSOL persistente (wallet_prep) el SOL recibido queda envuelto; wallet_prep lo rebalancea.
 
-import os, sys, time, json, argparse, sqlite3, subprocess, random, traceback
-from base64 import b64decode
-import requests
-from decimal import Decimal, getcontext
+import os, sys, time, json, argparse, sqlite3, random, traceback, threading
 from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 from solana.publickey import PublicKey
-from solana.rpc.api import Client
-from solana.rpc.types import TokenAccountOpts, TxOpts
 from solana.keypair import Keypair as PyKeypair
-from solana.transaction import Transaction
+
+import swap_exec
+import balances
+import priority_fees
+import confirmaciones
+import notificar
+import wallet_prep
 
 # === Telemetry (no-op fallback) ===
 try:
@@ -27,11 +33,8 @@ except Exception:
 
 # === Config centralizada ===
 from config import (
-    client,              # solana.rpc.api.Client(...)
     wallet_pubkey,       # str o PublicKey
     JUPITER_API_KEY,
-    QUOTE_URL,           # "https://quote-api.jup.ag/v6/quote"
-    SWAP_URL,            # "https://quote-api.jup.ag/v6/swap"
     DB_NAME              # p.ej. "goodt.db"
 )
 
@@ -52,119 +55,17 @@ except Exception:
     except Exception:
         BIRDEYE_API_KEY = os.getenv("BIRDEYE_API_KEY", "")
 
-SOL_MINT = "So11111111111111111111111111111111111111112"
-getcontext().prec = 50
-
-# ---------- HTTP helpers (con telemetría) ----------
-def hget(url, headers=None, params=None, timeout=10):
-    t0 = perf_counter()
-    try:
-        r = requests.get(url, headers=headers or {}, params=params or {}, timeout=timeout)
-        emit("http_get", url=url, status=getattr(r, "status_code", None), dt_ms=int((perf_counter()-t0)*1000))
-        return r
-    except requests.RequestException as e:
-        emit("http_get_error", url=url, err=str(e))
-        return None
-
-def hpost(url, headers=None, json_body=None, timeout=20):
-    t0 = perf_counter()
-    try:
-        r = requests.post(url, headers=headers or {}, json=json_body or {}, timeout=timeout)
-        emit("http_post", url=url, status=getattr(r, "status_code", None), dt_ms=int((perf_counter()-t0)*1000))
-        return r
-    except requests.RequestException as e:
-        emit("http_post_error", url=url, err=str(e))
-        return None
-
-# ---------- RPC utils ----------
-def _value_list(resp):
-    if hasattr(resp, "value"): return resp.value
-    if isinstance(resp, dict): return (resp.get("result", {}) or {}).get("value", [])
-    return []
-
-def _item_pubkey(it):
-    if isinstance(it, dict): return it.get("pubkey") or ((it.get("account", {}) or {}).get("pubkey"))
-    return str(getattr(it, "pubkey", "")) or None
-
-def _safe_get_token_account_balance(cli: Client, pubkey_str: str):
-    try:
-        bal = cli.get_token_account_balance(PublicKey(pubkey_str))
-        if isinstance(bal, dict):
-            v = (bal.get("result", {}) or {}).get("value", {}) or {}
-            ui = v.get("uiAmount") ; dec = v.get("decimals") ; amt = v.get("amount")
-        else:
-            v = getattr(bal, "value", None)
-            ui = getattr(v, "ui_amount", None)
-            dec = getattr(v, "decimals", None)
-            amt = getattr(v, "amount", None)
-        ui_f = float(ui) if ui is not None else 0.0
-        amt_i = int(amt) if amt is not None else 0
-        return ui_f, amt_i, int(dec) if dec is not None else None
-    except Exception:
-        return 0.0, 0, None
-
-def _list_token_acc_pubkeys_by_mint(cli: Client, owner_pub: PublicKey, mint: PublicKey):
-    try:
-        resp = cli.get_token_accounts_by_owner_json_parsed(owner_pub, TokenAccountOpts(mint=mint))
-        vals = _value_list(resp)
-        pubs = []
-        for it in (vals or []):
-            pk = _item_pubkey(it)
-            if pk: pubs.append(pk)
-        return pubs
-    except Exception:
-        return []
+SOL_MINT = swap_exec.SOL_MINT
 
 # ---------- Balances ----------
-def get_token_balance_ui(cli: Client, owner_pub: PublicKey, mint: PublicKey):
-    total = 0.0
-    for pk in _list_token_acc_pubkeys_by_mint(cli, owner_pub, mint):
-        ui, _, _ = _safe_get_token_account_balance(cli, pk)
-        total += ui
-    return total
-
-def get_token_balance_raw(cli: Client, owner_pub: PublicKey, mint: PublicKey, decimals_hint: int | None = None) -> int:
-    pubs = _list_token_acc_pubkeys_by_mint(cli, owner_pub, mint)
-    if pubs:
-        total = 0
-        for pk in pubs:
-            _, amt, _ = _safe_get_token_account_balance(cli, pk)
-            total += int(amt)
-        return total
-    d = decimals_hint if (decimals_hint is not None) else 9
-    ui = get_token_balance_ui(cli, owner_pub, mint)
+def get_token_balance(owner_pub: PublicKey, mint: PublicKey):
+    """(raw, ui) de la ATA del owner en una sola consulta (balances)."""
     try:
-        return int(Decimal(str(ui)) * (Decimal(10) ** d))
-    except Exception:
-        return 0
-
-# ---------- Confirmación ----------
-def confirm_tx_sig(cli: Client, sig: str, max_wait_s=90, dbg=False):
-    emit("confirm_start", sig=sig, max_wait_s=max_wait_s)
-    start = time.time()
-    backoff = 0.5
-    while time.time() - start < max_wait_s:
-        try:
-            resp = cli.get_signature_statuses([sig])
-            vlist = _value_list(resp)
-            v = vlist[0] if vlist else None
-        except Exception:
-            v = None
-        if isinstance(v, dict):
-            err = v.get("err")
-            cstat = v.get("confirmationStatus")
-            confs = v.get("confirmations", 0) or 0
-            if dbg: print(f"[DEBUG] confirm: err={err} status={cstat} confs={confs}")
-            if err is None and (cstat in ("confirmed","finalized") or confs >= 1):
-                emit("confirm_ok", sig=sig, status=cstat, confirmations=confs)
-                return True
-            if err is not None:
-                emit("confirm_err", sig=sig, err=str(err))
-                return False
-        time.sleep(backoff)
-        backoff = min(backoff*1.7, 3.0)
-    emit("confirm_timeout", sig=sig)
-    return False
+        raw, ui, _ = balances.balance(str(mint), owner=str(owner_pub))
+        return raw, ui
+    except Exception as e:
+        emit("balance_error", err=str(e))
+        return None, 0.0
 
 # ---------- Keypair ----------
 def load_key_bytes():
@@ -211,13 +112,16 @@ def jup_quote(token_in: str, amount_raw: int, slippage_bps=30, dbg=False):
         "onlyDirectRoutes": "true",
         "direct": "true",                        # forzar hop=1
         "restrictIntermediateTokens": "true",    # sin intermedios
-        "asLegacyTransaction": "true",
         "platformFeeBps": "0"
     }
     hdr = {"Accept":"application/json"}
     if JUPITER_API_KEY: hdr["X-API-KEY"] = JUPITER_API_KEY
+    limitador.tomar()
     t0 = perf_counter()
-    r = hget(QUOTE_URL, headers=hdr, params=params, timeout=12)
+    try:
+        r = swap_exec.quote(params, timeout=12, headers=hdr, side="forced", slippage_bps=slippage_bps)
+    except Exception:
+        r = None
     emit("jup_quote_http", status=getattr(r,"status_code",None), dt_ms=int((perf_counter()-t0)*1000), amount_raw=amount_raw, slippage_bps=slippage_bps)
 
     # HTTP != 200: intenta extraer errorCode
@@ -291,18 +195,21 @@ def debug_print_quote(q: dict):
 
 # PATCH: swap siempre retorna firma como str
 def jup_swap(qresp: dict, user_pubkey: str, dbg=False):
-    body = {
-        "quoteResponse": qresp,
-        "userPublicKey": user_pubkey,
-        "wrapAndUnwrapSol": True,
-        "asLegacyTransaction": True,   # firmamos legacy
-        "dynamicComputeUnitLimit": True,
-        "prioritizationFeeLamports": None
-    }
     hdr = {"Content-Type":"application/json"}
     if JUPITER_API_KEY: hdr["X-API-KEY"] = JUPITER_API_KEY
+    cu_price = priority_fees.cu_price("forced", priority_fees.cuentas_pool(qresp.get("inputMint"), SOL_MINT))
+    limitador.tomar()
     t0 = perf_counter()
-    r = hpost(SWAP_URL, headers=hdr, json_body=body, timeout=20)
+    try:
+        r = swap_exec.build_swap(
+            qresp, timeout=20, headers=hdr, user_pubkey=user_pubkey, tags={"side": "forced"},
+            wrapAndUnwrapSol=not wallet_prep.wsol_lista(),   # wSOL persistente: el SOL queda envuelto
+            asLegacyTransaction=False,  # v0 + address lookup tables
+            dynamicComputeUnitLimit=True,
+            computeUnitPriceMicroLamports=cu_price,
+        )
+    except Exception:
+        r = None
     emit("jup_swap_http", status=getattr(r,"status_code",None), dt_ms=int((perf_counter()-t0)*1000))
     if not r or r.status_code != 200:
         if dbg: print(f"[DEBUG] swap_http status={getattr(r,'status_code','exc')}")
@@ -315,22 +222,25 @@ def jup_swap(qresp: dict, user_pubkey: str, dbg=False):
             if dbg: print("[DEBUG] swap_no_tx en respuesta")
             return None, "swap_no_tx", None
 
-        tx_bytes = b64decode(tx_b64)
         kp = load_keypair()
         if str(getattr(kp, "public_key", "")) != user_pubkey and dbg:
             print(f"[WARN] keypair pubkey {getattr(kp,'public_key','?')} != user_pubkey {user_pubkey}")
 
-        tx = Transaction.deserialize(tx_bytes)
-        tx.sign(kp)
-        raw = tx.serialize()
-        emit("tx_built", raw_len=len(raw))
+        raw = swap_exec.sign_tx(tx_b64, kp)
+        raw, cu = swap_exec.ajustar_cu(raw, "forced:" + swap_exec.etiqueta_cu(qresp), kp,
+                                       precio_max=priority_fees.PERFILES["forced"]["max"])
+        if cu["err"] is not None:
+            emit("tx_sim_failed", err=str(cu["err"]))
+            return None, f"sim_err:{cu['err']}", None
+        cu_price = cu["cu_price"] or cu_price
+        emit("tx_built", raw_len=len(raw), cu_limit=cu["cu_limit"])
 
         t1 = perf_counter()
-        resp = client.send_raw_transaction(raw, opts=TxOpts(skip_preflight=False, preflight_commitment="confirmed", max_retries=3))
+        d = swap_exec.broadcast(raw, label="[FORCED] SEND", last_valid_block_height=j.get("lastValidBlockHeight"))
+        sigstr = d.sig
         dt_ms = int((perf_counter()-t1)*1000)
-        sigstr = resp.value if hasattr(resp, "value") else (resp.get("result") if isinstance(resp, dict) else None)
-        sigstr = str(sigstr) if sigstr is not None else None   # forzar string
-        emit("tx_submitted", sig=sigstr, dt_ms=dt_ms)
+        emit("tx_submitted", sig=sigstr, rpc=d.endpoint, dt_ms=dt_ms, cu_price=cu_price)
+        priority_fees.registrar_envio(sigstr, "forced", cu_price)
         if dbg: print(f"[DEBUG] tx sig={sigstr}")
         return True, None, sigstr
 
@@ -341,6 +251,57 @@ def jup_swap(qresp: dict, user_pubkey: str, dbg=False):
             traceback.print_exc()
         return None, f"send_err:{e}", None
 
+# ---------- Ensamblado local (/swap-instructions + blockhash cacheado) ----------
+PLAN_TTL = 20.0   # s: plan más viejo → re-cotizar (el estado del pool ya cambió)
+
+def jup_swap_plan(qresp: dict, user_pubkey: str, dbg=False):
+    """Una sola llamada a /swap-instructions; los reintentos re-firman localmente."""
+    hdr = {"Content-Type":"application/json"}
+    if JUPITER_API_KEY: hdr["X-API-KEY"] = JUPITER_API_KEY
+    limitador.tomar()
+    t0 = perf_counter()
+    try:
+        sp = swap_exec.swap_plan(
+            qresp, timeout=20, headers=hdr, user_pubkey=user_pubkey, tags={"side": "forced"},
+            wrapAndUnwrapSol=not wallet_prep.wsol_lista(),
+            dynamicComputeUnitLimit=True,
+        )
+    except Exception as e:
+        if dbg: print(f"[DEBUG] swap_ix err: {e}")
+        sp = None
+    emit("jup_swap_ix", ok=sp is not None, dt_ms=int((perf_counter()-t0)*1000))
+    return sp
+
+def enviar_plan(sp, slippage_bps: int, dbg=False):
+    """Re-firma el plan con blockhash fresco, CU price actual y slippage del intento. (ok, err, sig)"""
+    try:
+        if not sp.con_slippage(slippage_bps) and dbg:
+            print("[DEBUG] instrucción de ruta no reconocida: se mantiene el slippage de la quote")
+        cu_price = priority_fees.cu_price("forced", priority_fees.cuentas_pool(sp.quote.get("inputMint"), SOL_MINT))
+        kp = load_keypair()
+        raw = sp.firmar(cu_price, kp)
+        raw, cu = swap_exec.ajustar_cu(raw, "forced:" + swap_exec.etiqueta_cu(sp.quote), kp,
+                                       precio_max=priority_fees.PERFILES["forced"]["max"])
+        if cu["err"] is not None:
+            emit("tx_sim_failed", err=str(cu["err"]), local=True)
+            return None, f"sim_err:{cu['err']}", None
+        cu_price = cu["cu_price"] or cu_price
+        emit("tx_built", raw_len=len(raw), local=True, cu_limit=cu["cu_limit"])
+
+        t1 = perf_counter()
+        d = swap_exec.broadcast(raw, label="[FORCED] SEND", last_valid_block_height=sp.last_valid)
+        sigstr = d.sig
+        emit("tx_submitted", sig=sigstr, rpc=d.endpoint, dt_ms=int((perf_counter()-t1)*1000), cu_price=cu_price, local=True)
+        priority_fees.registrar_envio(sigstr, "forced", cu_price)
+        if dbg: print(f"[DEBUG] tx sig={sigstr}")
+        return True, None, sigstr
+    except Exception as e:
+        emit("tx_send_error", err=str(e))
+        if dbg:
+            print(f"[DEBUG] send_err: {e}")
+            traceback.print_exc()
+        return None, f"send_err:{e}", None
+
 # ---------- DB helpers ----------
 def _table_has_column(conn, table, col):
     try:
@@ -398,25 +359,19 @@ def vip_name(mint: str) -> str:
         except: pass
 
 def email_salida(token: str, name: str, subject: str, amount_tokens: float | None = None, dbg=False):
+    """Fire-and-forget: la alerta va al spool de notificar y la envía el worker (no bloquea la salida)."""
     if dbg: print(f"[DEBUG] email_salida: subj='{subject}' amount_tokens={amount_tokens}")
     emit("notify_email", token=token, subject=subject)
-    cmd = [sys.executable, "mesenger.py", "--token", token, "--name", name]
-    if isinstance(amount_tokens, (int, float)):
-        cmd += ["--amount", f"{amount_tokens:.8f}"]
-    cmd += ["--subject", subject]
-    subprocess.run(cmd, check=False)
+    notificar.encolar(token, name, subject, amount_tokens)
 
-def debug_list_accounts(cli: Client, owner_pub: PublicKey, mint: PublicKey):
+def debug_list_accounts(owner_pub: PublicKey, mint: PublicKey):
+    """Saldo del mint sumando todas las cuentas de la wallet (Token y Token-2022) vía balances.tenencias."""
     try:
-        resp = cli.get_token_accounts_by_owner_json_parsed(owner_pub, TokenAccountOpts(mint=mint))
-        vals = _value_list(resp)
-        print(f"[DEBUG] owner={owner_pub}, mint={mint}, cuentas={len(vals or [])}")
-        for it in (vals or []):
-            pk = _item_pubkey(it)
-            ui, amt, dec = _safe_get_token_account_balance(cli, pk) if pk else (0.0, 0, None)
-            print(f"[DEBUG]  - acc={pk} ui={ui} raw={amt} dec={dec}")
+        raw, dec = balances.tenencias(owner=str(owner_pub)).get(str(mint), (0, None))
+        ui = raw / 10 ** dec if dec is not None else 0.0
+        print(f"[DEBUG] owner={owner_pub}, mint={mint}, raw={raw} ui={ui} dec={dec}")
     except Exception as e:
-        print(f"[DEBUG] get_token_accounts_by_owner_json_parsed err: {e}")
+        print(f"[DEBUG] tenencias err: {e}")
 
 # ---------- Slippage plan ----------
 def build_slippage_plan(plan_str: str, base_bps: int, max_len: int = 6) -> list[int]:
@@ -430,6 +385,229 @@ def build_slippage_plan(plan_str: str, base_bps: int, max_len: int = 6) -> list[
             return xs[:max_len]
     return [base_bps, max(base_bps, 50), 80, 100, 200, 300][:max_len]
 
+# ---------- Límite global de peticiones a Jupiter ----------
+class Limitador:
+    """Token bucket compartido por hilos: como mucho 'rps' peticiones por segundo (ráfaga = rps)."""
+
+    def __init__(self, rps: float):
+        self.rps = float(rps)
+        self._fichas = self.rps
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._fichas = min(self.rps, self._fichas + (now - self._t) * self.rps)
+                self._t = now
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                falta = (1 - self._fichas) / self.rps
+            time.sleep(falta)
+
+JUP_RPS = 10.0
+limitador = Limitador(JUP_RPS)
+
+# ---------- Motor de salida (escalera de slippage concurrente) ----------
+ESCALATE_SECS   = 6.0    # s sin confirmar antes de escalar al siguiente slippage (el intento previo sigue vivo)
+LADDER_PREFETCH = 3      # niveles de slippage cotizados en paralelo por adelantado
+QUOTE_TTL       = 10.0   # s de validez de una quote precargada
+SETTLE_WAIT     = 60.0   # s máx. esperando intentos vivos tras el último envío
+
+def _preparar_nivel(token_mint: str, amt_raw: int, slip_bps: int, owner_pubkey_str: str, local_ix: bool, dbg=False):
+    """Quote (y plan local si --local-ix) para un nivel. Devuelve (quote, splan, err)."""
+    q, qerr = jup_quote(token_mint, amt_raw, slippage_bps=slip_bps, dbg=dbg)
+    if qerr:
+        return None, None, qerr
+    if dbg: debug_print_quote(q)
+    splan = jup_swap_plan(q, owner_pubkey_str, dbg=dbg) if local_ix else None
+    return q, splan, None
+
+def liquidar(token_mint: str, owner_pubkey_str: str, plan: list, max_intentos: int,
+             local_ix=False, raw_hint=None, decimals_hint=None, presupuesto=ESCALATE_SECS, delay=3.0, dbg=False):
+    """
+    Liquida TODO el saldo del mint escalando slippage por tiempo, no por confirmación.
+    - Quotes de los próximos LADDER_PREFETCH niveles en paralelo (y el siguiente se prepara mientras el actual espera)
+    - Cada intento vende el saldo completo: si uno aterriza, los demás fallan por saldo (solo uno puede liquidar)
+    Devuelve {ok, txids, final_balance_raw, final_balance_ui, intentos}.
+    """
+    owner = PublicKey(owner_pubkey_str)
+    mint  = PublicKey(token_mint)
+    ex = ThreadPoolExecutor(max_workers=LADDER_PREFETCH + 1)
+    txids, vivos = [], {}            # vivos: Future confirmación -> (intento, sig)
+    pref = {}                        # nivel -> (ts, Future(_preparar_nivel))
+    splan = None                     # SwapPlan vigente (--local-ix): un plan sirve a todos los niveles
+    amt_raw = None
+    intento = 0
+
+    def _saldo(primera=False):
+        if primera and raw_hint and raw_hint > 0:
+            return int(raw_hint), (raw_hint / (10 ** decimals_hint) if decimals_hint else float(raw_hint))
+        return get_token_balance(owner, mint)
+
+    def _nivel(i):
+        return min(i, len(plan) - 1)
+
+    def _precargar(desde):
+        for i in range(desde, min(desde + LADDER_PREFETCH, max_intentos)):
+            n = _nivel(i)
+            if local_ix and (n != _nivel(desde)):
+                break                    # en modo local basta un plan; el slippage se reescribe al firmar
+            hit = pref.get(n)
+            if hit is None or time.monotonic() - hit[0] > QUOTE_TTL:
+                pref[n] = (time.monotonic(), ex.submit(_preparar_nivel, token_mint, amt_raw, plan[n], owner_pubkey_str, local_ix, dbg))
+
+    try:
+        bal_raw, bal_ui = _saldo(primera=True)
+        while intento < max_intentos:
+            emit("attempt_balance", intento=intento+1, raw=bal_raw, ui=bal_ui)
+            if bal_raw is None:          # error de RPC: no confundir con saldo 0
+                time.sleep(min(delay, 1.0))
+                bal_raw, bal_ui = _saldo()
+                intento += 1
+                continue
+            if bal_raw == 0:
+                return {"ok": True, "txids": txids, "final_balance_raw": 0, "final_balance_ui": bal_ui, "intentos": intento}
+
+            if bal_raw != amt_raw:       # saldo nuevo → quotes/plan precargados ya no sirven
+                amt_raw = bal_raw
+                pref.clear()
+                splan = None
+            _precargar(intento)
+
+            n = _nivel(intento)
+            slip_bps = plan[n]
+            intento += 1
+            emit("attempt_start", intento=intento, slip_bps=slip_bps, amt_raw=amt_raw)
+            if dbg: print(f"[DEBUG] -------- intento={intento} slip={slip_bps}bps --------")
+
+            if local_ix and splan is not None and splan.amount == amt_raw and splan.age() < PLAN_TTL:
+                emit("attempt_plan_reuse", intento=intento, age_s=round(splan.age(), 2))
+                q, err = splan.quote, None
+            else:
+                ts_q, fut = pref.pop(n, (None, None))
+                if fut is None:
+                    fut = ex.submit(_preparar_nivel, token_mint, amt_raw, slip_bps, owner_pubkey_str, local_ix, dbg)
+                q, sp, err = fut.result()
+                if local_ix:
+                    splan = sp
+            if err:
+                emit("attempt_quote_error", intento=intento, error=err)
+                time.sleep(min(delay, 1.0) + random.uniform(0, 0.3))
+                continue
+
+            # mientras este intento vuela, ya se cotizan los siguientes niveles
+            _precargar(intento)
+
+            if local_ix and splan is not None:
+                ok, serr, sig = enviar_plan(splan, slip_bps, dbg=dbg)
+            else:
+                ok, serr, sig = jup_swap(q, owner_pubkey_str, dbg=dbg)
+            if serr or not ok or not sig:
+                emit("attempt_swap_error", intento=intento, error=serr or "unknown")
+                time.sleep(min(delay, 1.0) + random.uniform(0, 0.3))
+                continue
+
+            txids.append(str(sig))
+            vivos[confirmaciones.suscribir(sig)] = (intento, str(sig))
+            emit("attempt_swap_ok", intento=intento, sig=str(sig), vivos=len(vivos))
+
+            # Presupuesto de tiempo: si nada confirma, se escala sin cancelar los intentos vivos
+            done, _ = wait(list(vivos), timeout=presupuesto, return_when=FIRST_COMPLETED)
+            aterrizo = False
+            for f in done:
+                i_att, sg = vivos.pop(f)
+                if f.cancelled():
+                    continue
+                res = f.result()
+                emit("attempt_confirm", intento=i_att, sig=sg, confirmed=bool(res["ok"]), via=res["via"], dt_ms=res["dt_ms"])
+                if res["ok"]:
+                    aterrizo = True
+                    if res.get("slot"):
+                        priority_fees.registrar_landing(sg, res["slot"])
+            if not done:
+                emit("attempt_escalate", intento=intento, vivos=len(vivos), budget_s=presupuesto)
+            if aterrizo or not done:
+                bal_raw, bal_ui = _saldo()
+
+        # Sin intentos restantes: dar tiempo a los vivos (su blockhash puede seguir válido)
+        if vivos:
+            done, _ = wait(list(vivos), timeout=SETTLE_WAIT)
+            for f in done:
+                if f.cancelled():
+                    continue
+                res = f.result()
+                emit("attempt_confirm", intento=vivos[f][0], sig=vivos[f][1], confirmed=bool(res["ok"]), via=res["via"])
+            for f, (_, sg) in vivos.items():
+                if not f.done():
+                    confirmaciones.soltar(sg)   # caídos/expirados: fuera del polling y del WS
+        bal_raw, bal_ui = _saldo()
+        return {"ok": bal_raw == 0, "txids": txids, "final_balance_raw": bal_raw, "final_balance_ui": bal_ui, "intentos": intento}
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+# ---------- Modo batch (varias posiciones a la vez) ----------
+EXCLUIR_BATCH = {SOL_MINT, swap_exec.USDC_MINT}
+
+def db_open_op_id(db_path: str, mint: str):
+    """id de la operación abierta más reciente del mint (o None)."""
+    try:
+        with sqlite3.connect(db_path, timeout=5) as con:
+            row = con.execute("""
+                SELECT id FROM operaciones
+                WHERE address=? AND (hora_salida IS NULL OR TRIM(hora_salida)='')
+                ORDER BY id DESC LIMIT 1
+            """, (mint,)).fetchone()
+        return row[0] if row else None
+    except Exception:
+        return None
+
+def liquidar_batch(mints, owner_pubkey_str: str, plan: list, max_intentos: int, db_path: str,
+                   local_ix=False, presupuesto=ESCALATE_SECS, delay=3.0, max_workers=8, dbg=False):
+    """
+    Liquida varios mints en paralelo (un liquidar() por mint, límite global de Jupiter compartido).
+    mints=None → todo lo que tenga la wallet salvo USDC/SOL. Saldos iniciales en una sola consulta.
+    """
+    t0 = perf_counter()
+    if mints:
+        snap = balances.balances_raw(mints, owner=owner_pubkey_str)
+    else:
+        snap = balances.tenencias(owner=owner_pubkey_str)
+    snap = {m: v for m, v in snap.items() if m not in EXCLUIR_BATCH and v[0] > 0}
+    emit("batch_start", n=len(snap), mints=list(snap))
+
+    resultados = {}
+    if snap:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(snap)))) as ex:
+            futs = {ex.submit(liquidar, m, owner_pubkey_str, plan, max_intentos, local_ix=local_ix,
+                              raw_hint=raw, decimals_hint=dec, presupuesto=presupuesto, delay=delay, dbg=dbg): m
+                    for m, (raw, dec) in snap.items()}
+            for f in as_completed(futs):
+                m = futs[f]
+                try:
+                    out = f.result()
+                except Exception as e:
+                    out = {"ok": False, "txids": [], "error": str(e)}
+                resultados[m] = out
+                op_id = db_open_op_id(db_path, m)
+                if op_id is not None:
+                    try:
+                        if out.get("ok"):
+                            db_mark_forced_close_success(db_path, op_id, out.get("txids") or [])
+                        else:
+                            db_mark_forced_close_failure(db_path, op_id)
+                    except Exception as e:
+                        emit("db_mark_error", op_id=op_id, err=str(e))
+                out["op_id"] = op_id
+                emit("batch_item_done", mint=m, ok=bool(out.get("ok")), op_id=op_id)
+
+    ok = all(r.get("ok") for r in resultados.values())
+    emit("batch_done", ok=ok, n=len(resultados), dt_ms=int((perf_counter()-t0)*1000))
+    return {"ok": ok, "n": len(resultados), "resultados": resultados,
+            "dt_ms": int((perf_counter()-t0)*1000)}
+
 # ---------- Main ----------
 def main():
     ap = argparse.ArgumentParser()
@@ -441,8 +619,36 @@ def main():
     ap.add_argument("--op-id", "--op_id", dest="op_id", type=int, default=None, help="ID en operaciones para marcar cerrado forzado")
     ap.add_argument("--db", default=DB_NAME, help="Ruta DB SQLite (default: config.DB_NAME)")
     ap.add_argument("--debug", action="store_true")
+    ap.add_argument("--local-ix", action="store_true", help="Ensamblar TX localmente desde /swap-instructions (re-firma sin HTTP)")
+    ap.add_argument("--raw-amount", type=int, default=None, help="Saldo raw conocido por el trader (1er intento sin consultar balance)")
+    ap.add_argument("--decimals", type=int, default=None, help="Decimales del token (con --raw-amount)")
+    ap.add_argument("--escalar-s", type=float, default=ESCALATE_SECS, help="Segundos sin confirmar antes de escalar slippage")
+    ap.add_argument("--batch", default="", help="Modo batch: lista de mints separada por comas, o 'all' (todo salvo USDC/SOL)")
+    ap.add_argument("--rps", type=float, default=JUP_RPS, help="Límite global de peticiones/s a Jupiter")
     args = ap.parse_args()
 
+    global limitador
+    limitador = Limitador(args.rps)
+
+    if args.batch:
+        try:
+            owner_pubkey_str = str(load_keypair().public_key)
+        except Exception:
+            owner_pubkey_str = str(wallet_pubkey)
+        mints = None if args.batch.strip().lower() == "all" else [m.strip() for m in args.batch.split(",") if m.strip()]
+        plan = build_slippage_plan(args.slippage_plan, args.slippage_bps, max_len=args.max_intentos)
+        if args.local_ix:
+            swap_exec.blockhash_cache.start()
+        email_salida("BATCH", "batch", f"ALERTA: liquidación batch iniciada ({args.batch})", dbg=args.debug)
+        out = liquidar_batch(mints, owner_pubkey_str, plan, args.max_intentos, args.db, local_ix=args.local_ix,
+                             presupuesto=args.escalar_s, delay=args.delay, dbg=args.debug)
+        print(json.dumps(out, ensure_ascii=False))
+        pend = [m for m, r in out["resultados"].items() if not r.get("ok")]
+        email_salida("BATCH", "batch", f"Liquidación batch {'COMPLETADA' if out['ok'] else 'INCOMPLETA'} – "
+                     f"{out['n'] - len(pend)}/{out['n']} ok" + (f" (pendientes: {', '.join(m[:6] for m in pend)})" if pend else ""),
+                     dbg=args.debug)
+        sys.exit(0 if out["ok"] else 1)
+
     # token_mint opcional: pedir si falta
     if not args.token_mint:
         args.token_mint = input("Mint del token a liquidar: ").strip()
@@ -457,79 +663,22 @@ def main():
         owner_pubkey_str = str(wallet_pubkey)
 
     name = vip_name(args.token_mint)
-    owner = PublicKey(owner_pubkey_str)
-    mint  = PublicKey(args.token_mint)
 
     # Email de inicio
-    bal_ui0 = get_token_balance_ui(client, owner, mint)
+    bal_ui0 = (args.raw_amount / (10 ** args.decimals)) if (args.raw_amount and args.decimals) else get_token_balance(PublicKey(owner_pubkey_str), PublicKey(args.token_mint))[1]
     emit("forced_exit_init_balance", ui=bal_ui0)
     email_salida(args.token_mint, name, f"ALERTA: salida forzada iniciada – {name}", amount_tokens=bal_ui0, dbg=args.debug)
 
     plan = build_slippage_plan(args.slippage_plan, args.slippage_bps, max_len=args.max_intentos)
     emit("forced_exit_plan", plan_bps=plan)
 
-    txids = []
-
-    for intento in range(1, args.max_intentos + 1):
-        emit("attempt_start", intento=intento)
-        if args.debug: print(f"[DEBUG] -------- intento={intento} --------")
+    if args.local_ix:
+        swap_exec.blockhash_cache.start()
 
-        bal_raw = get_token_balance_raw(client, owner, mint)
-        bal_ui  = get_token_balance_ui(client, owner, mint)
-        emit("attempt_balance", intento=intento, raw=bal_raw, ui=bal_ui)
-
-        # Éxito solo si raw == 0
-        if bal_raw == 0:
-            out = {"ok": True, "txids": txids, "final_balance_raw": bal_raw, "final_balance_ui": bal_ui, "final_usd": "n/a", "intentos": intento - 1}
-            print(json.dumps(out, ensure_ascii=False))
-            emit("forced_exit_done", ok=True, tx_count=len(txids), attempts=intento-1, final_raw=bal_raw, final_ui=bal_ui)
-            if args.op_id is not None:
-                try:
-                    db_mark_forced_close_success(args.db, args.op_id, txids)
-                except Exception as e:
-                    emit("db_mark_success_error", err=str(e))
-            email_salida(args.token_mint, name, f"Salida forzada COMPLETADA – {name} (remanente: {bal_ui:.8f} tokens)", amount_tokens=bal_ui, dbg=args.debug)
-            return
-
-        # Intentar liquidar TODO el saldo disponible
-        amt_raw = bal_raw
-        if amt_raw <= 0:
-            time.sleep(args.delay + random.uniform(0, 0.6))
-            continue
-
-        # Slippage dinámico por intento
-        slip_bps = plan[min(intento-1, len(plan)-1)]
-        emit("attempt_quote", intento=intento, slip_bps=slip_bps, amt_raw=amt_raw)
-
-        q, qerr = jup_quote(args.token_mint, amt_raw, slippage_bps=slip_bps, dbg=args.debug)
-        if qerr:
-            emit("attempt_quote_error", intento=intento, error=qerr)
-            time.sleep(args.delay * (1 + 0.25*(intento-1)) + random.uniform(0, 0.7))
-            continue
-
-        if args.debug: debug_print_quote(q)
-
-        ok, serr, sig = jup_swap(q, owner_pubkey_str, dbg=args.debug)
-        if serr or not ok or not sig:
-            emit("attempt_swap_error", intento=intento, error=serr or "unknown")
-            time.sleep(args.delay * (1 + 0.25*(intento-1)) + random.uniform(0, 0.7))
-            continue
-
-        # Guardar siempre txid como string (evita TypeError en json.dumps)
-        txids.append(str(sig))
-        emit("attempt_swap_ok", intento=intento, sig=str(sig))
-
-        # Confirmación con espera mayor
-        conf = confirm_tx_sig(client, sig, max_wait_s=90, dbg=args.debug)
-        emit("attempt_confirm", intento=intento, sig=sig, confirmed=bool(conf))
-
-        # respirar para que la DB/RPC refleje balances post-swap
-        time.sleep(args.delay * (1 + 0.15*(intento-1)) + random.uniform(0, 0.5))
-
-    # Revisión final tras agotar intentos
-    bal_raw = get_token_balance_raw(client, owner, mint)
-    bal_ui  = get_token_balance_ui(client, owner, mint)
-    success = (bal_raw == 0)
+    out = liquidar(args.token_mint, owner_pubkey_str, plan, args.max_intentos,
+                   local_ix=args.local_ix, raw_hint=args.raw_amount, decimals_hint=args.decimals,
+                   presupuesto=args.escalar_s, delay=args.delay, dbg=args.debug)
+    txids, bal_raw, bal_ui, success = out["txids"], out["final_balance_raw"], out["final_balance_ui"], out["ok"]
 
     print(json.dumps({
         "ok": success,
@@ -537,11 +686,11 @@ def main():
         "final_balance_raw": bal_raw,
         "final_balance_ui": bal_ui,
         "final_usd": "n/a",
-        "intentos": args.max_intentos
+        "intentos": out["intentos"]
     }, ensure_ascii=False))
 
     if success:
-        emit("forced_exit_done", ok=True, tx_count=len(txids), attempts=args.max_intentos, final_raw=bal_raw, final_ui=bal_ui)
+        emit("forced_exit_done", ok=True, tx_count=len(txids), attempts=out["intentos"], final_raw=bal_raw, final_ui=bal_ui)
         email_salida(args.token_mint, name, f"Salida forzada COMPLETADA – {name} (remanente: {bal_ui:.8f} tokens)", amount_tokens=bal_ui, dbg=args.debug)
         if args.op_id is not None:
             try:
@@ -549,9 +698,9 @@ def main():
             except Exception as e:
                 emit("db_mark_success_error", err=str(e))
     else:
-        emit("forced_exit_done", ok=False, tx_count=len(txids), attempts=args.max_intentos, final_raw=bal_raw, final_ui=bal_ui)
+        emit("forced_exit_done", ok=False, tx_count=len(txids), attempts=out["intentos"], final_raw=bal_raw, final_ui=bal_ui)
         # Correo especial de fallo y nota en DB
-        email_salida(args.token_mint, name, f"❌ Salida forzada NO completada – {name} (remanente: {bal_ui:.8f} tokens)", amount_tokens=bal_ui, dbg=args.debug)
+        email_salida(args.token_mint, name, f"❌ Salida forzada NO completada – {name} (remanente: {(bal_ui or 0.0):.8f} tokens)", amount_tokens=bal_ui, dbg=args.debug)
         if args.op_id is not None:
             try:
                 db_mark_forced_close_failure(args.db, args.op_id)
@@ -560,11 +709,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
-
-
-
-
-
-
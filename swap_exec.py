@@ -0,0 +1,745 @@
+# swap_exec.py — Núcleo compartido de ejecución de swaps: quote → build → sign → send
+# - Un único cliente HTTP con pool (httpx, HTTP/2 si está 'h2'; si no, HTTP/1.1 keep-alive)
+# - Telemetría por etapa: emit("stage", stage=..., dt_ms=...)
+# - Variantes async (aquote/abuild_swap/asign_tx) sobre el mismo pool
+# - TX versionadas (v0 + address lookup tables) y legacy en sign_tx (firma sobre bytes crudos vía tx_codec)
+# - Quotes con cache TTL corta + single-flight (en proceso y entre procesos vía quote_service)
+# - Pipeline quote → build: cada /swap arranca en cuanto su quote pasa filtros (primera_construible)
+# - Difusión concurrente a todos los RPC con re-difusión hasta confirmar o expirar el blockhash (broadcast)
+# - Ensamblado local (SwapPlan) desde /swap-instructions con blockhash cacheado en segundo plano
+# - Límite de CU ajustado por simulación (ajustar_cu), cacheado por etiqueta de ruta/AMM
+# Usado por compra_swap_usdc, compra_swap_sol, swap_real y salida_forzada.
+
+import os, time, asyncio, threading, hashlib, sqlite3
+from collections import deque
+from base64 import b64decode, b64encode
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+from time import perf_counter
+
+import httpx
+from solders.transaction import VersionedTransaction
+from solders.pubkey import Pubkey
+from solders.hash import Hash
+from solders.signature import Signature
+from solders.instruction import Instruction, AccountMeta, CompiledInstruction
+from solders.message import MessageV0
+from solders.address_lookup_table_account import AddressLookupTableAccount
+from solders.compute_budget import set_compute_unit_limit, set_compute_unit_price
+from solana.transaction import Transaction
+
+import tx_codec
+from config import (
+    keypair, wallet_pubkey, RPC_URL, DB_NAME,
+    JUPITER_API_KEY, QUOTE_URL, SWAP_URL, SWAP_IX_URL,
+)
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+USDC_MINT = "EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v"
+SOL_MINT  = "So11111111111111111111111111111111111111112"
+
+FALLBACK_RPC_URLS = ["https://api.mainnet-beta.solana.com"]
+BROADCAST_URLS = [RPC_URL] + [u for u in FALLBACK_RPC_URLS if u != RPC_URL]
+
+PACKET_DATA_SIZE = tx_codec.PACKET_DATA_SIZE  # límite real de TX serializada en la red
+PACKET_B64_LEN   = 4 * ((PACKET_DATA_SIZE + 2) // 3)
+
+# ===== Timing por etapa =====
+@contextmanager
+def stage(name: str, **tags):
+    t0 = perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        emit("stage", stage=name, ok=ok, dt_ms=int((perf_counter() - t0) * 1000), **tags)
+
+# ===== HTTP pooled (un cliente por proceso) =====
+_HTTP = None
+_HTTP_LOCK = threading.Lock()
+
+def http() -> httpx.Client:
+    global _HTTP
+    if _HTTP is None:
+        with _HTTP_LOCK:
+            if _HTTP is None:
+                limits = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=90)
+                hdrs = {"Accept": "application/json"}
+                try:
+                    _HTTP = httpx.Client(http2=True, limits=limits, headers=hdrs)
+                except ImportError:  # falta 'h2' → HTTP/1.1 keep-alive
+                    _HTTP = httpx.Client(http2=False, limits=limits, headers=hdrs)
+    return _HTTP
+
+def http_get(url, headers=None, params=None, timeout=10, attempts=1):
+    last_exc = None
+    for i in range(attempts):
+        try:
+            t0 = perf_counter()
+            r = http().get(url, headers=headers or {}, params=params or {}, timeout=timeout)
+            emit("http_get", url=url, status=r.status_code, dt_ms=int((perf_counter() - t0) * 1000),
+                 http_version=getattr(r, "http_version", None))
+            return r
+        except Exception as e:
+            last_exc = e
+            emit("http_get_error", url=url, err=str(e), attempt=i+1)
+            if i + 1 < attempts:
+                time.sleep(0.2 * (2 ** i))
+    raise last_exc
+
+def http_post(url, headers=None, json_body=None, timeout=15, attempts=1):
+    last_exc = None
+    for i in range(attempts):
+        try:
+            t0 = perf_counter()
+            r = http().post(url, headers=headers or {}, json=json_body or {}, timeout=timeout)
+            emit("http_post", url=url, status=r.status_code, dt_ms=int((perf_counter() - t0) * 1000),
+                 http_version=getattr(r, "http_version", None))
+            return r
+        except Exception as e:
+            last_exc = e
+            emit("http_post_error", url=url, err=str(e), attempt=i+1)
+            if i + 1 < attempts:
+                time.sleep(0.2 * (2 ** i))
+    raise last_exc
+
+def rpc(method: str, params=None, timeout=3.0, url=None):
+    """JSON-RPC crudo sobre el pool HTTP (sin Client de solana-py). Devuelve 'result'."""
+    body = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or []}
+    r = http_post(url or RPC_URL, json_body=body, timeout=timeout)
+    r.raise_for_status()
+    j = r.json()
+    if j.get("error"):
+        raise RuntimeError(f"{method}: {j['error']}")
+    return j.get("result")
+
+def jup_headers():
+    return {"accept": "application/json", "Authorization": f"Bearer {JUPITER_API_KEY}"}
+
+# ===== Cache de quotes (TTL ~2 slots + single-flight; compartida entre procesos vía quote_service) =====
+QUOTE_TTL        = 0.8    # s (~2 slots)
+QUOTE_BUCKET_BPS = 0      # 0 = amount exacto (inAmount de la quote va tal cual a /swap)
+
+_quote_cache = {}         # key -> (ts_monotonic, RespuestaCacheada)
+_quote_inflight = {}      # key -> threading.Event
+_quote_lock = threading.Lock()
+
+class RespuestaCacheada:
+    """Respuesta de /quote desacoplada del socket (misma interfaz que usan los scripts)."""
+
+    def __init__(self, status_code: int, text: str, http_version=None):
+        self.status_code = int(status_code)
+        self.text = text
+        self.http_version = http_version
+
+    def json(self):
+        import json as _json
+        return _json.loads(self.text)
+
+def _bucket(amount) -> int:
+    a = int(amount)
+    if QUOTE_BUCKET_BPS <= 0 or a <= 0:
+        return a
+    paso = max(1, a * QUOTE_BUCKET_BPS // 10_000)
+    return a - a % paso
+
+def quote_key(params: dict) -> tuple:
+    """(inputMint, outputMint, amount bucket, slippage, direct, maxAccounts, resto de params)."""
+    p = {k: str(v) for k, v in params.items()}
+    base = (p.pop("inputMint", ""), p.pop("outputMint", ""), _bucket(p.pop("amount", 0)),
+            p.pop("slippageBps", ""), p.pop("onlyDirectRoutes", ""), p.pop("maxAccounts", ""))
+    return base + tuple(sorted(p.items()))
+
+def _quote_http(params, timeout, headers, attempts):
+    r = http_get(QUOTE_URL, headers=headers or jup_headers(), params=params, timeout=timeout, attempts=attempts)
+    return RespuestaCacheada(r.status_code, r.text, getattr(r, "http_version", None))
+
+def quote_local(params: dict, timeout=6, headers=None, attempts=1):
+    """Cache en proceso + single-flight: peticiones idénticas simultáneas comparten un solo GET."""
+    key = quote_key(params)
+    while True:
+        with _quote_lock:
+            hit = _quote_cache.get(key)
+            if hit and time.monotonic() - hit[0] < QUOTE_TTL:
+                emit("quote_cache_hit", age_ms=int((time.monotonic() - hit[0]) * 1000))
+                return hit[1]
+            ev = _quote_inflight.get(key)
+            if ev is None:
+                ev = _quote_inflight[key] = threading.Event()
+                lider = True
+            else:
+                lider = False
+        if not lider:
+            ev.wait(timeout)
+            with _quote_lock:
+                hit = _quote_cache.get(key)
+            if hit:
+                emit("quote_coalesced")
+                return hit[1]
+            continue    # el líder falló o no era 200: intentar como líder
+        try:
+            r = _quote_http(params, timeout, headers, attempts)
+            if r.status_code == 200:
+                with _quote_lock:
+                    _quote_cache[key] = (time.monotonic(), r)
+                    if len(_quote_cache) > 512:
+                        for k in [k for k, v in _quote_cache.items() if time.monotonic() - v[0] >= QUOTE_TTL]:
+                            _quote_cache.pop(k, None)
+            return r
+        finally:
+            with _quote_lock:
+                _quote_inflight.pop(key, None)
+            ev.set()
+
+# ===== Etapas =====
+def quote(params: dict, timeout=6, headers=None, attempts=1, cache=True, **tags):
+    """
+    GET /quote. Devuelve la respuesta (status_code/text/json()) y cada script aplica sus filtros.
+    cache=True: quote_service (socket local, compartido entre procesos) y si no está, cache en proceso.
+    """
+    with stage("quote", **tags):
+        if not cache:
+            return http_get(QUOTE_URL, headers=headers or jup_headers(), params=params, timeout=timeout, attempts=attempts)
+        import quote_service   # diferido: quote_service importa swap_exec
+        r = quote_service.pedir(params, timeout=timeout, headers=headers, attempts=attempts)
+        if r is not None:
+            return r
+        return quote_local(params, timeout=timeout, headers=headers, attempts=attempts)
+
+def build_swap(quote_json: dict, timeout=12, headers=None, attempts=1, user_pubkey=None, tags=None, **body):
+    """POST /swap con quoteResponse + userPublicKey + overrides del llamador."""
+    payload = {"quoteResponse": quote_json, "userPublicKey": str(user_pubkey or wallet_pubkey)}
+    payload.update(body)
+    with stage("build", **(tags or {})):
+        return http_post(SWAP_URL, headers=headers or jup_headers(), json_body=payload, timeout=timeout, attempts=attempts)
+
+def primera_construible(cotizadores: dict, construir, timeout=None):
+    """
+    Pipeline quote → build sin esperas en serie.
+    cotizadores: {clave: fn() -> quote filtrada o None}; construir(clave, quote) -> resultado o None.
+    Cada build arranca en cuanto su quote es válida; gana el primer resultado no-None y el resto se cancela
+    (las peticiones ya en vuelo terminan en segundo plano y se descartan).
+    """
+    ex = ThreadPoolExecutor(max_workers=max(1, 2 * len(cotizadores)))
+    pend = {ex.submit(fn): ("quote", k) for k, fn in cotizadores.items()}
+    t0 = perf_counter()
+    try:
+        while pend:
+            restante = None if timeout is None else timeout - (perf_counter() - t0)
+            if restante is not None and restante <= 0:
+                emit("pipeline_timeout", pending=len(pend))
+                return None
+            done, _ = wait(pend, timeout=restante, return_when=FIRST_COMPLETED)
+            for fut in done:
+                fase, k = pend.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    emit("pipeline_exc", fase=fase, key=str(k), err=str(e))
+                    continue
+                if res is None:
+                    continue
+                if fase == "quote":
+                    pend[ex.submit(construir, k, res)] = ("build", k)
+                else:
+                    emit("pipeline_win", key=str(k), pending=len(pend), dt_ms=int((perf_counter()-t0)*1000))
+                    return res
+        return None
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+def _solders_kp(kp):
+    return tx_codec.keypair_solders(kp)[0]
+
+def sign_tx(tx_b64_or_bytes, kp=None) -> bytes:
+    """
+    Firma y serializa. Acepta base64 (str), bytes crudos o tx_codec.TxCruda (ya decodificada).
+    Legacy y v0: firma directa sobre los bytes del mensaje (tx_codec); si la clave no es
+    firmante requerido, camino anterior (deserializar con solders / solana-py).
+    """
+    with stage("sign"):
+        kp = kp or keypair
+        try:
+            return tx_codec.firmar(tx_b64_or_bytes, kp)
+        except ValueError as e:
+            emit("sign_codec_fallback", err=str(e))
+        if isinstance(tx_b64_or_bytes, tx_codec.TxCruda):
+            raw = tx_b64_or_bytes.bytes()
+        else:
+            raw = b64decode(tx_b64_or_bytes) if isinstance(tx_b64_or_bytes, str) else tx_b64_or_bytes
+        if tx_codec.es_versionada(raw):
+            vt = VersionedTransaction.from_bytes(raw)
+            return bytes(VersionedTransaction(vt.message, [_solders_kp(kp)]))
+        tx = Transaction.deserialize(raw)
+        tx.sign(kp)
+        return tx.serialize()
+
+# ===== Blockhash reciente (refresco en segundo plano) =====
+class BlockhashCache:
+    """Mantiene (blockhash, lastValidBlockHeight) fresco con un hilo de fondo."""
+
+    def __init__(self, every=2.0, max_age=20.0):
+        self.every = every
+        self.max_age = max_age
+        self._val = None          # (Hash, last_valid_block_height, ts_monotonic)
+        self._lock = threading.Lock()
+        self._th = None
+
+    def _fetch(self):
+        res = rpc("getLatestBlockhash", [{"commitment": "confirmed"}])
+        v = (res or {}).get("value") or {}
+        val = (Hash.from_string(v["blockhash"]), int(v["lastValidBlockHeight"]), time.monotonic())
+        with self._lock:
+            self._val = val
+        return val
+
+    def _run(self):
+        while True:
+            try:
+                self._fetch()
+            except Exception as e:
+                emit("blockhash_refresh_error", err=str(e))
+            time.sleep(self.every)
+
+    def start(self):
+        with self._lock:
+            if self._th is None:
+                self._th = threading.Thread(target=self._run, daemon=True)
+                self._th.start()
+
+    def get(self):
+        """(Hash, lastValidBlockHeight). Síncrono solo si no hay valor o está viejo."""
+        self.start()
+        with self._lock:
+            val = self._val
+        if val is None or time.monotonic() - val[2] > self.max_age:
+            with stage("blockhash_sync"):
+                val = self._fetch()
+        return val[0], val[1]
+
+blockhash_cache = BlockhashCache()
+
+# ===== Ensamblado local desde /swap-instructions =====
+CU_LIMIT_DEFAULT = 300_000
+ALT_TTL = 300.0
+
+_ALT_CACHE = {}   # address -> (ts_monotonic, AddressLookupTableAccount)
+
+def _ix_from_json(j: dict) -> Instruction:
+    metas = [AccountMeta(Pubkey.from_string(a["pubkey"]), bool(a["isSigner"]), bool(a["isWritable"]))
+             for a in j.get("accounts") or []]
+    return Instruction(Pubkey.from_string(j["programId"]), b64decode(j.get("data") or ""), metas)
+
+def lookup_tables(addresses) -> list:
+    """AddressLookupTableAccount por dirección (cache; un getMultipleAccounts para los faltantes)."""
+    now = time.monotonic()
+    faltan = [a for a in addresses if a not in _ALT_CACHE or now - _ALT_CACHE[a][0] > ALT_TTL]
+    if faltan:
+        with stage("alt_fetch", n=len(faltan)):
+            res = rpc("getMultipleAccounts", [faltan, {"encoding": "base64"}])
+        for addr, acc in zip(faltan, (res or {}).get("value") or []):
+            if not acc:
+                continue
+            data = b64decode(acc["data"][0])
+            keys = [Pubkey.from_bytes(data[i:i+32]) for i in range(56, len(data) - 31, 32)]  # meta = 56 bytes
+            _ALT_CACHE[addr] = (now, AddressLookupTableAccount(Pubkey.from_string(addr), keys))
+    return [_ALT_CACHE[a][1] for a in addresses if a in _ALT_CACHE]
+
+# Instrucciones de ruta de Jupiter cuyo data termina en (..., slippage_bps u16, platform_fee_bps u8)
+_ROUTE_DISCS = {hashlib.sha256(f"global:{n}".encode()).digest()[:8] for n in (
+    "route", "shared_accounts_route", "route_with_token_ledger",
+    "exact_out_route", "shared_accounts_exact_out_route",
+)}
+
+class SwapPlan:
+    """
+    Instrucciones de un swap (una sola llamada a /swap-instructions) listas para
+    re-firmar con otro blockhash, CU price o slippage sin volver a Jupiter.
+    """
+
+    def __init__(self, quote_json: dict, ixs: dict, user_pubkey=None):
+        self.quote = quote_json
+        self.amount = int(quote_json.get("inAmount") or 0)
+        self.payer = Pubkey.from_string(str(user_pubkey or wallet_pubkey))
+        self.setup = [_ix_from_json(x) for x in ixs.get("setupInstructions") or []]
+        self.swap_ix = _ix_from_json(ixs["swapInstruction"])
+        self.cleanup = [_ix_from_json(ixs["cleanupInstruction"])] if ixs.get("cleanupInstruction") else []
+        self.other = [_ix_from_json(x) for x in ixs.get("otherInstructions") or []]
+        self.alts = lookup_tables(ixs.get("addressLookupTableAddresses") or [])
+        self.cu_limit = CU_LIMIT_DEFAULT
+        for x in ixs.get("computeBudgetInstructions") or []:
+            d = b64decode(x.get("data") or "")
+            if d[:1] == b"\x02" and len(d) >= 5:   # SetComputeUnitLimit(u32)
+                self.cu_limit = int.from_bytes(d[1:5], "little")
+        self.last_valid = None   # lastValidBlockHeight del último firmar()
+        self.ts = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.ts
+
+    def con_slippage(self, slippage_bps: int) -> bool:
+        """Reescribe slippage_bps en la instrucción de ruta (min-out on-chain). False si no se reconoce."""
+        data = bytes(self.swap_ix.data)
+        if data[:8] not in _ROUTE_DISCS or len(data) < 11:
+            return False
+        data = data[:-3] + int(slippage_bps).to_bytes(2, "little") + data[-1:]
+        self.swap_ix = Instruction(self.swap_ix.program_id, data, self.swap_ix.accounts)
+        return True
+
+    def firmar(self, cu_price: int, kp=None, cu_limit: int | None = None, blockhash=None) -> bytes:
+        """Ensambla MessageV0 (compute budget propio + swap) con blockhash cacheado y firma."""
+        with stage("assemble_sign"):
+            if blockhash is None:
+                bh, self.last_valid = blockhash_cache.get()
+            else:
+                bh, self.last_valid = blockhash, None
+            ixs = [set_compute_unit_limit(int(cu_limit or self.cu_limit)), set_compute_unit_price(int(cu_price))]
+            ixs += self.setup + [self.swap_ix] + self.cleanup + self.other
+            msg = MessageV0.try_compile(self.payer, ixs, self.alts, bh)
+            return bytes(VersionedTransaction(msg, [_solders_kp(kp or keypair)]))
+
+def swap_plan(quote_json: dict, timeout=12, headers=None, attempts=1, user_pubkey=None, tags=None, **body):
+    """POST /swap-instructions → SwapPlan (None si la respuesta no es usable)."""
+    payload = {"quoteResponse": quote_json, "userPublicKey": str(user_pubkey or wallet_pubkey)}
+    payload.update(body)
+    with stage("build_ix", **(tags or {})):
+        r = http_post(SWAP_IX_URL, headers=headers or jup_headers(), json_body=payload, timeout=timeout, attempts=attempts)
+    if r.status_code != 200:
+        emit("swap_ix_bad_status", status=r.status_code, body=(r.text or "")[:300])
+        return None
+    j = r.json()
+    if j.get("error") or not j.get("swapInstruction"):
+        emit("swap_ix_error", detail=str(j.get("error") or "no swapInstruction")[:300])
+        return None
+    return SwapPlan(quote_json, j, user_pubkey=user_pubkey)
+
+# ===== Límite de CU por simulación =====
+COMPUTE_BUDGET_PROGRAM = Pubkey.from_string("ComputeBudget111111111111111111111111111111")
+CU_SIM      = os.getenv("APOLLO_CU_SIM", "1") != "0"
+CU_MARGEN   = 1.15      # sobre el máximo observado / simulado
+CU_MIN      = 30_000
+CU_MUESTRAS = 20        # consumos recientes guardados por etiqueta
+CU_MAX_EDAD = 86_400    # s: observaciones más viejas no se cargan (upgrades de programas)
+
+_cu_obs = None          # etiqueta -> deque(unitsConsumed); se carga de cu_obs (DB) al primer uso
+_cu_lock = threading.Lock()
+
+# Persistencia: swap_real / salida_forzada son procesos cortos y sin esto simularían siempre
+def _cu_db():
+    con = sqlite3.connect(DB_NAME, timeout=2)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS cu_obs(
+          etiqueta TEXT NOT NULL,
+          units    INTEGER NOT NULL,
+          ts       REAL NOT NULL
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_cu_obs_etiqueta ON cu_obs(etiqueta, ts)")
+    return con
+
+def _cu_cargar():
+    obs = {}
+    try:
+        with _cu_db() as con:
+            for etiqueta, units in con.execute("SELECT etiqueta, units FROM cu_obs WHERE ts>=? ORDER BY ts",
+                                               (time.time() - CU_MAX_EDAD,)):
+                obs.setdefault(etiqueta, deque(maxlen=CU_MUESTRAS)).append(int(units))
+        emit("cu_obs_loaded", etiquetas=len(obs))
+    except Exception as e:
+        emit("cu_obs_db_error", err=str(e))
+    return obs
+
+def _cu_guardar(etiqueta: str, units: int):
+    try:
+        with _cu_db() as con:
+            con.execute("INSERT INTO cu_obs(etiqueta, units, ts) VALUES (?,?,?)", (etiqueta, int(units), time.time()))
+            con.execute("""
+                DELETE FROM cu_obs WHERE etiqueta=? AND rowid NOT IN (
+                    SELECT rowid FROM cu_obs WHERE etiqueta=? ORDER BY ts DESC LIMIT ?)
+            """, (etiqueta, etiqueta, CU_MUESTRAS))
+    except Exception as e:
+        emit("cu_obs_db_error", err=str(e))
+
+def _cu_mem():
+    global _cu_obs
+    if _cu_obs is None:
+        _cu_obs = _cu_cargar()
+    return _cu_obs
+
+def _cu_precargar():
+    with _cu_lock:
+        _cu_mem()
+
+# Carga las observaciones al importar (fuera del camino crítico de ajustar_cu)
+threading.Thread(target=_cu_precargar, daemon=True).start()
+
+def etiqueta_cu(quote_json: dict) -> str:
+    """Clave de consumo típico: AMMs de la ruta en orden (p. ej. 'Raydium CPMM' o 'Orca>Raydium')."""
+    rp = (quote_json or {}).get("routePlan") or []
+    return ">".join(((s.get("swapInfo") or {}).get("label") or s.get("label") or "?") for s in rp) or "?"
+
+def cu_tipico(etiqueta: str):
+    """Límite sugerido (máx. reciente × margen) o None si la etiqueta no tiene muestras."""
+    with _cu_lock:
+        xs = _cu_mem().get(etiqueta)
+        return max(CU_MIN, int(max(xs) * CU_MARGEN)) if xs else None
+
+def _registrar_cu(etiqueta: str, units: int):
+    with _cu_lock:
+        _cu_mem().setdefault(etiqueta, deque(maxlen=CU_MUESTRAS)).append(int(units))
+    # no daemon: el proceso CLI que termina tras enviar no pierde la observación
+    threading.Thread(target=_cu_guardar, args=(etiqueta, units)).start()
+
+def simular(raw: bytes, timeout=2.0):
+    """simulateTransaction (sin verificar firma). Devuelve (err, unitsConsumed, logs)."""
+    with stage("simulate"):
+        res = rpc("simulateTransaction", [b64encode(raw).decode(), {
+            "encoding": "base64", "sigVerify": False, "replaceRecentBlockhash": False, "commitment": "processed",
+        }], timeout=timeout)
+    v = (res or {}).get("value") or {}
+    return v.get("err"), v.get("unitsConsumed"), v.get("logs") or []
+
+def _compute_budget(msg: MessageV0):
+    """(limit, price) de las instrucciones de compute budget del mensaje (None si no están)."""
+    limit = price = None
+    for ix in msg.instructions:
+        if msg.account_keys[ix.program_id_index] != COMPUTE_BUDGET_PROGRAM:
+            continue
+        d = bytes(ix.data)
+        if d[:1] == b"\x02" and len(d) >= 5:
+            limit = int.from_bytes(d[1:5], "little")
+        elif d[:1] == b"\x03" and len(d) >= 9:
+            price = int.from_bytes(d[1:9], "little")
+    return limit, price
+
+def _con_compute_budget(msg: MessageV0, cu_limit: int, cu_price: int | None) -> MessageV0:
+    """Mismo mensaje con el data de SetComputeUnitLimit/Price reescrito (mismo tamaño: no cambia el layout)."""
+    ixs = []
+    for ix in msg.instructions:
+        d = bytes(ix.data)
+        if msg.account_keys[ix.program_id_index] == COMPUTE_BUDGET_PROGRAM:
+            if d[:1] == b"\x02" and len(d) >= 5:
+                d = b"\x02" + int(cu_limit).to_bytes(4, "little") + d[5:]
+            elif d[:1] == b"\x03" and len(d) >= 9 and cu_price is not None:
+                d = b"\x03" + int(cu_price).to_bytes(8, "little") + d[9:]
+        ixs.append(CompiledInstruction(ix.program_id_index, d, bytes(ix.accounts)))
+    return MessageV0(msg.header, msg.account_keys, msg.recent_blockhash, ixs, msg.address_table_lookups)
+
+def ajustar_cu(raw: bytes, etiqueta: str, kp=None, simular_siempre=False, precio_max: int | None = None):
+    """
+    Ajusta el límite de CU de una TX v0 firmada y la re-firma.
+    - Con consumo típico cacheado para la etiqueta: se usa sin simular (salvo simular_siempre).
+    - Si no: una simulación; su consumo alimenta el cache y su error se devuelve antes de enviar.
+    - precio_max: el presupuesto de fee que sobra al bajar el límite se reinvierte en precio por CU (acotado).
+    Devuelve (raw, info) con info = {err, cu_limit, cu_price, units, via}; raw sin cambios si no aplica.
+    """
+    info = {"err": None, "cu_limit": None, "cu_price": None, "units": None, "via": "none"}
+    if not CU_SIM or not tx_codec.es_versionada(raw):
+        return raw, info
+    try:
+        vt = VersionedTransaction.from_bytes(raw)
+        msg = vt.message
+        lim0, price0 = _compute_budget(msg)
+        if lim0 is None:
+            return raw, info
+        limite = None if simular_siempre else cu_tipico(etiqueta)
+        if limite is not None:
+            info["via"] = "cache"
+        else:
+            err, units, logs = simular(raw)
+            info["via"] = "sim"
+            if err is not None:
+                info["err"] = err
+                emit("cu_sim_error", etiqueta=etiqueta, err=str(err), log=(logs[-1] if logs else None))
+                return raw, info
+            if not units:
+                return raw, info
+            info["units"] = int(units)
+            _registrar_cu(etiqueta, units)
+            limite = max(CU_MIN, int(units * CU_MARGEN))
+        if limite >= lim0:
+            info["cu_limit"] = lim0
+            return raw, info
+        precio = None
+        if precio_max and price0:
+            precio = min(int(precio_max), price0 * lim0 // limite)
+        nuevo = _con_compute_budget(msg, limite, precio)
+        raw = bytes(VersionedTransaction(nuevo, [_solders_kp(kp or keypair)]))
+        info.update(cu_limit=limite, cu_price=precio or price0)
+        emit("cu_ajustado", etiqueta=etiqueta, via=info["via"], cu_limit_antes=lim0, cu_limit=limite,
+             cu_price_antes=price0, cu_price=info["cu_price"], units=info["units"])
+        return raw, info
+    except Exception as e:
+        emit("cu_ajuste_error", etiqueta=etiqueta, err=str(e))
+        return raw, info
+
+# ===== Difusión multi-RPC =====
+REBROADCAST_EVERY  = 0.4     # s entre oleadas de re-difusión
+BROADCAST_MAX_SECS = 75.0    # techo si no se conoce lastValidBlockHeight (~150 slots)
+HEIGHT_CHECK_EVERY = 2.0     # s entre consultas de getBlockHeight para detectar expiración
+
+_BCAST_POOL = ThreadPoolExecutor(max_workers=8)
+
+def firma_de(raw: bytes) -> str:
+    """Primera firma de la TX serializada (la que identifica la transacción)."""
+    return str(Signature.from_bytes(tx_codec.primera_firma(raw)))
+
+class Difusion:
+    """
+    Una TX firmada enviada a todos los RPC a la vez (conexiones del pool) y re-difundida cada
+    'every' s hasta que confirma (confirmaciones: WS + polling), falla on-chain o expira su blockhash.
+    status: pending | confirmed | failed | expired | stopped
+    """
+
+    def __init__(self, raw: bytes, label="[SEND]", last_valid_block_height=None, urls=None,
+                 every=REBROADCAST_EVERY, max_secs=BROADCAST_MAX_SECS, commitment="confirmed", preflight=True):
+        self.raw = raw
+        self.b64 = b64encode(raw).decode()
+        self.sig = firma_de(raw)
+        self.label = label
+        self.urls = list(urls or BROADCAST_URLS)
+        self.last_valid = int(last_valid_block_height) if last_valid_block_height else None
+        self.every = every
+        self.max_secs = max_secs
+        self.commitment = commitment
+        self.preflight = preflight
+        self.status = "pending"
+        self.endpoint = None      # primer RPC que aceptó la TX
+        self.slot = None
+        self.err = None
+        self.rechazo = None       # error de preflight del primario (informativo: los demás van sin preflight)
+        self.acks = {}            # url -> nº de envíos aceptados
+        self.oleadas = 0
+        self.conf = None          # Future de confirmaciones (signatureSubscribe)
+        self.t0 = perf_counter()
+        self._done = threading.Event()
+        self._ack = threading.Event()
+        self._lock = threading.Lock()
+
+    # --- envío ---
+    def _send_one(self, url, skip_preflight):
+        cfg = {"encoding": "base64", "skipPreflight": bool(skip_preflight), "maxRetries": 0}
+        if not skip_preflight:
+            cfg["preflightCommitment"] = "confirmed"
+        try:
+            rpc("sendTransaction", [self.b64, cfg], timeout=3.0, url=url)
+            with self._lock:
+                self.acks[url] = self.acks.get(url, 0) + 1
+                if self.endpoint is None:
+                    self.endpoint = url
+                    emit("tx_sent", rpc=url, skip_preflight=bool(skip_preflight), sig=self.sig,
+                         dt_ms=int((perf_counter() - self.t0) * 1000))
+            self._ack.set()
+        except Exception as e:
+            emit("tx_send_error_try", rpc=url, skip_preflight=bool(skip_preflight), err=str(e))
+            # Rechazo de simulación en el primario: no basta para dar la TX por no enviada (los demás RPC
+            # la recibieron sin preflight y puede aterrizar; p.ej. "Blockhash not found" de un nodo atrasado)
+            if not skip_preflight and isinstance(e, RuntimeError):
+                self.rechazo = str(e)
+
+    def _oleada(self, primera=False):
+        self.oleadas += 1
+        return [_BCAST_POOL.submit(self._send_one, u, not (primera and self.preflight and i == 0))
+                for i, u in enumerate(self.urls)]
+
+    # --- estado ---
+    def _fin(self, status, err=None, slot=None):
+        with self._lock:
+            if self.status != "pending":
+                return
+            self.status, self.err, self.slot = status, err, slot
+        self._done.set()
+        self._ack.set()
+        if status in ("expired", "stopped") and self.conf is not None:
+            import confirmaciones
+            confirmaciones.soltar(self.sig, self.commitment)   # la firma deja de vigilarse si nadie más espera
+        emit("broadcast_done", sig=self.sig, status=status, rpc=self.endpoint, acks=dict(self.acks),
+             oleadas=self.oleadas, err=err, dt_ms=int((perf_counter() - self.t0) * 1000), label=self.label)
+
+    def _on_conf(self, fut):
+        try:
+            res = fut.result()
+        except CancelledError:
+            return   # soltada o expirada en confirmaciones
+        except Exception as e:
+            emit("broadcast_status_error", err=str(e))
+            return
+        if res["ok"]:
+            self._fin("confirmed", slot=res.get("slot"))
+            try:
+                import priority_fees   # diferido: priority_fees importa swap_exec
+                priority_fees.registrar_landing(self.sig, res.get("slot"))
+            except Exception as e:
+                emit("broadcast_landing_error", err=str(e))
+        else:
+            self._fin("failed", err=str(res.get("err")), slot=res.get("slot"))
+
+    def _run(self):
+        t_height = 0.0
+        while not self._done.wait(self.every):
+            now = perf_counter()
+            if now - self.t0 > self.max_secs:
+                self._fin("expired", err="timeout")
+                break
+            if self.last_valid and now - t_height >= HEIGHT_CHECK_EVERY:
+                t_height = now
+                try:
+                    if int(rpc("getBlockHeight", [{"commitment": "confirmed"}], timeout=2.0)) > self.last_valid:
+                        self._fin("expired", err="blockhash_expired")
+                        break
+                except Exception as e:
+                    emit("broadcast_height_error", err=str(e))
+            self._oleada()
+
+    def start(self):
+        """
+        Primera oleada; vuelve con la firma en cuanto un RPC la acepta. Relanza solo si todos la
+        rechazan: con algún ack la TX puede aterrizar y decide la confirmación.
+        """
+        with stage("send", label=self.label, n_rpc=len(self.urls)):
+            futs = self._oleada(primera=True)
+            while not self._ack.wait(0.05):
+                if all(f.done() for f in futs):
+                    break
+        if not self.acks:
+            err = self.rechazo or "ningún RPC aceptó la TX"
+            self._fin("failed", err=err)
+            emit("tx_send_failed", err=err)
+            raise RuntimeError(f"{self.label} {err}")
+        if self.rechazo:
+            emit("tx_preflight_rejected", sig=self.sig, err=self.rechazo, acks=dict(self.acks), label=self.label)
+        print(f"{self.label} sig={self.sig} rpc={self.endpoint}")
+        import confirmaciones   # diferido: confirmaciones importa swap_exec
+        self.conf = confirmaciones.suscribir(self.sig, self.commitment)
+        self.conf.add_done_callback(self._on_conf)
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def wait(self, timeout=None) -> str:
+        self._done.wait(timeout)
+        return self.status
+
+    def stop(self):
+        """Corta la re-difusión (p.ej. confirmada por otra vía)."""
+        self._fin("stopped")
+
+def broadcast(raw: bytes, label="[SEND]", last_valid_block_height=None, **kw) -> Difusion:
+    """Difunde la TX a todos los RPC (re-difusión en segundo plano). Ver Difusion."""
+    return Difusion(raw, label=label, last_valid_block_height=last_valid_block_height, **kw).start()
+
+# ===== Variantes async (mismo pool, sin bloquear el loop) =====
+async def aquote(params: dict, **kw):
+    return await asyncio.to_thread(quote, params, **kw)
+
+async def abuild_swap(quote_json: dict, **kw):
+    return await asyncio.to_thread(build_swap, quote_json, **kw)
+
+async def asign_tx(tx_b64_or_bytes, kp=None):
+    return await asyncio.to_thread(sign_tx, tx_b64_or_bytes, kp)
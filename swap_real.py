@@ -1,18 +1,24 @@
 # swap_real.py — Venta TOKEN -> (USDC|SOL) con fallback:
-# 1) Si falla la preferida, intenta la alternativa (USDC<->SOL).
-# 2) Si no hay ruta directa (NO_ROUTES_FOUND), reintenta sin onlyDirectRoutes.
+# 1) Cotiza USDC y SOL en paralelo y elige el mayor valor USD neto (ventana de gracia corta).
+# 2) Directa y no-direct se cotizan a la vez; la directa se prefiere si llega dentro de la gracia.
 #    Mantiene minOut estricto. Cambios acotados a cotización/selección de ruta.
+# 0) VIP con pool_id: swap directo contra el pool Raydium (sin Jupiter); si falla, flujo Jupiter.
+#    El modelo local del pool (en paralelo a las quotes) marca quotes desfasadas.
+# HTTP/quote/build/sign/send vía swap_exec (pool compartido).
 
-import sys, os, json, sqlite3, time, argparse, logging, traceback
+import sys, os, json, sqlite3, time, argparse, logging, traceback, subprocess
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
-from base64 import b64decode
-from solana.transaction import Transaction
-from solana.rpc.types import TxOpts
-from solana.rpc.api import Client  # noqa: F401 (client real viene de config)
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from time import perf_counter
 
+import swap_exec
+import balances
+import confirmaciones
+import reconciliar
+import priority_fees
+import raydium_directo
+import wallet_prep
+
 # === Telemetry (no-op fallback) ===
 try:
     from telemetry import emit  # type: ignore
@@ -22,13 +28,12 @@ except Exception:
 
 # === Config centralizada ===
 from config import (
-    client, keypair, wallet_pubkey,
-    JUPITER_API_KEY, QUOTE_URL, SWAP_URL,
+    wallet_pubkey,
     DB_NAME, AMOUNT_LAMPORTS as CFG_AMOUNT_LAMPORTS  # noqa: F401
 )
 
-USDC_MINT = "EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v"
-SOL_MINT  = "So11111111111111111111111111111111111111112"
+USDC_MINT = swap_exec.USDC_MINT
+SOL_MINT  = swap_exec.SOL_MINT
 
 # --- logging ---
 DEBUG = os.getenv("DEBUG_SWAP_REAL", "0") == "1"
@@ -37,49 +42,18 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(message)s",
 )
 
-# --- sesión HTTP reutilizable ---
-_SES = requests.Session()
-_SES.headers.update({"Accept": "application/json", "Connection": "keep-alive"})
-
+# --- HTTP vía pool compartido (swap_exec) ---
 def http_get(url, headers=None, params=None, timeout=5, attempts=2):
-    last_exc = None
-    for i in range(attempts):
-        try:
-            t0 = perf_counter()
-            r = _SES.get(url, headers=headers or {}, params=params or {}, timeout=timeout)
-            dt = int((perf_counter() - t0) * 1000)
-            emit("http_get", url=url, status=r.status_code, dt_ms=dt)
-            if r.status_code >= 400:
-                logging.warning(f"GET {url} {r.status_code}: {r.text[:300]}")
-            return r
-        except Exception as e:
-            last_exc = e
-            emit("http_get_error", url=url, err=str(e), attempt=i+1)
-            logging.error(f"GET {url} error: {e}\n{traceback.format_exc()}")
-            if i + 1 < attempts:
-                time.sleep(0.2 * (2 ** i))
-    if last_exc:
-        raise last_exc
+    r = swap_exec.http_get(url, headers=headers, params=params, timeout=timeout, attempts=attempts)
+    if r.status_code >= 400:
+        logging.warning(f"GET {url} {r.status_code}: {r.text[:300]}")
+    return r
 
 def http_post(url, headers=None, json_body=None, timeout=10, attempts=2):
-    last_exc = None
-    for i in range(attempts):
-        try:
-            t0 = perf_counter()
-            r = _SES.post(url, headers=headers or {}, json=json_body or {}, timeout=timeout)
-            dt = int((perf_counter() - t0) * 1000)
-            emit("http_post", url=url, status=r.status_code, dt_ms=dt)
-            if r.status_code >= 400:
-                logging.warning(f"POST {url} {r.status_code}: {r.text[:300]}")
-            return r
-        except Exception as e:
-            last_exc = e
-            emit("http_post_error", url=url, err=str(e), attempt=i+1)
-            logging.error(f"POST {url} error: {e}\n{traceback.format_exc()}")
-            if i + 1 < attempts:
-                time.sleep(0.2 * (2 ** i))
-    if last_exc:
-        raise last_exc
+    r = swap_exec.http_post(url, headers=headers, json_body=json_body, timeout=timeout, attempts=attempts)
+    if r.status_code >= 400:
+        logging.warning(f"POST {url} {r.status_code}: {r.text[:300]}")
+    return r
 
 # --- preparse --motivo sin romper argv actual ---
 _pre = argparse.ArgumentParser(add_help=False)
@@ -119,92 +93,24 @@ def db_exec(q, p=()):
         con.execute(q, p)
         con.commit()
 
-# ----- Precios Jupiter (USD) -----
-JUP_PRICE_URL = "https://price.jup.ag/v6/price?ids={mint}"
-
-def precio_jupiter_usd(mint, timeout=5):
-    try:
-        t0 = perf_counter()
-        r = http_get(JUP_PRICE_URL.format(mint=mint), timeout=timeout)
-        r.raise_for_status()
-        data = r.json()
-        entry = (data or {}).get("data", {}).get(mint)
-        px = (entry or {}).get("price")
-        if px is None:
-            emit("jup_price_none", mint=mint, dt_ms=int((perf_counter()-t0)*1000))
-            return None
-        f = float(px)
-        if f > 0:
-            emit("jup_price_ok", mint=mint, price=f, dt_ms=int((perf_counter()-t0)*1000))
-            return f
-        emit("jup_price_nonpos", mint=mint, dt_ms=int((perf_counter()-t0)*1000))
-        return None
-    except Exception as e:
-        emit("jup_price_error", mint=mint, err=str(e))
-        logging.debug(f"precio_jupiter_usd fail: {e}")
-        return None
-
-# ----- Precio “vivo” del trailing (DB) -----
-def precio_trailing_db(token_mint: str, fresh_secs: int = 10):
-    try:
-        with _db_connect() as con:
-            row = con.execute("""
-                SELECT price_usd, updated_at
-                FROM precios_live
-                WHERE address=?
-            """, (token_mint,)).fetchone()
-            if not row:
-                return None
-            px = float(row["price_usd"] or 0.0)
-            if px <= 0:
-                return None
-            try:
-                t = datetime.strptime(row["updated_at"], "%Y-%m-%d %H:%M:%S")
-            except Exception:
-                return None
-            age = (datetime.now() - t).total_seconds()
-            return px if age <= fresh_secs else None
-    except Exception as e:
-        logging.debug(f"precio_trailing_db fail: {e}")
-        return None
-
 # ----- Balance SPL (raw + ui) -----
-HELIUS_RPC_URL = os.getenv("HELIUS_RPC_URL", "https://mainnet.helius-rpc.com/?api-key=06d471af-62a0-40d9-867a-50d9aad046e6").strip()
-
 def consultar_balance_raw_and_ui(token_mint: str, timeout=8):
-    payload = {
-        "jsonrpc": "2.0", "id": 1, "method": "getTokenAccountsByOwner",
-        "params": [
-            str(wallet_pubkey),
-            {"programId": "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"},
-            {"encoding": "jsonParsed", "commitment": "processed"}
-        ]
-    }
+    """Saldo de la ATA del mint (raw, ui, dec) con un getMultipleAccounts; sin escanear la wallet."""
     try:
         t0 = perf_counter()
-        r = http_post(HELIUS_RPC_URL, json_body=payload, timeout=timeout)
-        emit("helius_balance_http", status=r.status_code, dt_ms=int((perf_counter()-t0)*1000))
-        r.raise_for_status()
-        vals = (r.json().get("result") or {}).get("value") or []
-        for acc in vals:
-            info = ((acc.get("account") or {}).get("data") or {}).get("parsed", {}).get("info", {})
-            if (info.get("mint") or "") != token_mint:
-                continue
-            ta = info.get("tokenAmount") or {}
-            raw = int(ta.get("amount") or "0")
-            dec = int(ta.get("decimals") or 0)
-            if raw > 0:
-                ui = raw / (10 ** dec if dec else 1)
-                emit("balance_found", mint=token_mint, raw=raw, ui=ui, dec=dec)
-                return raw, ui, dec
+        raw, ui, dec = balances.balance(token_mint)
+        emit("ata_balance_http", dt_ms=int((perf_counter()-t0)*1000))
+        if raw > 0:
+            emit("balance_found", mint=token_mint, raw=raw, ui=ui, dec=dec)
+            return raw, ui, dec
         emit("balance_zero", mint=token_mint)
         return 0, 0.0, None
     except Exception as e:
-        emit("helius_balance_error", err=str(e))
+        emit("ata_balance_error", err=str(e))
         logging.error(f"❌ Error consultando balance: {e}\n{traceback.format_exc()}")
         return 0, 0.0, None
 
-# ===== Cotización hop=1 con fallback a no-direct =====
+# ===== Cotización hop=1 y no-direct en paralelo =====
 def _quote_request(input_mint: str, output_mint: str, amount_raw: int,
                    slippage_bps: int, max_accounts: int, timeout_quote: int,
                    direct_only: bool):
@@ -219,9 +125,8 @@ def _quote_request(input_mint: str, output_mint: str, amount_raw: int,
         "restrictIntermediateTokens": "true",   # nunca false en free tier
         "maxAccounts": max_accounts
     }
-    headers = {"accept": "application/json", "Authorization": f"Bearer {JUPITER_API_KEY}"}
     t0 = perf_counter()
-    qr = http_get(QUOTE_URL, headers=headers, params=params, timeout=timeout_quote)
+    qr = swap_exec.quote(params, timeout=timeout_quote, attempts=2, route=output_mint[:6], direct=direct_only)
     emit("quote_http", input=input_mint, output=output_mint, status=qr.status_code,
          dt_ms=int((perf_counter()-t0)*1000), max_accounts=max_accounts, direct_only=direct_only)
 
@@ -247,30 +152,80 @@ def _quote_request(input_mint: str, output_mint: str, amount_raw: int,
         return None, "NO_ROUTE"
     return q, None
 
+DIRECT_GRACE_S = 0.10   # con una no-direct válida en mano, espera máx. por la directa
+EST_WAIT_S     = 0.05   # con una quote en mano, espera máx. por el modelo local del pool
+_QUOTE_POOL = ThreadPoolExecutor(max_workers=8)
+
+def _estimacion(est, output_mint: str):
+    """Modelo local (dict o Future) si ya está y va hacia output_mint; None si no (no frena la quote)."""
+    if isinstance(est, Future):
+        try:
+            est = est.result(timeout=EST_WAIT_S)
+        except Exception:
+            return None
+    if not est or est.get("mint_out") != output_mint:
+        return None
+    return est
+
 def cotizar_hop1_con_fallback(input_mint: str, output_mint: str, amount_raw: int,
-                              slippage_bps: int, max_accounts: int, timeout_quote: int):
-    # 1) directo hop=1
-    q, err = _quote_request(input_mint, output_mint, amount_raw, slippage_bps, max_accounts, timeout_quote,
-                            direct_only=True)
-    if q is not None:
+                              slippage_bps: int, max_accounts: int, timeout_quote: int,
+                              grace: float = DIRECT_GRACE_S, est=None):
+    """
+    Directa (hop=1) y no-direct en paralelo: un solo round trip en el peor caso.
+    Ambas pasan por ruta_valida; la directa se prefiere si llega dentro de la ventana de gracia.
+    est: modelo local del pool VIP (dict o Future en curso); solo sirve para el contraste de
+    ruta_valida, la directa se pide siempre (puede ir por otro pool con más liquidez).
+    """
+    kinds = [("direct", True), ("non_direct", False)]
+    futs = {
+        _QUOTE_POOL.submit(_quote_request, input_mint, output_mint, amount_raw, slippage_bps,
+                           max_accounts, timeout_quote, direct): kind
+        for kind, direct in kinds
+    }
+    validas, errs = {}, {}
+    pendientes = set(futs)
+    deadline = None
+    while pendientes and "direct" not in validas:
+        timeout = None if deadline is None else max(0.0, deadline - perf_counter())
+        done, pendientes = wait(pendientes, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for f in done:
+            kind = futs[f]
+            try:
+                q, err = f.result()
+            except Exception as e:
+                q, err = None, f"EXC_{e}"
+            if q is None:
+                errs[kind] = err or "err"
+                continue
+            if kind == "non_direct":
+                q["_non_direct"] = True
+            ok, why = ruta_valida(q, _estimacion(est, output_mint))
+            if not ok:
+                errs[kind] = f"route_invalid:{why}"
+                continue
+            validas[kind] = q
+            if kind == "non_direct" and deadline is None:
+                deadline = perf_counter() + grace
+    for f in pendientes:
+        f.cancel()
+
+    if "direct" in validas:
         emit("quote_ok_hop1", output=output_mint)
+        return validas["direct"], None
+    if "non_direct" in validas:
+        q = validas["non_direct"]
+        emit("quote_ok_non_direct", output=output_mint, legs=len(q.get("routePlan") or []),
+             direct=errs.get("direct", "pending"))
         return q, None
-
-    # 2) no-direct si el error fue ruta inexistente o HTTP 400
-    if err and ("NO_ROUTE" in err or "NO_ROUTES_FOUND" in err or "HTTP_400" in err):
-        emit("quote_retry_non_direct", output=output_mint, reason=err)
-        q2, err2 = _quote_request(input_mint, output_mint, amount_raw, slippage_bps, max_accounts, timeout_quote,
-                                  direct_only=False)
-        if q2 is not None:
-            q2["_non_direct"] = True
-            emit("quote_ok_non_direct", output=output_mint, legs=len(q2.get("routePlan") or []))
-            return q2, None
-        return None, err2 or err
-
-    return None, err or "NO_ROUTE"
+    return None, errs.get("direct") or errs.get("non_direct") or "NO_ROUTE"
 
 # ----- Filtro de ruta -----
-def ruta_valida(quote):
+MAX_PI_DIRECTA  = 0.004    # price impact máx. ruta directa
+DESVIO_MAX_BPS  = 100      # Jupiter promete más que el pool por encima de esto → estado viejo
+
+def ruta_valida(quote, est=None):
     rp = quote.get("routePlan") or []
     # Acepta multi-hop solo si fue obtenido en fallback no-direct
     if len(rp) != 1 and not quote.get("_non_direct"):
@@ -302,7 +257,7 @@ def ruta_valida(quote):
     except Exception:
         pi = 0.0
 
-    if (not quote.get("_non_direct") and pi > 0.004) or (quote.get("_non_direct") and pi > 0.015):
+    if (not quote.get("_non_direct") and pi > MAX_PI_DIRECTA) or (quote.get("_non_direct") and pi > 0.015):
         emit("route_invalid", reason="price_impact", price_impact=pi)
         return False, f"pi={pi:.5f}"
 
@@ -314,6 +269,14 @@ def ruta_valida(quote):
         emit("route_invalid", reason="outAmount<=0")
         return False, "outAmount<=0"
 
+    # contraste con el modelo local del pool VIP (misma pool y destino)
+    dev = raydium_directo.desvio_bps(quote, est)
+    if dev is not None:
+        emit("quote_vs_local", amm=label or "n/a", desvio_bps=dev, local_out=est["out"], out_amt=out_amt)
+        if dev > DESVIO_MAX_BPS:
+            emit("route_invalid", reason="stale_vs_local", desvio_bps=dev)
+            return False, f"desvio_local={dev}bps"
+
     emit("route_valid", amm=label or "n/a", legs=len(rp), fees_bps=fees_bps, price_impact=pi, out_amt=out_amt, non_direct=bool(quote.get("_non_direct")))
     return True, "ok"
 
@@ -329,20 +292,18 @@ def construir_y_enviar_swap(quote, wrap_unwrap: bool, timeout_swap: int, slippag
     if out_amt <= 0:
         return None, "outAmount<=0"
     min_out = _calc_min_out(out_amt, slippage_bps)
-    emit("build_swap", min_out=min_out, slippage_bps=slippage_bps, wrap_unwrap=bool(wrap_unwrap))
-
-    headers = {"accept": "application/json", "Authorization": f"Bearer {JUPITER_API_KEY}"}
-    body = {
-        "quoteResponse": quote,
-        "userPublicKey": str(wallet_pubkey),
-        "wrapAndUnwrapSol": wrap_unwrap,
-        "dynamicSlippage": False,
-        "minOut": min_out,
-        "asLegacyTransaction": True,
-        "computeUnitPriceMicroLamports": 9000
-    }
+    cu_price = priority_fees.cu_price("exit", priority_fees.cuentas_pool(quote.get("inputMint"), quote.get("outputMint")))
+    emit("build_swap", min_out=min_out, slippage_bps=slippage_bps, wrap_unwrap=bool(wrap_unwrap), cu_price=cu_price)
+
     t0 = perf_counter()
-    sr = http_post(SWAP_URL, headers=headers, json_body=body, timeout=timeout_swap)
+    sr = swap_exec.build_swap(
+        quote, timeout=timeout_swap, attempts=2, tags={"side": "sell"},
+        wrapAndUnwrapSol=wrap_unwrap,
+        dynamicSlippage=False,
+        minOut=min_out,
+        asLegacyTransaction=False,     # v0 + address lookup tables
+        computeUnitPriceMicroLamports=cu_price,
+    )
     emit("swap_http", status=sr.status_code, dt_ms=int((perf_counter()-t0)*1000))
     if sr.status_code != 200:
         emit("swap_bad_status", status=sr.status_code)
@@ -357,21 +318,23 @@ def construir_y_enviar_swap(quote, wrap_unwrap: bool, timeout_swap: int, slippag
         emit("swap_missing_tx")
         return None, "swapTransaction vacío"
     try:
-        tx_decoded = b64decode(raw_b64)
-        tx = Transaction.deserialize(tx_decoded)
-        tx.sign(keypair)
+        raw = swap_exec.sign_tx(raw_b64)
     except Exception as e:
         emit("tx_build_error", err=str(e))
         return None, f"tx_build {e}"
+    # límite de CU ajustado (simulación = chequeo previo) y el fee sobrante reinvertido en precio por CU
+    raw, cu = swap_exec.ajustar_cu(raw, "sell:" + swap_exec.etiqueta_cu(quote),
+                                   precio_max=priority_fees.PERFILES["exit"]["max"])
+    if cu["err"] is not None:
+        return None, f"sim {cu['err']}"
+    cu_price = cu["cu_price"] or cu_price
     try:
         t0s = perf_counter()
-        sent = client.send_raw_transaction(
-            tx.serialize(),
-            opts=TxOpts(skip_preflight=False, preflight_commitment="confirmed", max_retries=5)
-        )
+        d = swap_exec.broadcast(raw, label="[SELL] SEND", last_valid_block_height=sj.get("lastValidBlockHeight"))
+        sig = d.sig
         dt = int((perf_counter() - t0s) * 1000)
-        sig = sent["result"] if isinstance(sent, dict) and "result" in sent else getattr(sent, "value", sent)
-        emit("tx_sent_confirmed", sig=str(sig), dt_ms=dt)
+        emit("tx_sent_confirmed", sig=str(sig), rpc=d.endpoint, dt_ms=dt)
+        priority_fees.registrar_envio(sig, "exit", cu_price)
         return str(sig), None
     except Exception as e:
         emit("tx_send_error", err=str(e))
@@ -385,23 +348,133 @@ def estimar_px_usd_por_token(out_raw: int, output_mint: str, qty_in_ui: float):
     if output_mint == USDC_MINT:
         out_usd_value = out_ui
     else:
-        sol_px = precio_jupiter_usd(SOL_MINT) or 0.0
+        sol_px = precio_sol_cacheado() or 0.0
         out_usd_value = out_ui * sol_px if sol_px > 0 else 0.0
     return (out_usd_value / qty_in_ui) if out_usd_value > 0 else 0.0
 
+# ----- Selección de ruta por mejor ejecución -----
+SELECT_GRACE_S    = 0.15   # espera máx. por el otro destino tras la primera ruta válida
+PREFER_MARGIN_BPS = 5      # la ruta no preferida debe superar a la preferida por este margen
+SOL_PX_TTL        = 30.0
+
+_SOL_PX = {"ts": 0.0, "px": None}
+
+def precio_sol_cacheado(ttl: float = SOL_PX_TTL):
+    """Precio SOL/USD con cache corto (una consulta por proceso en una salida normal)."""
+    now = time.monotonic()
+    if _SOL_PX["px"] and now - _SOL_PX["ts"] <= ttl:
+        return _SOL_PX["px"]
+    px = reconciliar.precio_sol_usd(timeout=1.5)
+    if px:
+        _SOL_PX.update(ts=now, px=px)
+    return _SOL_PX["px"]
+
+def valor_usd_quote(quote, output_mint: str, sol_px: float | None):
+    """
+    USD que entrega la quote. outAmount ya descuenta fees del pool y price impact,
+    así que es el neto comparable entre destinos. None si no hay precio de SOL.
+    """
+    try:
+        out_raw = int(quote.get("outAmount") or 0)
+    except Exception:
+        return None
+    if output_mint == USDC_MINT:
+        return out_raw / 1e6
+    return out_raw / 1e9 * sol_px if sol_px else None
+
+def elegir_ruta(token_mint: str, raw: int, targets, prefer: str,
+                slippage_bps: int, max_accounts: int, timeout_quote: int,
+                grace: float = SELECT_GRACE_S, est=None):
+    """
+    Cotiza todos los destinos en paralelo. Tras la primera ruta válida espera como mucho
+    'grace' s al resto y elige la de mayor valor USD neto; 'prefer' gana salvo que la otra
+    la supere por PREFER_MARGIN_BPS. Devuelve ((name, output_mint, quote) | None, errs).
+    """
+    t0 = perf_counter()
+    ex = ThreadPoolExecutor(max_workers=len(targets) + 1)
+    f_px = ex.submit(precio_sol_cacheado)
+    futs = {ex.submit(cotizar_hop1_con_fallback, token_mint, omint, raw,
+                      slippage_bps, max_accounts, timeout_quote,
+                      est=est): (name, omint)
+            for name, omint in targets}
+    validas = {}
+    errs = {}
+    deadline = None
+    pendientes = set(futs)
+    try:
+        while pendientes:
+            timeout = None if deadline is None else max(0.0, deadline - perf_counter())
+            done, pendientes = wait(pendientes, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                name, omint = futs[f]
+                try:
+                    q, err = f.result()
+                except Exception as e:
+                    q, err = None, f"EXC_{e}"
+                if q is None:
+                    errs[name] = err or "err"
+                    emit("quote_fail", route=name, error=str(err))
+                    continue
+                emit("quote_ok", route=name, output_mint=omint, non_direct=bool(q.get("_non_direct")))
+                validas[name] = (name, omint, q)
+                if deadline is None:
+                    deadline = perf_counter() + grace
+        if pendientes:
+            emit("route_grace_expired", pending=[futs[f][0] for f in pendientes], grace_ms=int(grace * 1000))
+        if not validas:
+            return None, errs
+
+        try:
+            sol_px = f_px.result(timeout=grace)
+        except Exception:
+            sol_px = _SOL_PX["px"]
+        valores = {n: valor_usd_quote(v[2], v[1], sol_px) for n, v in validas.items()}
+
+        best = validas.get(prefer) or next(iter(validas.values()))
+        otros = [n for n in validas if n != best[0] and valores.get(n) is not None]
+        v_best = valores.get(best[0])
+        margin_bps = None
+        if otros and v_best:
+            rival = max(otros, key=lambda n: valores[n])
+            margin_bps = int(round((valores[rival] / v_best - 1) * 10_000))
+            if margin_bps > PREFER_MARGIN_BPS:
+                best = validas[rival]
+        emit("route_compare", chosen=best[0], prefer=prefer, margin_bps=margin_bps,
+             usd={n: (round(v, 6) if v is not None else None) for n, v in valores.items()},
+             sol_px=sol_px, dt_ms=int((perf_counter() - t0) * 1000))
+        logging.info(f"[SELL] ruta={best[0]} prefer={prefer} margen_bps={margin_bps} usd={valores}")
+        return best, errs
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
 # ----- Swap Jupiter -----
 def ejecutar_swap_salida(token_mint: str, slippage_bps: int, max_accounts: int,
-                         timeout_quote: int, timeout_swap: int):
+                         timeout_quote: int, timeout_swap: int,
+                         raw_amount: int | None = None, decimals: int | None = None):
     """
     Devuelve dict {'txid': str, 'qty_ui': float, 'route': 'USDC'|'SOL', 'price_out_est': float}
+    raw_amount: saldo raw ya conocido por el llamador (suscripción a la ATA) → sin consulta de balance.
     """
     emit("sell_start", token_mint=token_mint, wallet=str(wallet_pubkey))
     # 1) route_base desde vip_tokens
-    row = db_row("SELECT route_base FROM vip_tokens WHERE address=?", (token_mint,))
+    row = db_row("SELECT route_base, pool_id FROM vip_tokens WHERE address=?", (token_mint,))
     prefer = (row["route_base"] if row else None) or "USDC"
-
-    # 2) Balance
-    raw, ui, dec = consultar_balance_raw_and_ui(token_mint)
+    pool_id = row["pool_id"] if row else None
+
+    # fees recientes (pool del VIP; sin pool, ambos destinos) en paralelo con el balance
+    priority_fees.precalentar(priority_fees.cuentas_pool(token_mint, USDC_MINT))
+    priority_fees.precalentar(priority_fees.cuentas_pool(token_mint, SOL_MINT))
+
+    # 2) Balance (el del trader si viene; si no, ATA por RPC)
+    if raw_amount and raw_amount > 0:
+        raw = int(raw_amount)
+        dec = decimals if decimals is not None else balances.decimales(token_mint)
+        ui = raw / (10 ** dec) if dec else float(raw)
+        emit("sell_balance_live", raw=raw, dec=dec)
+    else:
+        raw, ui, dec = consultar_balance_raw_and_ui(token_mint)
     if raw <= 0:
         logging.error("❌ No hay balance para vender.")
         emit("sell_abort", reason="no_balance")
@@ -410,30 +483,31 @@ def ejecutar_swap_salida(token_mint: str, slippage_bps: int, max_accounts: int,
 
     logging.info(f"[SELL] {token_mint[:6]}… qty={ui:.6f} (raw={raw}) prefer={prefer}")
 
-    # 3) Intento paralelo con fallback interno
+    # 2.1) Pool hop=1 conocido: swap directo (sin /quote ni /swap); cualquier fallo → Jupiter
+    if pool_id:
+        cu_price = priority_fees.cu_price("exit", priority_fees.cuentas_pool(token_mint))
+        res = raydium_directo.swap(pool_id, token_mint, raw, slippage_bps, cu_price, lado="sell",
+                                   precio_max=priority_fees.PERFILES["exit"]["max"])
+        if res:
+            route = "USDC" if res["mint_out"] == USDC_MINT else "SOL"
+            priority_fees.registrar_envio(res["sig"], "exit", res["cu_price"])
+            logging.info(f"✅ TXID (directo {res['tipo']}): {res['sig']}")
+            emit("sell_done", txid=str(res["sig"]), route=route, direct=True)
+            return {
+                "txid": res["sig"],
+                "qty_ui": float(ui),
+                "route": route,
+                "price_out_est": float(estimar_px_usd_por_token(res["out_est"], res["mint_out"], ui)),
+            }
+        emit("sell_direct_fallback", pool=pool_id)
+
+    # 3) Cotización paralela de ambos destinos + selección por valor USD neto (ventana de gracia)
     targets = [("USDC", USDC_MINT), ("SOL", SOL_MINT)]
     targets.sort(key=lambda t: 0 if t[0] == prefer else 1)
-
-    futs = {}
-    with ThreadPoolExecutor(max_workers=2) as ex:
-        for name, omint in targets:
-            futs[ex.submit(cotizar_hop1_con_fallback, token_mint, omint, raw,
-                           slippage_bps, max_accounts, timeout_quote)] = (name, omint)
-
-        best = None
-        errs = {}
-        for f in as_completed(futs):
-            name, omint = futs[f]
-            q, err = f.result()
-            if q is not None:
-                emit("quote_ok", route=name, output_mint=omint, non_direct=bool(q.get("_non_direct")))
-                if name == prefer and best is None:
-                    best = (name, omint, q)
-                elif best is None:
-                    best = (name, omint, q)
-            else:
-                errs[name] = err or "err"
-                emit("quote_fail", route=name, error=str(err))
+    # modelo local del pool en paralelo a las quotes: ruta_valida lo usa si ya está
+    f_est = _QUOTE_POOL.submit(raydium_directo.estimar, pool_id, token_mint, raw) if pool_id else None
+    best, errs = elegir_ruta(token_mint, raw, targets, prefer, slippage_bps, max_accounts, timeout_quote,
+                             est=f_est)
 
     # Fallback explícito a la alternativa si nada elegido
     if best is None and errs:
@@ -451,12 +525,6 @@ def ejecutar_swap_salida(token_mint: str, slippage_bps: int, max_accounts: int,
 
     route, output_mint, quote = best
 
-    # 3.1) Filtro de ruta
-    ok, why = ruta_valida(quote)
-    if not ok:
-        logging.error(f"⚠️ Ruta inválida en salida: {why}")
-        emit("sell_abort", reason="route_invalid", detail=why)
-        return False
     emit("route_selected", route=route, output_mint=output_mint, non_direct=bool(quote.get("_non_direct")))
 
     out_raw = int(quote.get("outAmount") or 0)
@@ -464,7 +532,8 @@ def ejecutar_swap_salida(token_mint: str, slippage_bps: int, max_accounts: int,
     emit("sell_estimation", out_raw=out_raw, price_out_est=est_price_out_usd_per_token)
 
     # 4) Construir swap y enviar
-    wrap_unwrap = True
+    # con wSOL persistente (wallet_prep) el producto en SOL queda envuelto: TX sin create/close del wSOL
+    wrap_unwrap = not (output_mint == SOL_MINT and wallet_prep.wsol_lista())
     txid, err = construir_y_enviar_swap(quote, wrap_unwrap, timeout_swap, slippage_bps)
     if err:
         logging.error(f"❌ swap error: {err}")
@@ -481,11 +550,65 @@ def ejecutar_swap_salida(token_mint: str, slippage_bps: int, max_accounts: int,
     }
 
 # ----- Registrar salida en 'operaciones' -----
+def _fill_entrada(op_id):
+    try:
+        row = db_row("SELECT fill_entrada FROM operaciones WHERE id=?", (op_id,))
+        return float(row["fill_entrada"] or 0.0) if row else 0.0
+    except Exception:
+        return 0.0   # columna aún no creada (sin reconciliación previa)
+
+def _profit(price_in, price_out, qty_ui):
+    if price_in > 0 and price_out and price_out > 0:
+        profit_pct = round((price_out / price_in - 1) * 100, 2)
+        profit_usd = round((qty_ui or 0.0) * (price_out - price_in), 4) if (qty_ui and qty_ui > 0) else 0.0
+        return profit_pct, profit_usd
+    return 0.0, 0.0
+
+def _actualizar_operacion(op_id, price_out, profit_pct, profit_usd, nota, hora_salida=True):
+    with _db_connect() as con:
+        if hora_salida:
+            con.execute("""
+                UPDATE operaciones SET
+                    hora_salida   = ?,
+                    price_salida  = ?,
+                    profit_percent= ?,
+                    profit_usd    = ?,
+                    note          = ?
+                WHERE id = ?
+            """, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), round(price_out or 0.0, 6),
+                  profit_pct, profit_usd, nota, op_id))
+        else:
+            con.execute("""
+                UPDATE operaciones SET price_salida=?, profit_percent=?, profit_usd=?, note=?
+                WHERE id = ?
+            """, (round(price_out or 0.0, 6), profit_pct, profit_usd, nota, op_id))
+        con.commit()
+
+def _lanzar_reconciliacion(op_id, sig, token_mint, px_decision, qty_ui, nota_base):
+    """Confirmación + fill en un proceso desacoplado: la venta termina sin esperar a la cadena."""
+    cmd = [sys.executable, os.path.abspath(__file__), token_mint, "--reconciliar-op", str(op_id), "--sig", str(sig),
+           "--px-decision", str(px_decision or 0.0), "--qty-ui", str(qty_ui or 0.0), "--motivo", nota_base]
+    try:
+        kw = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "stdin": subprocess.DEVNULL}
+        if os.name == "nt":
+            kw["creationflags"] = 0x00000008 | 0x00000200   # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+        else:
+            kw["start_new_session"] = True
+        subprocess.Popen(cmd, **kw)
+        emit("reconcile_exit_spawned", op_id=op_id, sig=str(sig))
+    except Exception as e:
+        emit("reconcile_exit_spawn_error", op_id=op_id, err=str(e))
+
 def registrar_salida(token_mint: str,
                      route: str,
                      qty_ui: float | None,
                      price_out_est: float | None = None,
-                     motivo: str = ""):
+                     motivo: str = "",
+                     sig: str | None = None):
+    """
+    Cierra la operación en cuanto la venta está enviada, con el precio estimado de la quote (o sin
+    precio). La confirmación y el fill real los escribe después un proceso aparte (reconciliar_salida_op).
+    """
     try:
         with _db_connect() as con:
             cur = con.cursor()
@@ -501,58 +624,55 @@ def registrar_salida(token_mint: str,
                 return
             op_id, price_in = row[0], float(row[1] or 0.0)
 
-        fuente_price = None
-        price_out = precio_trailing_db(token_mint, fresh_secs=10)
-        if price_out and price_out > 0:
-            fuente_price = "trailing"
-        if not price_out or price_out <= 0:
-            price_out = float(price_out_est or 0.0)
-            if price_out > 0:
-                fuente_price = "estimado_swap"
-        if not price_out or price_out <= 0:
-            jpx = precio_jupiter_usd(token_mint)
-            if jpx and jpx > 0:
-                price_out = jpx
-                fuente_price = "jup_price"
-
-        if price_in > 0 and price_out and price_out > 0:
-            profit_pct = round((price_out / price_in - 1) * 100, 2)
-            profit_usd = round((qty_ui or 0.0) * (price_out - price_in), 4) if (qty_ui and qty_ui > 0) else 0.0
-        else:
-            profit_pct = 0.0
-            profit_usd = 0.0
+        # Solo el estimado de la quote (sin consultas); el fill real (getTransaction) lo corrige en segundo plano
+        price_out = float(price_out_est or 0.0)
+        fuente_price = "estimado_swap" if price_out > 0 else None
 
-        nota = f"swap automático ({route})"
+        profit_pct, profit_usd = _profit(price_in, price_out, qty_ui)
+
+        nota_base = f"swap automático ({route})"
         if motivo:
-            nota += f" | {motivo}"
-        if fuente_price:
-            nota += f" | px={fuente_price}"
+            nota_base += f" | {motivo}"
+        nota = nota_base + (f" | px={fuente_price}" if fuente_price else "")
 
-        with _db_connect() as con:
-            cur = con.cursor()
-            cur.execute("""
-                UPDATE operaciones SET
-                    hora_salida   = ?,
-                    price_salida  = ?,
-                    profit_percent= ?,
-                    profit_usd    = ?,
-                    note          = ?
-                WHERE id = ?
-            """, (
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                round(price_out or 0.0, 6),
-                profit_pct,
-                profit_usd,
-                nota,
-                op_id
-            ))
-            con.commit()
+        _actualizar_operacion(op_id, price_out, profit_pct, profit_usd, nota)
         logging.info("📒 Operación actualizada en DB.")
         emit("reg_salida_ok", op_id=op_id, price_out=price_out, profit_pct=profit_pct, profit_usd=profit_usd, fuente=fuente_price or "n/a")
+        if sig:
+            _lanzar_reconciliacion(op_id, sig, token_mint, price_out or None, qty_ui, nota_base)
     except Exception as e:
         emit("reg_salida_error", err=str(e))
         logging.error(f"⚠️ Error registrando operación: {e}\n{traceback.format_exc()}")
 
+def reconciliar_salida_op(op_id: int, sig: str, token_mint: str, px_decision: float | None,
+                          qty_ui: float | None, nota_base: str):
+    """Espera la confirmación de la venta y reescribe precio/profit de la operación con el fill real."""
+    conf = confirmaciones.esperar(sig, timeout=60)
+    if conf and conf["ok"]:
+        priority_fees.registrar_landing(sig, conf.get("slot"))
+    if not conf or not conf["ok"]:
+        estado = "tx_fallida" if conf else "sin_confirmar"
+        emit("reconcile_exit_unconfirmed", op_id=op_id, sig=str(sig), estado=estado, err=str((conf or {}).get("err")))
+        try:
+            with _db_connect() as con:
+                con.execute("UPDATE operaciones SET note = COALESCE(note,'') || ? WHERE id = ?", (f" | {estado}", op_id))
+                con.commit()
+        except Exception as e:
+            emit("reg_salida_error", err=str(e))
+        return None
+    fill = reconciliar.reconciliar_salida(op_id, sig, token_mint, precio_decision=px_decision)
+    if not fill or not fill.get("precio_usd"):
+        return fill
+    price_in = _fill_entrada(op_id)
+    if not price_in:
+        row = db_row("SELECT price_entrada FROM operaciones WHERE id=?", (op_id,))
+        price_in = float(row["price_entrada"] or 0.0) if row else 0.0
+    qty = fill.get("token_ui") or qty_ui
+    profit_pct, profit_usd = _profit(price_in, fill["precio_usd"], qty)
+    _actualizar_operacion(op_id, fill["precio_usd"], profit_pct, profit_usd, f"{nota_base} | px=fill", hora_salida=False)
+    emit("reg_salida_fill", op_id=op_id, price_out=fill["precio_usd"], profit_pct=profit_pct, profit_usd=profit_usd)
+    return fill
+
 # ----- CLI -----
 def parse_args():
     p = argparse.ArgumentParser(description="swap_real — salida TOKEN -> (USDC|SOL) hop=1 + fallback")
@@ -563,6 +683,13 @@ def parse_args():
     p.add_argument("--max-accounts", type=int, default=48, help="maxAccounts para Jupiter (default 48)")
     p.add_argument("--timeout-quote", type=int, default=5, help="timeout GET /quote (s)")
     p.add_argument("--timeout-swap", type=int, default=10, help="timeout POST /swap (s)")
+    p.add_argument("--raw-amount", type=int, default=None, help="Saldo raw conocido (evita consultar balance)")
+    p.add_argument("--decimals", type=int, default=None, help="Decimales del token (con --raw-amount)")
+    # Uso interno: confirmación + fill de una venta ya registrada (proceso desacoplado)
+    p.add_argument("--reconciliar-op", type=int, default=None, help=argparse.SUPPRESS)
+    p.add_argument("--sig", default=None, help=argparse.SUPPRESS)
+    p.add_argument("--px-decision", type=float, default=None, help=argparse.SUPPRESS)
+    p.add_argument("--qty-ui", type=float, default=None, help=argparse.SUPPRESS)
     return p.parse_args()
 
 def main():
@@ -571,6 +698,10 @@ def main():
         sys.exit(2)
     args = parse_args()
     token_mint = args.token_mint.strip()
+    if args.reconciliar_op is not None:
+        reconciliar_salida_op(args.reconciliar_op, args.sig, token_mint, args.px_decision or None,
+                              args.qty_ui or None, args.motivo or "")
+        sys.exit(0)
     emit("cli_start", token_mint=token_mint, motivo=args.motivo, slippage_bps=args.slippage_bps, max_accounts=args.max_accounts)
 
     try:
@@ -579,7 +710,9 @@ def main():
             slippage_bps=args.slippage_bps,
             max_accounts=args.max_accounts,
             timeout_quote=args.timeout_quote,
-            timeout_swap=args.timeout_swap
+            timeout_swap=args.timeout_swap,
+            raw_amount=args.raw_amount,
+            decimals=args.decimals,
         )
         if not txinfo:
             logging.error("❌ Swap no ejecutado.")
@@ -590,7 +723,8 @@ def main():
             txinfo.get("route"),
             txinfo.get("qty_ui"),
             txinfo.get("price_out_est"),
-            args.motivo or ""
+            args.motivo or "",
+            sig=txinfo.get("txid"),
         )
         emit("cli_end", ok=True)
         sys.exit(0)
@@ -5,14 +5,25 @@
 import os, sys, time, json, sqlite3, threading, asyncio, subprocess, random, requests
 from datetime import datetime
 import websockets
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from decimal import Decimal, ROUND_HALF_UP
 from telemetry import Timer, jlog              # ← observabilidad
 from config import WS_URL, WS_PING_INTERVAL, WS_PING_TIMEOUT  # <<< WS centralizado
+from config import AMOUNT_USDC                                # ← monto único (compra_previa usa el mismo)
+import compra_swap_usdc, compra_swap_sol       # ← preparación in-process para carrera USDC/SOL
+import confirmaciones                          # ← compra aterrizada antes de iniciar trailing
+import balances                                # ← ATA propia del mint (suscripción de posición)
+import reconciliar                             # ← fill real de la compra desde la TX
+import rutas_stats                             # ← formas de quote que aterrizan (compra adaptativa)
+import raydium_directo, priority_fees          # ← compra directa contra el pool VIP (sin Jupiter)
+import compra_previa                           # ← compra preparada por el orquestador en la pre-señal
+import vault_feed                              # ← feed de vaults (WS) y estado heredado del orquestador
+from vault_feed import PriceFeed
 
 DB_NAME = "goodt.db"
 
 # ===== Parámetros (no tocar) =====
-MONTO_USDC        = 2.0
+MONTO_USDC        = AMOUNT_USDC
 SLIPPAGE_INFO     = "0.5%"
 ACTIVA_TRAIL_EN   = 0.020    # +2.0%
 TRAILING_STOP     = 0.007    # -0.7%
@@ -24,6 +35,9 @@ WAIT_FIRST_WS     = 2.0
 POLL_SECONDS      = 0.40
 DORMIDO_WINDOW    = 360      # 6 minutos
 DORMIDO_BANDA     = 0.005    # ±0.5%
+BUY_GRACE_SECS    = 0.15     # tras la 1ª ruta válida, espera a la otra para comparar
+BUY_CONFIRM_SECS  = 30.0     # espera máx. de confirmación de la compra (signatureSubscribe)
+SLIPPAGE_BPS_DIRECTO = 30      # min_out del swap directo (mismo 0.3% que las quotes de compra)
 
 # --- Anti-429 / HTTP control ---
 PRICE_TTL         = 2.0
@@ -216,12 +230,14 @@ def precio_sol_usd(ttl=3.0):
         _SOL_CACHE["ts"] = now
     return _SOL_CACHE["px"]
 
-# ===== WS feed de precio (Raydium CPMM via vaults) =====
-class PriceFeed:
-    def __init__(self, vault_quote: str, vault_token: str):
-        self.vq = vault_quote
-        self.vt = vault_token
-        self._last = None   # (price_raw_quote_per_token, ts_monotonic)
+# ===== WS posición propia (ATA del mint operado) =====
+class PosicionFeed:
+    """Saldo raw de la ATA propia en memoria (accountSubscribe, processed). Evita consultar balance al vender."""
+
+    def __init__(self, mint: str):
+        self.mint = mint
+        self.ata = None     # se deriva en el hilo (necesita el programa del mint: Token / Token-2022)
+        self._raw = None
         self._stop = threading.Event()
         self._th = None
 
@@ -235,56 +251,43 @@ class PriceFeed:
             try: self._th.join(timeout=2)
             except: pass
 
-    def last(self):
-        return self._last
+    def raw(self):
+        return self._raw
 
-    def _set_price(self, quote_ui, tok_ui):
-        if quote_ui and tok_ui and tok_ui > 0:
-            self._last = (quote_ui / tok_ui, time.monotonic())
+    def _set_raw(self, raw, src):
+        if raw != self._raw:
+            self._raw = raw
+            jlog("position_update", mint=self.mint, raw=raw, src=src)
 
     async def _loop(self):
-        amt_quote = None
-        amt_tok   = None
+        if self.ata is None:
+            balances.decimales(self.mint)
+            self.ata = balances.ata(self.mint)
         async with websockets.connect(WS_URL, ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT) as ws:
             await ws.send(json.dumps({
-                "jsonrpc": "2.0", "id": 101, "method": "accountSubscribe",
-                "params": [self.vq, {"encoding": "jsonParsed", "commitment": "processed"}]
-            }))
-            await ws.send(json.dumps({
-                "jsonrpc": "2.0", "id": 102, "method": "accountSubscribe",
-                "params": [self.vt, {"encoding": "jsonParsed", "commitment": "processed"}]
+                "jsonrpc": "2.0", "id": 201, "method": "accountSubscribe",
+                "params": [self.ata, {"encoding": "base64", "commitment": "processed"}]
             }))
-
-            ack_q = json.loads(await ws.recv()); sub_q = ack_q.get("result")
-            ack_t = json.loads(await ws.recv()); sub_t = ack_t.get("result")
+            json.loads(await ws.recv())
+            # saldo previo (la ATA puede existir ya con restos); solo si el WS aún no trajo nada
+            if self._raw is None:
+                try:
+                    raw, _ = balances.balances_raw([self.mint])[self.mint]
+                    if self._raw is None:
+                        self._set_raw(raw, "rpc")
+                except Exception:
+                    pass
 
             while not self._stop.is_set():
                 try:
                     msg = await asyncio.wait_for(ws.recv(), timeout=5.0)
                 except asyncio.TimeoutError:
                     continue
-                data = json.loads(msg)
-                params = data.get("params") or {}
-                sub_id = params.get("subscription")
-                val = params.get("result", {}).get("value", {}) if params else {}
-                parsed = (val.get("data") or {}).get("parsed", {})
-                info = parsed.get("info", {})
-                token_amount = info.get("tokenAmount", {}) or {}
-                uiAmt = token_amount.get("uiAmount")
-                if uiAmt is None:
+                params = json.loads(msg).get("params") or {}
+                val = (params.get("result") or {}).get("value")
+                if val is None:
                     continue
-                try:
-                    ui = float(uiAmt)
-                except:
-                    continue
-
-                if sub_id == sub_q:
-                    amt_quote = ui
-                elif sub_id == sub_t:
-                    amt_tok = ui
-
-                if amt_quote is not None and amt_tok is not None:
-                    self._set_price(amt_quote, amt_tok)
+                self._set_raw(balances.monto_raw(val), "ws")
 
     def _run(self):
         while not self._stop.is_set():
@@ -293,6 +296,13 @@ class PriceFeed:
             except Exception:
                 time.sleep(2)
 
+def _args_posicion(pos, dec):
+    """Args '--raw-amount/--decimals' para los scripts de venta si la posición en memoria es válida."""
+    raw = pos.raw() if pos else None
+    if not raw or raw <= 0:
+        return []
+    return ["--raw-amount", str(int(raw)), "--decimals", str(int(dec))]
+
 # ===== Compra / Venta =====
 def _run_script(cmd, label, timeout_sec=60):
     try:
@@ -342,26 +352,151 @@ def _run_script(cmd, label, timeout_sec=60):
         except: pass
         return False
 
-def comprar_usdc(address, monto_usdc_ui):
-    with Timer("buy_usdc", mint=address, amt=monto_usdc_ui):
-        ok = _run_script([sys.executable, "compra_swap_usdc.py", address, str(monto_usdc_ui)], "compra_swap_usdc.py")
-    jlog("buy_result", base="USDC", mint=address, ok=bool(ok))
-    return ok
+def _confirmar_compra(address, base, sig):
+    """Espera la confirmación de la compra (None si vence BUY_CONFIRM_SECS)."""
+    with Timer("buy_confirm", mint=address, base=base):
+        conf = confirmaciones.esperar(sig, timeout=BUY_CONFIRM_SECS)
+    if conf and conf["ok"]:
+        priority_fees.registrar_landing(sig, conf.get("slot"))
+    jlog("buy_confirm", mint=address, sig=str(sig), ok=(conf or {}).get("ok"), via=(conf or {}).get("via"),
+         dt_ms=(conf or {}).get("dt_ms"))
+    return conf
+
+def comprar_directo(address, monto_usdc_ui, route_base, pool_id, feed=None):
+    """Compra contra el pool VIP sin Jupiter (reservas del feed). Firma (str) confirmada/pendiente o None."""
+    base_mint = USDC_MINT if route_base == "USDC" else SOL_MINT
+    if route_base == "USDC":
+        amount_in = int(round(monto_usdc_ui * 1_000_000))
+    else:
+        px = precio_sol_usd(ttl=2.0)
+        if not px:
+            return None
+        amount_in = int(monto_usdc_ui / px * 1_000_000_000)
+    with Timer("buy_direct", mint=address, base=route_base):
+        res = raydium_directo.swap(pool_id, base_mint, amount_in, SLIPPAGE_BPS_DIRECTO,
+                                   priority_fees.cu_price("entry", priority_fees.cuentas_pool(address, base_mint)),
+                                   vaults=feed.vaults() if feed else None, lado="buy")
+    if not res:
+        return None
+    priority_fees.registrar_envio(res["sig"], "entry", res["cu_price"])
+    print(f"[{ts()}] ⚡ compra directa {res['tipo']} → {res['sig']}", flush=True)
+    conf = _confirmar_compra(address, "DIRECT", res["sig"])
+    if conf is not None and not conf["ok"]:
+        print(f"[{ts()}] ⚠️ compra directa falló on-chain ({conf['err']}); se sigue con Jupiter", flush=True)
+        return None
+    if conf is None:
+        print(f"[{ts()}] ⚠️ compra sin confirmar en {BUY_CONFIRM_SECS:.0f}s; se sigue con la posición", flush=True)
+    return res["sig"]
+
+def _carrera_preparar(address, monto_usdc_ui, route_base, preps):
+    """Prepara USDC y SOL en paralelo y deja en 'preps' las válidas (ventana BUY_GRACE_SECS tras la 1ª)."""
+    with Timer("buy_race", mint=address, amt=monto_usdc_ui, prefer=route_base):
+        ex = ThreadPoolExecutor(max_workers=2)
+        futs = {
+            ex.submit(compra_swap_usdc.preparar_compra_usdc, address, int(round(monto_usdc_ui * 1_000_000))): "USDC",
+            ex.submit(compra_swap_sol.preparar_compra_sol, address, monto_usdc_ui, precio_sol_usd(ttl=2.0)): "SOL",
+        }
+        pending = set(futs)
+        deadline = None
+        while pending:
+            tmo = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=tmo, return_when=FIRST_COMPLETED)
+            if not done:
+                break  # venció la ventana de gracia
+            for f in done:
+                base = futs[f]
+                try:
+                    prep = f.result()
+                except Exception as e:
+                    print(f"[{ts()}] ⚠️ preparar {base} error: {e}", flush=True)
+                    prep = None
+                if prep and prep.get("out_raw", 0) > 0 and prep.get("in_usd", 0) > 0:
+                    preps[base] = prep
+                    if deadline is None:
+                        deadline = time.monotonic() + BUY_GRACE_SECS
+        # la preparación perdedora no envía nada; no se espera a que termine
+        ex.shutdown(wait=False, cancel_futures=True)
+
+def comprar_carrera(address, monto_usdc_ui, route_base, pool_id=None, feed=None, previas=None):
+    """
+    Con pool VIP conocido intenta primero el swap directo (sin Jupiter). Si no, usa las preparaciones
+    del orquestador (compra_previa) o prepara USDC y SOL en paralelo (quote + /swap, sin enviar),
+    elige la de mayor salida por USD (o la primera válida si la otra no llega en BUY_GRACE_SECS)
+    y envía SOLO una.
+    """
+    if pool_id:
+        sig = comprar_directo(address, monto_usdc_ui, route_base, pool_id, feed)
+        if sig:
+            return sig
+        jlog("buy_direct_fallback", mint=address, pool=pool_id)
+
+    preps = dict(previas or {})
+    t0 = time.monotonic()
+    if preps:
+        print(f"[{ts()}] ⚡ compra preparada en la pre-señal ({','.join(preps)})", flush=True)
+    else:
+        _carrera_preparar(address, monto_usdc_ui, route_base, preps)
+
+    if not preps:
+        jlog("buy_race_result", mint=address, ok=False, dt_ms=int((time.monotonic()-t0)*1000))
+        return False
 
-def comprar_sol(address, monto_usdc_ui):
-    with Timer("buy_sol", mint=address, amt=monto_usdc_ui):
-        ok = _run_script([sys.executable, "compra_swap_sol.py", address, str(monto_usdc_ui)], "compra_swap_sol.py")
-    jlog("buy_result", base="SOL", mint=address, ok=bool(ok))
+    def _out_per_usd(base):
+        p = preps[base]
+        return p["out_raw"] / p["in_usd"]
+
+    # empate → preferida por route_base
+    orden = sorted(preps, key=lambda b: (_out_per_usd(b), b == route_base), reverse=True)
+    win = orden[0]
+    margin_bps = None
+    if len(orden) > 1:
+        margin_bps = int(round((_out_per_usd(win) / _out_per_usd(orden[1]) - 1) * 10_000))
+    print(f"[{ts()}] 🏁 carrera compra → {win} (candidatas={','.join(orden)} margen={margin_bps}bps)", flush=True)
+
+    # Si el envío falla sin difundir nada (simulación / firma), se prueba la otra preparación válida
+    ok = False
+    for base in orden:
+        win = base
+        with Timer("buy_send", mint=address, base=win):
+            try:
+                if win == "USDC":
+                    ok = compra_swap_usdc.enviar_compra_usdc(preps[win])
+                else:
+                    ok = compra_swap_sol.enviar_compra_sol(preps[win], address)
+            except Exception as e:
+                print(f"[{ts()}] ⚠️ envío {win} error: {e}", flush=True)
+                ok = False
+        if ok or "difusion" in preps[win]:
+            break
+        jlog("buy_send_next", mint=address, failed=win)
+    jlog("buy_race_result", mint=address, base=win, ok=bool(ok), margin_bps=margin_bps,
+         n_routes=len(preps), dt_ms=int((time.monotonic()-t0)*1000), previa=bool(previas))
+    if not ok and previas and not any("difusion" in p for p in preps.values()):
+        # ninguna preparación previa pasó la simulación (nada difundido): carrera normal con quotes frescas
+        jlog("buy_prep_fallback", mint=address, base=win)
+        return comprar_carrera(address, monto_usdc_ui, route_base, None, feed)
+    if not ok:
+        return ok
+
+    # Compra aterrizada antes de empezar el trailing (error on-chain → abortar; timeout → seguir)
+    conf = _confirmar_compra(address, win, ok)
+    if conf is not None and preps[win].get("forma"):
+        rutas_stats.registrar(address, win, preps[win]["forma"], "aterrizadas" if conf["ok"] else "fallidas")
+    if conf is not None and not conf["ok"]:
+        print(f"[{ts()}] ❌ compra falló on-chain: {conf['err']}", flush=True)
+        return False
+    if conf is None:
+        print(f"[{ts()}] ⚠️ compra sin confirmar en {BUY_CONFIRM_SECS:.0f}s; se sigue con la posición", flush=True)
     return ok
 
-def vender_a_usdc(address, motivo=""):
+def vender_a_usdc(address, motivo="", extra=None):
     with Timer("sell", mint=address, cause=motivo):
-        ok = _run_script([sys.executable, "swap_real.py", address, "sell", "--motivo", motivo], "swap_real.py")
+        ok = _run_script([sys.executable, "swap_real.py", address, "sell", "--motivo", motivo] + list(extra or []), "swap_real.py")
     jlog("sell_result", mint=address, cause=motivo, ok=bool(ok))
     return ok
 
-def vender_seguro(address: str, motivo: str):
-    ok = vender_a_usdc(address, motivo)
+def vender_seguro(address: str, motivo: str, extra=None):
+    ok = vender_a_usdc(address, motivo, extra)
     return ok
 
 # ===== MAIN =====
@@ -372,7 +507,7 @@ def main():
     address = sys.argv[1].strip()
 
     vip = db_row("""
-        SELECT address, name, decimals, vault_usdc, vault_token, route_base
+        SELECT address, name, decimals, vault_usdc, vault_token, route_base, pool_id
         FROM vip_tokens WHERE address=?
     """, (address,))
     if not vip:
@@ -394,8 +529,14 @@ def main():
         print(f"⏳ HOLD armado: {HOLD_SECS}s tras compra antes de evaluar SL/TS", flush=True)
     jlog("trade_start", mint=address, name=name, base=route_base, amt=MONTO_USDC, hold=HOLD_SECS)
 
-    # Lanzar WS y obtener primer precio
+    # Lanzar WS y obtener primer precio (con feed previo del orquestador el precio ya está vivo)
     feed = PriceFeed(v_quote, v_token)
+    warm = vault_feed.heredado(v_quote, v_token)
+    if warm and feed.sembrar(warm):
+        if warm.get("sol_usd") and not _SOL_CACHE["px"]:
+            _SOL_CACHE["px"] = float(warm["sol_usd"])
+            _SOL_CACHE["ts"] = time.monotonic() - max(0.0, time.time() - float(warm["ts"]))
+        jlog("warm_feed_inherited", mint=address, age_ms=int((time.time() - float(warm["ts"])) * 1000))
     feed.start()
     price_in = None
 
@@ -436,16 +577,19 @@ def main():
     except Exception:
         pass
 
-    # COMPRA
-    if route_base == "USDC":
-        buy_ok = comprar_usdc(address, MONTO_USDC) or comprar_sol(address, MONTO_USDC)
-    else:
-        buy_ok = comprar_sol(address, MONTO_USDC) or comprar_usdc(address, MONTO_USDC)
+    # Posición propia en memoria desde antes del envío (la suscripción ve el fill de la compra)
+    pos = PosicionFeed(address)
+    pos.start()
+
+    # COMPRA (carrera USDC/SOL concurrente, se envía una sola)
+    previas = compra_previa.tomar(address, price_in, MONTO_USDC)
+    buy_ok = comprar_carrera(address, MONTO_USDC, route_base, vip["pool_id"], feed, previas)
 
     if not buy_ok:
         print(f"[{ts()}] ❌ Error de compra.", flush=True)
         jlog("trade_abort_buy_fail", mint=address)
         feed.stop()
+        pos.stop()
         return
 
     # Marca inicio de HOLD tras compra
@@ -463,6 +607,10 @@ def main():
         op_id = cur.lastrowid
     jlog("op_open", mint=address, op_id=op_id, entry=price_entrada)
 
+    # Fill real de la compra (getTransaction) fuera del camino crítico
+    threading.Thread(target=reconciliar.reconciliar_entrada,
+                     args=(op_id, str(buy_ok), address, precio_sol_usd(ttl=60.0)), daemon=True).start()
+
     # Trailing
     trailing_activo = False
     precio_max = price_in
@@ -586,11 +734,11 @@ def main():
                 if not trailing_activo and gan <= -STOP_LOSS_FIJO:
                     print(f"[{ts()}] 🔻 STOP LOSS | {name} | {gan*100:.2f}%", flush=True)
                     jlog("exit_signal", mint=address, cause="stop_loss_fijo", pnl_bp=int(gan*1e4))
-                    ok = vender_seguro(address, "stop_loss_fijo")
+                    ok = vender_seguro(address, "stop_loss_fijo", _args_posicion(pos, dec))
                     if not ok:
                         subprocess.run([sys.executable, "salida_forzada.py", address,
-                                        "--max-intentos","6","--delay","3",
-                                        "--op-id", str(op_id)], check=False)
+                                        "--max-intentos","6","--delay","3","--local-ix",
+                                        "--op-id", str(op_id)] + _args_posicion(pos, dec), check=False)
                     break
 
                 # 2) Activación de trailing
@@ -604,22 +752,22 @@ def main():
                 if trailing_activo and precio <= stop_dinamico:
                     print(f"[{ts()}] 🔴 TRAILING HIT | {name} | px={precio:.8f} stop={stop_dinamico:.8f}", flush=True)
                     jlog("exit_signal", mint=address, cause="trailing_hit")
-                    ok = vender_seguro(address, "trailing_hit")
+                    ok = vender_seguro(address, "trailing_hit", _args_posicion(pos, dec))
                     if not ok:
                         subprocess.run([sys.executable, "salida_forzada.py", address,
-                                        "--max-intentos","6","--delay","3",
-                                        "--op-id", str(op_id)], check=False)
+                                        "--max-intentos","6","--delay","3","--local-ix",
+                                        "--op-id", str(op_id)] + _args_posicion(pos, dec), check=False)
                     break
 
                 # 4) Token dormido
                 if (time.monotonic() - dormido_start_mono) >= DORMIDO_WINDOW:
                     print(f"[{ts()}] 😴 TOKEN DORMIDO | {name} | {DORMIDO_WINDOW}s", flush=True)
                     jlog("exit_signal", mint=address, cause="token_dormido")
-                    ok = vender_seguro(address, "token_dormido")
+                    ok = vender_seguro(address, "token_dormido", _args_posicion(pos, dec))
                     if not ok:
                         subprocess.run([sys.executable, "salida_forzada.py", address,
-                                        "--max-intentos","6","--delay","3",
-                                        "--op-id", str(op_id)], check=False)
+                                        "--max-intentos","6","--delay","3","--local-ix",
+                                        "--op-id", str(op_id)] + _args_posicion(pos, dec), check=False)
                     break
 
                 time.sleep(POLL_SECONDS if (src == "ws") else (POLL_SECONDS_HTTP + random.uniform(0, JITTER_MAX)))
@@ -627,6 +775,7 @@ def main():
     finally:
         try:
             feed.stop()
+            pos.stop()
         except Exception:
             pass
         jlog("trade_end", mint=address)
@@ -0,0 +1,163 @@
+# tx_codec.py — Códec de transacciones sobre los bytes crudos (firma con solders, sin objetos intermedios)
+# - decodificar(): base64 → bytes una sola vez; tamaño, versión y firmantes se leen del buffer
+# - firmar(): firma los bytes del mensaje (mismo procedimiento en legacy y v0) y escribe la firma en su hueco
+# - es_versionada() / primera_firma(): lectura directa del buffer (sin TxCruda) para swap_exec
+# - Keypair de solders cacheado (la conversión desde solana-py se hace una vez por proceso)
+# - python tx_codec.py --bench: compara con el camino anterior (solana-py legacy / VersionedTransaction)
+# Usado por swap_exec.sign_tx y los scripts de compra/venta (chequeo de tamaño sin segundo decode).
+
+import time, argparse
+from base64 import b64decode, b64encode
+
+from solders.keypair import Keypair as SoldersKeypair
+
+PACKET_DATA_SIZE = 1232   # límite real de TX serializada en la red
+
+_kps = {}   # id(kp) -> (kp, SoldersKeypair, bytes(pubkey))
+
+def _compact_u16(buf, off: int):
+    val = shift = 0
+    while True:
+        b = buf[off]; off += 1
+        val |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return val, off
+        shift += 7
+
+def es_versionada(raw) -> bool:
+    """True si el mensaje es v0 (primer byte tras las firmas con el bit alto activo)."""
+    n_firmas, off = _compact_u16(raw, 0)
+    return bool(raw[off + 64 * n_firmas] & 0x80)
+
+def primera_firma(raw) -> bytes:
+    """Primera firma (64 bytes) de la TX serializada: la que identifica la transacción."""
+    _, off = _compact_u16(raw, 0)
+    return bytes(raw[off:off + 64])
+
+def keypair_solders(kp):
+    """(SoldersKeypair, pubkey bytes) para un keypair de solders o solana-py (cacheado)."""
+    e = _kps.get(id(kp))
+    if e is None or e[0] is not kp:
+        if isinstance(kp, SoldersKeypair):
+            sk = kp
+        elif callable(getattr(kp, "to_solders", None)):
+            sk = kp.to_solders()
+        else:
+            sk = SoldersKeypair.from_bytes(bytes(kp.secret_key))
+        e = _kps[id(kp)] = (kp, sk, bytes(sk.pubkey()))
+    return e[1], e[2]
+
+class TxCruda:
+    """TX serializada en un bytearray mutable con los offsets de firmas y mensaje ya resueltos."""
+    __slots__ = ("buf", "n_firmas", "off_firmas", "off_msg", "version", "n_req", "off_claves")
+
+    def __init__(self, raw):
+        self.buf = bytearray(raw)
+        self.n_firmas, self.off_firmas = _compact_u16(self.buf, 0)
+        self.off_msg = self.off_firmas + 64 * self.n_firmas
+        self.version = 0 if self.buf[self.off_msg] & 0x80 else None   # None = legacy
+        h = self.off_msg + (1 if self.version is not None else 0)
+        self.n_req = self.buf[h]                                       # num_required_signatures
+        _, self.off_claves = _compact_u16(self.buf, h + 3)
+
+    def __len__(self):
+        return len(self.buf)
+
+    @property
+    def versionada(self) -> bool:
+        return self.version is not None
+
+    def cabe(self, limite: int = PACKET_DATA_SIZE) -> bool:
+        return len(self.buf) <= limite
+
+    def firmante(self, i: int) -> bytes:
+        off = self.off_claves + 32 * i
+        return bytes(self.buf[off:off + 32])
+
+    def mensaje(self) -> memoryview:
+        return memoryview(self.buf)[self.off_msg:]
+
+    def bytes(self) -> bytes:
+        return bytes(self.buf)
+
+def decodificar(tx_b64_or_bytes) -> TxCruda:
+    raw = b64decode(tx_b64_or_bytes) if isinstance(tx_b64_or_bytes, str) else tx_b64_or_bytes
+    return TxCruda(raw)
+
+def firmar(tx, kp) -> bytes:
+    """
+    Firma en el hueco del firmante y devuelve los bytes listos para enviar.
+    Acepta TxCruda, bytes o base64. ValueError si la clave no es firmante requerido del mensaje.
+    """
+    if not isinstance(tx, TxCruda):
+        tx = decodificar(tx)
+    sk, pub = keypair_solders(kp)
+    for i in range(min(tx.n_req, tx.n_firmas)):
+        if tx.firmante(i) == pub:
+            off = tx.off_firmas + 64 * i
+            tx.buf[off:off + 64] = bytes(sk.sign_message(bytes(tx.mensaje())))
+            return bytes(tx.buf)
+    raise ValueError("la clave no es firmante requerido de la transacción")
+
+# ===== Benchmark =====
+def _tx_prueba(sk, versionada: bool) -> str:
+    from solders.hash import Hash
+    from solders.message import Message, MessageV0
+    from solders.signature import Signature
+    from solders.system_program import transfer, TransferParams
+    from solders.transaction import Transaction as SoldersTx, VersionedTransaction
+
+    ixs = [transfer(TransferParams(from_pubkey=sk.pubkey(), to_pubkey=SoldersKeypair().pubkey(), lamports=1))
+           for _ in range(4)]
+    bh = Hash.new_unique()
+    if versionada:
+        vt = VersionedTransaction.populate(MessageV0.try_compile(sk.pubkey(), ixs, [], bh), [Signature.default()])
+        return b64encode(bytes(vt)).decode()
+    return b64encode(bytes(SoldersTx.new_unsigned(Message.new_with_blockhash(ixs, sk.pubkey(), bh)))).decode()
+
+def _medir(fn, n):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+def bench(n: int = 2000):
+    from solana.keypair import Keypair as PyKeypair
+    from solana.transaction import Transaction
+    from solders.transaction import VersionedTransaction
+
+    sk = SoldersKeypair()
+    pk = PyKeypair.from_secret_key(bytes(sk))
+    casos = {}
+    leg = _tx_prueba(sk, False)
+    v0 = _tx_prueba(sk, True)
+
+    def anterior_legacy():
+        tx = Transaction.deserialize(b64decode(leg))
+        tx.sign(pk)
+        return tx.serialize()
+
+    def anterior_v0():
+        vt = VersionedTransaction.from_bytes(b64decode(v0))
+        return bytes(VersionedTransaction(vt.message, [sk]))
+
+    casos["legacy  solana-py"] = _medir(anterior_legacy, max(1, n // 10))
+    casos["legacy  codec    "] = _medir(lambda: firmar(leg, pk), n)
+    casos["v0      solders  "] = _medir(anterior_v0, n)
+    casos["v0      codec    "] = _medir(lambda: firmar(v0, pk), n)
+    assert firmar(leg, pk) == anterior_legacy(), "legacy: firmas distintas"
+    assert firmar(v0, pk) == anterior_v0(), "v0: firmas distintas"
+    for k, us in casos.items():
+        print(f"{k}  {us:9.1f} µs/tx")
+    return casos
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Códec de transacciones (solders)")
+    ap.add_argument("--bench", action="store_true", help="Benchmark contra el camino anterior")
+    ap.add_argument("-n", type=int, default=2000)
+    args = ap.parse_args()
+    if args.bench:
+        bench(args.n)
+    else:
+        ap.print_help()
@@ -0,0 +1,154 @@
+# vault_feed.py — Feed de precio por WS sobre los vaults del pool VIP (accountSubscribe, processed)
+# - PriceFeed: precio QUOTE/TOKEN y reservas raw en memoria (las usa el swap directo)
+# - Foto inicial opcional (getMultipleAccounts) al suscribir: precio sin esperar a que el pool se mueva
+# - Feed previo: main_master abre la suscripción cuando el score se acerca al umbral y al lanzar el
+#   trader le pasa el estado por entorno (APOLLO_WARM_FEED); el trader arranca con precio ya vivo
+# Usado por el trader y main_master.
+
+import os, json, time, asyncio, threading
+import websockets
+
+from config import WS_URL, WS_PING_INTERVAL, WS_PING_TIMEOUT
+
+ENV_WARM      = "APOLLO_WARM_FEED"
+WARM_MAX_AGE  = 5.0      # s entre el traspaso (lanzamiento del trader) y su lectura
+
+# ===== WS feed de precio (Raydium CPMM via vaults) =====
+class PriceFeed:
+    def __init__(self, vault_quote: str, vault_token: str, foto_inicial: bool = False):
+        self.vq = vault_quote
+        self.vt = vault_token
+        self.foto_inicial = foto_inicial
+        self._last = None   # (price_raw_quote_per_token, ts_monotonic)
+        self._raw = {}      # vault -> amount raw (reservas para el swap directo)
+        self._ui = {}       # vault -> uiAmount (estado a traspasar)
+        self._vivo = False  # suscripciones confirmadas en la conexión actual
+        self._stop = threading.Event()
+        self._th = None
+
+    def start(self):
+        self._th = threading.Thread(target=self._run, daemon=True)
+        self._th.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._th:
+            try: self._th.join(timeout=2)
+            except: pass
+
+    def last(self):
+        return self._last
+
+    def vaults(self):
+        """{vault: raw} con ambos vaults, o None si aún no llegaron."""
+        return dict(self._raw) if len(self._raw) == 2 else None
+
+    def estado(self):
+        """Estado traspasable (dict JSON) si la suscripción está viva y hay precio; None si no."""
+        if not self._vivo or not self._last or len(self._ui) < 2:
+            return None
+        return {"vq": self.vq, "vt": self.vt, "ui": dict(self._ui), "raw": dict(self._raw)}
+
+    def sembrar(self, estado: dict):
+        """Carga el estado de otro feed (mismo pool) antes de start(); las notificaciones lo reemplazan."""
+        if not estado or estado.get("vq") != self.vq or estado.get("vt") != self.vt:
+            return False
+        self._ui = {k: float(v) for k, v in (estado.get("ui") or {}).items()}
+        self._raw = {k: int(v) for k, v in (estado.get("raw") or {}).items()}
+        self._set_price(self._ui.get(self.vq), self._ui.get(self.vt))
+        return self._last is not None
+
+    def _set_price(self, quote_ui, tok_ui):
+        if quote_ui and tok_ui and tok_ui > 0:
+            self._last = (quote_ui / tok_ui, time.monotonic())
+
+    def _set_cuenta(self, vault, token_amount):
+        try:
+            self._raw[vault] = int(token_amount["amount"])
+        except Exception:
+            pass
+        try:
+            self._ui[vault] = float(token_amount.get("uiAmount"))
+        except Exception:
+            return False
+        return True
+
+    def _foto(self):
+        import swap_exec
+        res = swap_exec.rpc("getMultipleAccounts", [[self.vq, self.vt], {"encoding": "jsonParsed", "commitment": "processed"}],
+                            timeout=2.0)
+        for vault, acc in zip((self.vq, self.vt), (res or {}).get("value") or []):
+            info = (((acc or {}).get("data") or {}).get("parsed") or {}).get("info") or {}
+            self._set_cuenta(vault, info.get("tokenAmount") or {})
+
+    async def _loop(self):
+        async with websockets.connect(WS_URL, ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT) as ws:
+            await ws.send(json.dumps({
+                "jsonrpc": "2.0", "id": 101, "method": "accountSubscribe",
+                "params": [self.vq, {"encoding": "jsonParsed", "commitment": "processed"}]
+            }))
+            await ws.send(json.dumps({
+                "jsonrpc": "2.0", "id": 102, "method": "accountSubscribe",
+                "params": [self.vt, {"encoding": "jsonParsed", "commitment": "processed"}]
+            }))
+
+            ack_q = json.loads(await ws.recv()); sub_q = ack_q.get("result")
+            ack_t = json.loads(await ws.recv()); sub_t = ack_t.get("result")
+
+            # suscrito: lo que llegue después de la foto es más nuevo que ella
+            if self.foto_inicial:
+                try:
+                    self._foto()
+                    self._set_price(self._ui.get(self.vq), self._ui.get(self.vt))
+                except Exception:
+                    pass
+            self._vivo = True
+            try:
+                while not self._stop.is_set():
+                    try:
+                        msg = await asyncio.wait_for(ws.recv(), timeout=5.0)
+                    except asyncio.TimeoutError:
+                        continue
+                    data = json.loads(msg)
+                    params = data.get("params") or {}
+                    sub_id = params.get("subscription")
+                    if sub_id not in (sub_q, sub_t):
+                        continue
+                    val = params.get("result", {}).get("value", {}) if params else {}
+                    parsed = (val.get("data") or {}).get("parsed", {})
+                    info = parsed.get("info", {})
+                    vault = self.vq if sub_id == sub_q else self.vt
+                    if self._set_cuenta(vault, info.get("tokenAmount", {}) or {}):
+                        self._set_price(self._ui.get(self.vq), self._ui.get(self.vt))
+            finally:
+                self._vivo = False
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                asyncio.run(self._loop())
+            except Exception:
+                time.sleep(2)
+
+# ===== Traspaso orquestador → trader =====
+def a_entorno(feed: PriceFeed, sol_usd: float | None = None) -> dict:
+    """Variables de entorno para el trader ({} si el feed no tiene estado vivo)."""
+    est = feed.estado() if feed else None
+    if not est:
+        return {}
+    est["ts"] = time.time()
+    if sol_usd:
+        est["sol_usd"] = float(sol_usd)
+    return {ENV_WARM: json.dumps(est)}
+
+def heredado(vault_quote: str, vault_token: str):
+    """Estado traspasado por main_master para este pool, o None (ausente, otro pool o viejo)."""
+    try:
+        est = json.loads(os.environ.get(ENV_WARM) or "null")
+    except Exception:
+        return None
+    if not est or est.get("vq") != vault_quote or est.get("vt") != vault_token:
+        return None
+    if time.time() - float(est.get("ts") or 0) > WARM_MAX_AGE:
+        return None
+    return est
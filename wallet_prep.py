@@ -0,0 +1,221 @@
+# wallet_prep.py — Preparación de la wallet fuera del camino crítico (TX de trade = solo el swap)
+# - wSOL persistente (ATA de wSOL) con saldo objetivo: las rutas vía SOL no llevan create/sync/close
+# - Recarga si baja de WSOL_MIN; si sobra (ventas a SOL) o el SOL nativo baja de la reserva, se
+#   desenvuelve y se deja en el objetivo: la TX de cierre va con el lock de trade tomado por
+#   wallet_prep (main_master no arranca un trade hasta que confirma)
+# - ATAs de los VIP activos creadas por lotes (CreateIdempotent) la primera vez que se ve cada VIP
+# - Consultas para los traders con cache corto: wsol_cubre(lamports), wsol_lista(), ata_lista(mint)
+# Lanzado por main_master al ver VIPs nuevos, tras cada trade y periódicamente (python wallet_prep.py MINT1,MINT2 …).
+# Usado por compra_swap_sol, swap_real, salida_forzada y raydium_directo.
+
+import os, sys, time, threading, argparse
+
+from solders.pubkey import Pubkey
+from solders.instruction import Instruction, AccountMeta
+from solders.message import MessageV0
+from solders.transaction import VersionedTransaction
+from solders.compute_budget import set_compute_unit_limit, set_compute_unit_price
+from solders.system_program import transfer, TransferParams
+
+import swap_exec
+import balances
+import confirmaciones
+from config import keypair, wallet_pubkey
+
+# === Telemetry (no-op fallback) ===
+try:
+    from telemetry import emit  # type: ignore
+except Exception:
+    def emit(event, **kw):  # no-op
+        pass
+
+SOL_MINT       = swap_exec.SOL_MINT
+SYSTEM_PROGRAM = "11111111111111111111111111111111"
+
+WSOL_OBJETIVO  = int(float(os.getenv("APOLLO_WSOL_SOL", "0.10")) * 1e9)   # lamports en wSOL tras recargar
+WSOL_MIN       = WSOL_OBJETIVO * 4 // 10                                  # por debajo → recarga
+WSOL_MAX       = WSOL_OBJETIVO * 3                                        # por encima → desenvolver el exceso
+SOL_RESERVA    = 50_000_000       # SOL nativo que nunca se envuelve (fees y rent)
+ATAS_POR_TX    = 8
+CU_PRICE_PREP  = 5_000            # µlamports: sin urgencia
+CONFIRM_SECS   = 60.0
+CACHE_TTL      = 3.0
+LOCK_FILE      = "trading.lock"   # lock 1×1 de main_master: trade en curso (o rebalanceo de wSOL)
+
+_wsol = {"ts": 0.0, "raw": None}  # raw None = la ATA de wSOL no existe
+_atas = set()                     # mints con ATA propia confirmada
+_lock = threading.Lock()
+
+# ===== Instrucciones =====
+def _meta(addr, signer=False, writable=False):
+    return AccountMeta(Pubkey.from_string(str(addr)), signer, writable)
+
+def ix_crear_ata(mint: str, programa: str = balances.TOKEN_PROGRAM):
+    """CreateIdempotent de la ATA propia (no falla si ya existe)."""
+    owner = str(wallet_pubkey)
+    return Instruction(Pubkey.from_string(balances.ATA_PROGRAM), bytes([1]), [
+        _meta(owner, True, True), _meta(balances.ata(mint, owner, programa), writable=True), _meta(owner),
+        _meta(mint), _meta(SYSTEM_PROGRAM), _meta(programa),
+    ])
+
+def ix_sync_native(cuenta: str):
+    return Instruction(Pubkey.from_string(balances.TOKEN_PROGRAM), bytes([17]), [_meta(cuenta, writable=True)])
+
+def ix_cerrar(cuenta: str):
+    owner = str(wallet_pubkey)
+    return Instruction(Pubkey.from_string(balances.TOKEN_PROGRAM), bytes([9]),
+                       [_meta(cuenta, writable=True), _meta(owner, writable=True), _meta(owner, True)])
+
+def ix_envolver(lamports: int):
+    """Transfer + SyncNative a la ATA de wSOL (que debe existir o crearse antes en la misma TX)."""
+    wsol = wsol_ata()
+    return [transfer(TransferParams(from_pubkey=Pubkey.from_string(str(wallet_pubkey)),
+                                    to_pubkey=Pubkey.from_string(wsol), lamports=int(lamports))),
+            ix_sync_native(wsol)]
+
+def wsol_ata() -> str:
+    return balances.ata(SOL_MINT, program=balances.TOKEN_PROGRAM)
+
+# ===== Consultas (traders) =====
+def _cuenta(addr, commitment="processed"):
+    res = swap_exec.rpc("getMultipleAccounts", [[addr], {"encoding": "base64", "commitment": commitment}], timeout=2.0)
+    return ((res or {}).get("value") or [None])[0]
+
+def _leer_wsol():
+    acc = _cuenta(wsol_ata())
+    raw = balances.monto_raw(acc) if acc else None
+    with _lock:
+        _wsol.update(ts=time.monotonic(), raw=raw)
+    return raw
+
+def saldo_wsol(ttl: float = CACHE_TTL):
+    """Lamports en la ATA de wSOL (None si no existe). Cache corto."""
+    if time.monotonic() - _wsol["ts"] <= ttl:
+        return _wsol["raw"]
+    try:
+        return _leer_wsol()
+    except Exception as e:
+        emit("wsol_read_error", err=str(e))
+        return _wsol["raw"]
+
+def precalentar():
+    """Refresca el saldo de wSOL en segundo plano (en paralelo con precio/quotes)."""
+    if time.monotonic() - _wsol["ts"] > CACHE_TTL:
+        threading.Thread(target=saldo_wsol, daemon=True).start()
+
+def wsol_lista() -> bool:
+    """La ATA de wSOL existe: las ventas a SOL pueden dejar el producto envuelto."""
+    return saldo_wsol(ttl=60.0 if _wsol["raw"] is not None else CACHE_TTL) is not None
+
+def wsol_cubre(lamports: int) -> bool:
+    """Hay wSOL suficiente para pagar 'lamports' sin envolver dentro del swap."""
+    raw = saldo_wsol()
+    return raw is not None and raw >= int(lamports)
+
+def ata_lista(mint: str) -> bool:
+    """ATA propia del mint ya creada (cache positivo; la consulta solo se repite mientras no exista)."""
+    if mint in _atas:
+        return True
+    try:
+        balances.decimales(mint)
+        acc = _cuenta(balances.ata(mint))
+    except Exception:
+        return False
+    if acc:
+        with _lock:
+            _atas.add(mint)
+    return bool(acc)
+
+# ===== Preparación =====
+def _enviar(ixs, label):
+    ixs = [set_compute_unit_limit(200_000), set_compute_unit_price(CU_PRICE_PREP)] + ixs
+    bh, last_valid = swap_exec.blockhash_cache.get()
+    msg = MessageV0.try_compile(Pubkey.from_string(str(wallet_pubkey)), ixs, [], bh)
+    raw = bytes(VersionedTransaction(msg, [swap_exec._solders_kp(keypair)]))
+    d = swap_exec.broadcast(raw, label=label, last_valid_block_height=last_valid)
+    conf = confirmaciones.esperar(d.sig, timeout=CONFIRM_SECS)
+    ok = bool(conf and conf["ok"])
+    emit("wallet_prep_tx", label=label, sig=d.sig, ok=ok, n_ix=len(ixs) - 2, err=str((conf or {}).get("err")))
+    return ok
+
+def _tomar_lock_trade() -> bool:
+    """Mismo lock atómico que main_master.acquire_lock: False si hay un trade en curso."""
+    try:
+        fd = os.open(LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
+    except OSError:
+        return False
+
+def _soltar_lock_trade():
+    try: os.remove(LOCK_FILE)
+    except OSError: pass
+
+def _plan_wsol(wsol_raw, sol_lamports):
+    """(instrucciones para dejar el wSOL en el objetivo, True si cierran la cuenta). Vacío si ya está en rango."""
+    wsol = wsol_ata()
+    if wsol_raw is None:
+        monto = min(WSOL_OBJETIVO, max(0, sol_lamports - SOL_RESERVA))
+        return [ix_crear_ata(SOL_MINT)] + (ix_envolver(monto) if monto > 0 else []), False
+    if wsol_raw < WSOL_MIN:
+        monto = min(WSOL_OBJETIVO - wsol_raw, max(0, sol_lamports - SOL_RESERVA))
+        return (ix_envolver(monto) if monto > 0 else []), False
+    if wsol_raw > WSOL_MAX or (sol_lamports < SOL_RESERVA and wsol_raw > WSOL_OBJETIVO):
+        # el token program no desenvuelve parcialmente: cerrar y volver a crear con el objetivo
+        return [ix_cerrar(wsol), ix_crear_ata(SOL_MINT)] + ix_envolver(WSOL_OBJETIVO), True
+    return [], False
+
+def preparar(mints=()) -> dict:
+    """wSOL en rango + ATAs de 'mints' creadas. Devuelve {wsol: lamports|None, creadas: n, ok: bool}."""
+    owner = str(wallet_pubkey)
+    mints = [m for m in dict.fromkeys(str(m) for m in mints) if m and m != SOL_MINT and m not in _atas]
+    if mints:
+        balances.balances_raw(mints)              # programa (Token / Token-2022) de cada mint
+    atas = [balances.ata(m) for m in mints]
+    res = swap_exec.rpc("getMultipleAccounts", [atas + [wsol_ata()], {"encoding": "base64", "commitment": "confirmed"}],
+                        timeout=5.0)
+    vals = (res or {}).get("value") or [None] * (len(atas) + 1)
+    sol = int((swap_exec.rpc("getBalance", [owner, {"commitment": "confirmed"}]) or {}).get("value") or 0)
+
+    faltan = []
+    for m, acc in zip(mints, vals[:len(atas)]):
+        if acc:
+            _atas.add(m)
+        else:
+            faltan.append(m)
+    wsol_raw = balances.monto_raw(vals[-1]) if vals[-1] else None
+
+    ok = True
+    lotes = [faltan[i:i + ATAS_POR_TX] for i in range(0, len(faltan), ATAS_POR_TX)] or [[]]
+    for n, lote in enumerate(lotes):
+        ixs, cierra = _plan_wsol(wsol_raw, sol) if n == 0 else ([], False)
+        # cerrar el wSOL con un trade en curso rompería su swap: el lock se toma (atómico) hasta
+        # que la TX confirma; si ya lo tiene un trade, el rebalanceo queda para la próxima pasada
+        con_lock = cierra and _tomar_lock_trade()
+        if cierra and not con_lock:
+            emit("wallet_prep_rebalance_skip", reason="trade_lock", wsol=wsol_raw, sol=sol)
+            ixs = []
+        ixs += [ix_crear_ata(m, balances.programa(m)) for m in lote]
+        if not ixs:
+            continue
+        try:
+            if _enviar(ixs, f"[PREP] lote {n + 1}/{len(lotes)}"):
+                _atas.update(lote)
+            else:
+                ok = False
+        finally:
+            if con_lock:
+                _soltar_lock_trade()
+    with _lock:
+        _wsol["ts"] = 0.0                         # forzar relectura
+    emit("wallet_prep_done", mints=len(mints), creadas=len(faltan), wsol=wsol_raw, sol=sol, ok=ok)
+    return {"wsol": saldo_wsol(), "creadas": len(faltan), "ok": ok}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Preparación de la wallet: wSOL persistente + ATAs de VIPs")
+    ap.add_argument("mints", nargs="?", default="", help="Mints separados por coma")
+    args = ap.parse_args()
+    r = preparar([m.strip() for m in args.mints.split(",") if m.strip()])
+    print(f"wallet_prep: wsol={r['wsol']} creadas={r['creadas']} ok={r['ok']}")
+    sys.exit(0 if r["ok"] else 1)